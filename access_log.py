@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import streamlit as st
+import pandas as pd
+from datetime import datetime
+import os
+
+from cold_storage import with_archived_rows
+from tracing import traced
+from log_files import file_signature, append_csv_rows
+
+# ============================================
+# ステップ3: アクセスログ記録機能
+# ============================================
+
+def ensure_log_directory():
+    """ログディレクトリの作成"""
+    log_dir = "logs"
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    return log_dir
+
+def log_access(username, action, details="", display_name=None):
+    """アクセスログの記録"""
+    try:
+        log_dir = ensure_log_directory()
+        log_file = os.path.join(log_dir, "access_log.csv")
+        
+        log_entry = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "username": username,
+            "display_name": display_name or st.session_state.get("user_display_name", username),
+            "action": action,
+            "details": details
+        }
+        
+        append_csv_rows(log_file, ["timestamp", "username", "display_name", "action", "details"], [log_entry])
+            
+    except Exception as e:
+        print(f"ログ記録エラー: {e}")
+
+@traced()
+def get_access_logs(include_archived=False):
+    """アクセスログの取得（include_archived=Trueなら圧縮済みの過去分も含める）"""
+    log_file = os.path.join("logs", "access_log.csv")
+    
+    try:
+        df = pd.read_csv(log_file) if os.path.exists(log_file) else None
+        if include_archived:
+            df = with_archived_rows("access_log.csv", df)
+        return df
+    except Exception as e:
+        st.error(f"ログファイルの読み込みに失敗しました: {e}")
+        return None
+
+def get_log_signature(log_file=os.path.join("logs", "access_log.csv")):
+    """ログファイルの更新検知用キー（更新時刻とサイズ）"""
+    return file_signature(log_file)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import re
+
+import pandas as pd
+
+from result_parser import table_to_dataframe
+
+# ============================================
+# 日本語金額・割合・範囲の数値化
+# ============================================
+
+# 「CPM 500円」「6-10円」「1,200万円」「3.5億」「3億5000万円」「15%」「+300-500万円」に一致
+# 金額は「3億5000万」「5千万」のように倍率つきの項を並べた複合表記も受け付ける（2項目以降は *_rest）
+_NUMBER = r'\d[\d,]*(?:\.\d+)?'
+_MULT = r'千?[億万]|千'
+_REST = rf'(?:\s*{_NUMBER}\s*(?:{_MULT}))*(?:\s*{_NUMBER})?'
+_UNIT = r'円|%|％|倍|本|回|名|人'
+_AMOUNT_REGEX = (
+    r'^\s*(?:約|~|〜|～)?\s*(?:[A-Za-z/]+\s*)?'
+    rf'(?P<sign>[+-])?(?P<low>{_NUMBER})\s*(?:(?P<low_mult>{_MULT})(?P<low_rest>{_REST}))?\s*(?P<low_unit>{_UNIT})?'
+    rf'(?:\s*[-~〜～]\s*(?P<high>{_NUMBER})\s*(?:(?P<high_mult>{_MULT})(?P<high_rest>{_REST}))?\s*(?P<high_unit>{_UNIT})?)?'
+    r'\s*\+?\s*$'
+)
+
+# 複合表記の1項（「5000万」「5千万」「200」）
+_TERM_PATTERN = rf'(?P<number>{_NUMBER})\s*(?P<mult>{_MULT})?'
+
+# 見出しの単位「配分額(万円)」
+_HEADER_UNIT_PATTERN = re.compile(r'[（(]\s*(億|万|千)?\s*(円|%|％|倍|本|回|名|人)\s*[)）]')
+
+MULTIPLIERS = {"億": 1e8, "万": 1e4, "千": 1e3, "千億": 1e11, "千万": 1e7}
+
+# 単位がなくても金額（円）とみなす倍率
+_YEN_MULTIPLIERS = ["億", "万", "千億", "千万"]
+
+# 表記ゆれの統一
+_UNIT_ALIASES = {"％": "%", "人": "名"}
+
+# 列を数値列とみなす数値セルの割合
+MIN_NUMERIC_RATIO = 0.6
+
+
+def parse_header_unit(header):
+    """列見出しから (倍率, 単位) を取得"""
+    match = _HEADER_UNIT_PATTERN.search(str(header))
+    if not match:
+        return 1.0, ""
+    multiplier = MULTIPLIERS.get(match.group(1), 1.0)
+    return multiplier, _UNIT_ALIASES.get(match.group(2), match.group(2))
+
+
+def normalize_values(values, header_multipliers=None, header_units=None):
+    """文字列のSeriesを一括で (min, max, point, unit) のDataFrameに変換
+
+    金額は円、件数は個数、割合は%の数値で返す。数値化できないセルはNaN。
+    header_multipliers / header_units: セルに単位がない場合の既定値（valuesと同じindexのSeries）
+    """
+    # 全角の数字・記号（「１２万円」「１５％」）は半角にそろえてから抽出
+    parts = values.astype("string").str.normalize("NFKC").str.extract(_AMOUNT_REGEX)
+
+    low, low_last_mult = _side_amounts(parts, "low")
+    high, high_last_mult = _side_amounts(parts, "high")
+    low_has_mult = parts["low_mult"].notna()
+    high_has_mult = parts["high_mult"].notna()
+
+    # 「10-15万円」のように片側だけの倍率はもう片側にも適用（複合表記なら末尾の項の倍率）
+    low = low * high_last_mult.where(~low_has_mult).fillna(1.0)
+    high = high * low_last_mult.where(~high_has_mult).fillna(1.0)
+
+    unit = parts["high_unit"].fillna(parts["low_unit"]).replace(_UNIT_ALIASES)
+
+    # セルに単位も倍率もなければ見出しの単位を使う
+    if header_multipliers is not None:
+        no_mult = ~(low_has_mult | high_has_mult)
+        header_mult = header_multipliers.where(unit.isna() & no_mult).fillna(1.0)
+        low = low * header_mult
+        high = high * header_mult
+    if header_units is not None:
+        unit = unit.fillna(header_units.replace("", pd.NA))
+
+    # 「3.5億」のように単位のない億・万の金額は円
+    large_amount = parts["low_mult"].isin(_YEN_MULTIPLIERS) | parts["high_mult"].isin(_YEN_MULTIPLIERS)
+    unit = unit.mask(unit.isna() & large_amount, "円")
+
+    sign = parts["sign"].map({"-": -1.0}).fillna(1.0)
+    value_min = low * sign
+    value_max = high.fillna(value_min)
+
+    # 数値化できなかったセルには単位も付けない
+    unit = unit.where(value_min.notna())
+
+    return pd.DataFrame({
+        "min": value_min,
+        "max": value_max,
+        "point": (value_min + value_max) / 2,
+        "unit": unit.fillna(""),
+    })
+
+
+def _side_amounts(parts, side):
+    """範囲の片側（"low" / "high"）の金額（倍率を掛けた値）と末尾の項の倍率"""
+    head_mult = parts[f"{side}_mult"].map(MULTIPLIERS).astype("float64")
+    amounts = pd.to_numeric(parts[side].str.replace(",", "", regex=False), errors="coerce") * head_mult.fillna(1.0)
+    last_mult = head_mult
+
+    # 複合表記（「3億5000万」の「5000万」以降）は該当するセルだけ項に分けて足す
+    rest = parts[f"{side}_rest"]
+    compound = (rest.str.strip() != "").fillna(False).astype(bool)
+    if compound.any():
+        amounts = amounts.mask(compound, amounts + _sum_terms(rest[compound]).reindex(amounts.index))
+        rest_mult = rest[compound].str.extract(rf'({_MULT})\s*$')[0].map(MULTIPLIERS).astype("float64")
+        last_mult = last_mult.mask(compound, rest_mult.reindex(last_mult.index))
+    return amounts, last_mult
+
+
+def _sum_terms(amounts):
+    """「5000万」「2千万」のような項を並べた文字列の各項を倍率つきで合計"""
+    positional = amounts.reset_index(drop=True)
+    terms = positional.str.extractall(_TERM_PATTERN)
+    term_values = pd.to_numeric(terms["number"].str.replace(",", "", regex=False), errors="coerce")
+    term_values = term_values * terms["mult"].map(MULTIPLIERS).astype("float64").fillna(1.0)
+    totals = term_values.groupby(level=0).sum(min_count=1).reindex(positional.index)
+    return pd.Series(totals.to_numpy(dtype="float64"), index=amounts.index)
+
+
+def normalize_table(df):
+    """表DataFrameの数値列に _min/_max/_point/_unit 列を追加（全セルを1回で変換）"""
+    if df is None or df.empty:
+        return df
+
+    # 列番号で積み上げ（列名の重複に対応）
+    stacked = df.set_axis(range(df.shape[1]), axis=1).stack()
+    column_positions = stacked.index.get_level_values(1)
+
+    header_units = [parse_header_unit(header) for header in df.columns]
+    header_multipliers = pd.Series([header_units[pos][0] for pos in column_positions], index=stacked.index)
+    header_unit_names = pd.Series([header_units[pos][1] for pos in column_positions], index=stacked.index)
+
+    normalized = normalize_values(stacked, header_multipliers, header_unit_names)
+
+    typed = df.copy()
+    for position, column in enumerate(df.columns):
+        column_values = normalized.xs(position, level=1)
+        non_empty = (df.iloc[:, position].astype("string").str.strip() != "").sum()
+        if non_empty == 0 or column_values["min"].notna().sum() / non_empty < MIN_NUMERIC_RATIO:
+            continue
+
+        typed[f"{column}_min"] = column_values["min"].to_numpy()
+        typed[f"{column}_max"] = column_values["max"].to_numpy()
+        typed[f"{column}_point"] = column_values["point"].to_numpy()
+        units = column_values["unit"][column_values["unit"] != ""]
+        typed[f"{column}_unit"] = units.mode().iloc[0] if not units.empty else ""
+
+    return typed
+
+
+def normalize_metrics(metrics):
+    """extract_metrics_from_textの結果（"50000万円"等）を数値の辞書に変換"""
+    if not metrics:
+        return {}
+    normalized = normalize_values(pd.Series(metrics))
+    return {name: (None if pd.isna(value) else float(value)) for name, value in normalized["point"].items()}
+
+
+# ============================================
+# 3パターンの比較
+# ============================================
+
+def build_pattern_comparison(section, total_marketing_budget=None):
+    """配分案セクションから、パターン別の数値サマリーと施策別配分額を作成"""
+    summary_rows = []
+    allocation_frames = []
+    pattern_name = section["title"]
+    pending = {}
+
+    def flush():
+        if pending:
+            summary_rows.append({"パターン": pattern_name, **pending})
+
+    for block in section["blocks"]:
+        if block["type"] == "heading":
+            flush()
+            pattern_name = block["text"].split(":")[0].split("：")[0].strip()
+            pending = {}
+
+        elif block["type"] == "table":
+            typed = normalize_table(table_to_dataframe(block))
+            if typed is None:
+                continue
+            amount_columns = [c for c in typed.columns if "配分額" in str(c) and str(c).endswith("_point")]
+            if not amount_columns:
+                continue
+            allocation = pd.DataFrame({
+                "パターン": pattern_name,
+                "施策": typed.iloc[:, 0].to_numpy(),
+                "配分額(万円)": (typed[amount_columns[0]] / MULTIPLIERS["万"]).to_numpy(),
+            })
+            allocation_frames.append(allocation)
+            pending["配分合計(万円)"] = allocation["配分額(万円)"].sum()
+
+        elif block["type"] == "metrics":
+            values = normalize_metrics(block["values"])
+            if values.get("総予算") is not None:
+                pending["総予算(万円)"] = values["総予算"] / MULTIPLIERS["万"]
+            if values.get("期待販売本数") is not None:
+                pending["期待販売本数"] = values["期待販売本数"]
+            if values.get("想定ROI") is not None:
+                pending["想定ROI(%)"] = values["想定ROI"]
+
+    flush()
+
+    summary = pd.DataFrame(summary_rows)
+    if not summary.empty and "配分合計(万円)" in summary:
+        reference_budget = summary["総予算(万円)"] if "総予算(万円)" in summary else pd.Series(dtype="float64")
+        if total_marketing_budget:
+            reference_budget = reference_budget.reindex(summary.index).fillna(total_marketing_budget)
+        summary["予算との差異(%)"] = ((summary["配分合計(万円)"] / reference_budget - 1) * 100).round(1)
+
+    allocations = pd.concat(allocation_frames, ignore_index=True) if allocation_frames else pd.DataFrame()
+    return summary, allocations
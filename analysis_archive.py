@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import json
+import lzma
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+
+# ============================================
+# 過去の分析結果のアーカイブと全文検索（SQLite FTS5）
+# ============================================
+#
+# 分析結果は解析済みの木（parse_result_tree の戻り値）ごと保存し、開くときは再解析もAPI呼び出しもしない。
+# 日本語は単語の区切りがないため、FTS5のtrigramトークナイザ（部分一致）で索引を作る。
+# trigramは3文字以上の語だけを検索できるので、2文字以下の語は部分一致（LIKE）で絞り込む。
+#
+# 古い結果は解析結果・入力をlzmaで圧縮したファイル（COLD_CHUNK_SIZE件ずつ）に移し、
+# データベースには本文（全文検索の索引の元）と圧縮ファイルの場所だけを残す（開くときに透過的に展開）。
+# 索引は analyses を元にした外部コンテンツ形式なので、索引に入っている列（本文を含む）は消さない。
+
+ARCHIVE_FILE = os.path.join("data", "analyses.sqlite")
+COLD_DIR = os.path.join("data", "archive")
+
+# 1つの圧縮ファイルにまとめる件数
+COLD_CHUNK_SIZE = 100
+
+# 検索対象の列とbm25の重み（プロジェクト名・ジャンルの一致を本文より上位にする）
+SEARCH_COLUMNS = ["project_name", "genre", "tactics", "text"]
+SEARCH_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+
+DEFAULT_SEARCH_LIMIT = 20
+
+# 抜粋の前後のトークン数
+SNIPPET_TOKENS = 16
+
+# 検索語の「3億」「5,000万円」は予算の条件にする（総予算の±BUDGET_TOLERANCE）
+_BUDGET_PATTERN = re.compile(r'(?P<value>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>億|万)円?')
+BUDGET_TOLERANCE = 0.1
+
+TRIGRAM_MIN_LENGTH = 3
+
+
+@contextmanager
+def _connect(archive_file=ARCHIVE_FILE):
+    """接続を開き、正常終了ならコミットして閉じる"""
+    os.makedirs(os.path.dirname(archive_file), exist_ok=True)
+    connection = sqlite3.connect(archive_file, timeout=10)
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        _ensure_schema(connection)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def _ensure_schema(connection):
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS analyses (
+            id INTEGER PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            username TEXT,
+            project_name TEXT,
+            genre TEXT,
+            budget INTEGER,
+            tactics TEXT,
+            text TEXT,
+            text_hash TEXT UNIQUE,
+            tier TEXT,
+            model TEXT,
+            section_ids TEXT,
+            inputs TEXT,
+            tree TEXT,
+            cold_file TEXT
+        )
+    """)
+    # 圧縮機能の追加前に作られたデータベースに列を追加
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(analyses)")]
+    if "cold_file" not in columns:
+        connection.execute("ALTER TABLE analyses ADD COLUMN cold_file TEXT")
+    columns = ", ".join(SEARCH_COLUMNS)
+    try:
+        connection.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5("
+            f"{columns}, content='analyses', content_rowid='id', tokenize='trigram')"
+        )
+    except sqlite3.OperationalError:
+        # trigramがない古いSQLite（3.34未満）では既定のトークナイザを使う
+        connection.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5("
+            f"{columns}, content='analyses', content_rowid='id')"
+        )
+    if connection.execute("PRAGMA user_version").fetchone()[0] < 1:
+        _restore_cold_text(connection)
+        connection.execute("PRAGMA user_version = 1")
+
+
+def _restore_cold_text(connection):
+    """本文まで圧縮ファイルに移していた以前の形式のデータベースに本文を戻し、索引を作り直す"""
+    rows = connection.execute("SELECT id, cold_file FROM analyses WHERE cold_file IS NOT NULL AND text IS NULL").fetchall()
+    if not rows:
+        return
+    with connection:
+        for row in rows:
+            try:
+                record = _read_cold_record(row["cold_file"], row["id"])
+            except (OSError, KeyError) as e:
+                print(f"分析結果の本文の復元エラー: {e}")
+                continue
+            connection.execute("UPDATE analyses SET text = ? WHERE id = ?", (record["text"], row["id"]))
+        connection.execute("INSERT INTO analyses_fts (analyses_fts) VALUES ('rebuild')")
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def archive_analysis(analysis, username, archive_file=ARCHIVE_FILE):
+    """分析結果（text・tree・inputs・section_ids・tier・model）を保存して索引に追加
+
+    同じ本文の結果は1件だけ保存する。戻り値は保存した（または既存の）ID。
+    """
+    inputs = analysis["inputs"]
+    text = analysis["text"]
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    row = {
+        "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "username": username,
+        "project_name": inputs.get("project_name", ""),
+        "genre": inputs.get("project_genre", ""),
+        "budget": inputs.get("total_marketing_budget"),
+        "tactics": "\n".join(inputs.get("selected_tactics", [])),
+        "text": text,
+        "text_hash": text_hash,
+        "tier": analysis.get("tier"),
+        "model": analysis.get("model"),
+        "section_ids": json.dumps(analysis.get("section_ids", [])),
+        "inputs": json.dumps(inputs, ensure_ascii=False, default=_json_default),
+        "tree": json.dumps(analysis["tree"], ensure_ascii=False),
+    }
+
+    with _connect(archive_file) as connection:
+        existing = connection.execute("SELECT id FROM analyses WHERE text_hash = ?", (text_hash,)).fetchone()
+        if existing is not None:
+            return existing["id"]
+
+        cursor = connection.execute(
+            f"INSERT INTO analyses ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+            list(row.values())
+        )
+        connection.execute(
+            f"INSERT INTO analyses_fts (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+            [cursor.lastrowid] + [row[column] for column in SEARCH_COLUMNS]
+        )
+        return cursor.lastrowid
+
+
+def load_analysis(analysis_id, archive_file=ARCHIVE_FILE):
+    """保存した分析結果を session_state["analysis_result"] と同じ形で返す（なければNone）"""
+    with _connect(archive_file) as connection:
+        row = connection.execute("SELECT * FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+    if row is None:
+        return None
+
+    if row["cold_file"]:
+        stored = _read_cold_record(row["cold_file"], row["id"])
+    else:
+        stored = {"tree": json.loads(row["tree"]), "inputs": json.loads(row["inputs"])}
+
+    inputs = stored["inputs"]
+    if inputs.get("launch_date"):
+        inputs["launch_date"] = datetime.date.fromisoformat(inputs["launch_date"])
+    return {
+        "text": row["text"],
+        "tree": stored["tree"],
+        "inputs": inputs,
+        "section_ids": json.loads(row["section_ids"]),
+        "tier": row["tier"],
+        "model": row["model"],
+        "archive_id": row["id"],
+    }
+
+
+def parse_search_query(query):
+    """検索語を (全文検索の語, 部分一致の語, 予算(万円)) に分ける"""
+    budget = None
+    match = _BUDGET_PATTERN.search(query or "")
+    if match:
+        value = float(match.group("value").replace(",", ""))
+        budget = value * 10_000 if match.group("unit") == "億" else value
+        query = query[:match.start()] + " " + query[match.end():]
+
+    terms = [term for term in re.split(r'[\s　]+', query or "") if term]
+    fts_terms = [term for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+    like_terms = [term for term in terms if len(term) < TRIGRAM_MIN_LENGTH]
+    return fts_terms, like_terms, budget
+
+
+def search_analyses(query, limit=DEFAULT_SEARCH_LIMIT, archive_file=ARCHIVE_FILE):
+    """検索語に一致する分析結果を関連度順に返す（検索語が空なら新しい順）
+
+    戻り値の列: id, 作成日時, プロジェクト, ジャンル, 予算(万円), 作成者, 抜粋
+    """
+    fts_terms, like_terms, budget = parse_search_query(query)
+
+    conditions, params = [], []
+    for term in like_terms:
+        conditions.append("(" + " OR ".join(f"a.{column} LIKE ?" for column in SEARCH_COLUMNS) + ")")
+        params += [f"%{term}%"] * len(SEARCH_COLUMNS)
+    if budget is not None:
+        conditions.append("a.budget BETWEEN ? AND ?")
+        params += [budget * (1 - BUDGET_TOLERANCE), budget * (1 + BUDGET_TOLERANCE)]
+
+    columns = "a.id, a.created_at, a.project_name, a.genre, a.budget, a.username"
+    if fts_terms:
+        # 各語をフレーズとして扱う（FTS5の演算子や記号をそのまま検索できるように）
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in fts_terms)
+        sql = (
+            f"SELECT {columns}, snippet(analyses_fts, 3, '【', '】', '…', {SNIPPET_TOKENS}) AS excerpt "
+            f"FROM analyses_fts JOIN analyses a ON a.id = analyses_fts.rowid "
+            f"WHERE analyses_fts MATCH ?"
+            + "".join(f" AND {condition}" for condition in conditions)
+            + f" ORDER BY bm25(analyses_fts, {', '.join(map(str, SEARCH_WEIGHTS))}) LIMIT ?"
+        )
+        params = [match] + params + [limit]
+    else:
+        sql = (
+            f"SELECT {columns}, substr(a.text, 1, 120) AS excerpt FROM analyses a"
+            + (" WHERE " + " AND ".join(conditions) if conditions else "")
+            + " ORDER BY a.id DESC LIMIT ?"
+        )
+        params = params + [limit]
+
+    with _connect(archive_file) as connection:
+        rows = connection.execute(sql, params).fetchall()
+
+    return pd.DataFrame(
+        [tuple(row) for row in rows],
+        columns=["id", "作成日時", "プロジェクト", "ジャンル", "予算(万円)", "作成者", "抜粋"]
+    )
+
+
+
+# ============================================
+# 古い結果の圧縮（コールド層）
+# ============================================
+
+def _read_cold_record(cold_file, analysis_id):
+    """圧縮ファイル（1行1件のJSON: id・tree・inputs）から1件を取り出す"""
+    with lzma.open(os.path.join(COLD_DIR, cold_file), "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["id"] == analysis_id:
+                return record
+    raise KeyError(f"圧縮ファイル {cold_file} に分析結果 #{analysis_id} がありません")
+
+
+def archive_cold_analyses(cutoff, archive_file=ARCHIVE_FILE):
+    """cutoffより前に保存した結果の解析結果・入力を圧縮ファイルに移し、移した件数を返す
+
+    本文と全文検索の索引はそのまま残るので、圧縮後も抜粋つきで検索できる。
+    """
+    if not os.path.exists(archive_file):
+        return 0
+
+    moved = 0
+    with _connect(archive_file) as connection:
+        rows = connection.execute(
+            "SELECT id, tree, inputs FROM analyses WHERE cold_file IS NULL AND created_at < ? ORDER BY id",
+            (cutoff.strftime("%Y-%m-%d %H:%M:%S"),)
+        ).fetchall()
+
+        os.makedirs(COLD_DIR, exist_ok=True)
+        for start in range(0, len(rows), COLD_CHUNK_SIZE):
+            chunk = rows[start:start + COLD_CHUNK_SIZE]
+            cold_file = f"analyses-{chunk[0]['id']}-{chunk[-1]['id']}.jsonl.xz"
+            with lzma.open(os.path.join(COLD_DIR, cold_file), "wt", encoding="utf-8") as f:
+                for row in chunk:
+                    f.write(json.dumps({
+                        "id": row["id"],
+                        "tree": json.loads(row["tree"]),
+                        "inputs": json.loads(row["inputs"]),
+                    }, ensure_ascii=False) + "\n")
+            connection.executemany(
+                "UPDATE analyses SET tree = NULL, inputs = NULL, cold_file = ? WHERE id = ?",
+                [(cold_file, row["id"]) for row in chunk]
+            )
+            moved += len(chunk)
+
+    if moved:
+        # 空いた領域をファイルから解放
+        connection = sqlite3.connect(archive_file, timeout=10)
+        try:
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+    return moved
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""分析結果パーサーのスケーリング計測
+
+実行方法（リポジトリ直下で）:
+    python -m benchmarks.bench_result_parser
+"""
+import sys
+import time
+
+from result_parser import parse_result_tree
+from benchmarks.fixtures import make_synthetic_result
+
+# 計測する出力サイズ（KB）
+SIZES_KB = [16, 64, 256, 1024, 4096]
+
+# 1KBあたりの処理時間が最小サイズの何倍まで許容するか（線形性の判定）
+LINEARITY_TOLERANCE = 3.0
+
+
+def time_parse(text, repeat=3):
+    """最速の実行時間（秒）"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse_result_tree(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    results = []
+    for size_kb in SIZES_KB:
+        text = make_synthetic_result(size_kb)
+        actual_kb = len(text.encode("utf-8")) / 1024
+        elapsed = time_parse(text)
+        results.append((actual_kb, elapsed))
+
+    base_per_kb = results[0][1] / results[0][0]
+    print(f"{'サイズ(KB)':>12} {'時間(ms)':>10} {'ms/KB':>8} {'比率':>6}")
+    worst_ratio = 0.0
+    for actual_kb, elapsed in results:
+        per_kb = elapsed / actual_kb
+        ratio = per_kb / base_per_kb
+        worst_ratio = max(worst_ratio, ratio)
+        print(f"{actual_kb:>12.0f} {elapsed * 1000:>10.1f} {per_kb * 1000:>8.3f} {ratio:>6.2f}")
+
+    if worst_ratio > LINEARITY_TOLERANCE:
+        print(f"線形性の判定に失敗: 1KBあたりの時間が最大 {worst_ratio:.2f} 倍に増加")
+        return 1
+
+    print("線形時間で処理できています")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""ベンチマーク用の合成データ"""
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from access_log import ensure_log_directory
+from analysis_archive import archive_analysis
+from result_parser import parse_result_tree
+
+_TABLE_HEADER = "| 施策 | 詳細 | 配分額(万円) | 構成比 | 期待リーチ | CPV/CPM | 配分理由 |"
+_TABLE_SEPARATOR = "|------|------|-------------|--------|-----------|---------|----------|"
+
+_LOG_ACTIONS = ["login", "login_failed", "analysis_executed", "logout"]
+
+
+def make_table(rows):
+    """指定行数のマークダウン表（空セルを含む）"""
+    lines = [_TABLE_HEADER, _TABLE_SEPARATOR]
+    for row in range(rows):
+        detail = "" if row % 7 == 0 else f"{row}万人級×{row % 5 + 1}名"
+        lines.append(f"| VTuber{row} | {detail} | {row * 10:,} | {row % 40}% | {row * 1000:,} | {row % 10 + 1}円 | 参考データ |")
+    return "\n".join(lines)
+
+
+def make_synthetic_result(target_kb, rows_per_table=40):
+    """実際の出力形式を模した、指定サイズ（KB）以上の分析結果"""
+    table = make_table(rows_per_table)
+
+    chunks = []
+    size = 0
+    section_no = 0
+    while size < target_kb * 1024:
+        section_no += 1
+        lines = [f"## {section_no}. マーケティング予算配分案（3パターン）", ""]
+        for pattern in "ABC":
+            lines += [
+                f"### パターン{pattern}: 認知拡大重視プラン",
+                table,
+                "",
+                f"**総計**: {section_no * 1000:,}万円",
+                "**期待総視聴数**: 1,000,000回",
+                f"**期待販売本数**: {section_no * 100:,}本（CVR 0.5-2%で計算）",
+                "**想定ROI**: 150%",
+                "",
+                "配分理由の説明文。参考データの範囲内でCPVを算出しています。",
+                "",
+            ]
+        chunk = "\n".join(lines)
+        chunks.append(chunk)
+        size += len(chunk.encode("utf-8"))
+
+    return "\n".join(chunks)
+
+
+def make_reference_text(groups):
+    """参考データ欄の箇条書き（フォロワー規模別の行をgroups×4行）"""
+    lines = ["【過去実績データ（Switch向けゲーム）】", ""]
+    for group in range(groups):
+        lines.append(f"■ フォロワー規模別の実績（グループ{group}）:")
+        for tier in (7, 10, 25, 47):
+            lines.append(f"- {tier}万人級: コスト {tier}-{tier * 2}万円、CPV 0.9-10円、7日視聴 5,600-{tier * 1000:,}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def make_roster(creators, seed=0):
+    """配信者リスト（実績ファイルと同じ列名）"""
+    rng = np.random.default_rng(seed)
+    followers = rng.integers(10_000, 2_000_000, size=creators)
+    return pd.DataFrame({
+        "配信者": [f"配信者{i}" for i in range(creators)],
+        "プラットフォーム": np.array(["YouTube", "Twitch"])[rng.integers(0, 2, size=creators)],
+        "フォロワー数": followers.astype(str),
+        "コスト": (followers // 10 + rng.integers(10_000, 500_000, size=creators)).astype(str),
+        "7日視聴": (followers // 8 + rng.integers(0, 20_000, size=creators)).astype(str),
+        "CTR": rng.uniform(0.1, 0.5, size=creators).round(2).astype(str),
+    })
+
+
+def make_portfolio(titles, seed=0):
+    """ポートフォリオ最適化のタイトル表（参考データ列つき）"""
+    rng = np.random.default_rng(seed)
+    markets = np.array(["日本のみ", "日本+アジア", "グローバル"])
+    return pd.DataFrame({
+        "タイトル": [f"タイトル{i}" for i in range(titles)],
+        "ジャンル": "アクション",
+        "ターゲット市場": markets[rng.integers(0, 3, size=titles)],
+        "販売単価(円)": rng.integers(20, 80, size=titles) * 100,
+        "購入率(%)": rng.uniform(0.5, 2.0, size=titles).round(2),
+        "最低予算(万円)": 100.0,
+        "最大予算(万円)": np.nan,
+        "VTuber参考データ": make_reference_text(1),
+        "その他参考データ": "- YouTube広告: CPM 500-1,000円\n- Steam広告: CPM 800-1,500円",
+    })
+
+
+def write_analysis_archive(analyses, seed=0):
+    """data/analyses.sqlite に指定件数の分析結果を保存する（カレントディレクトリ基準）"""
+    rng = np.random.default_rng(seed)
+    genres = ["サバイバル/クラフティング", "RPG", "アクション", "パズル", "シミュレーション"]
+    for index in range(analyses):
+        text = make_synthetic_result(4) + f"\n<!-- {index} -->"
+        archive_analysis({
+            "text": text,
+            "tree": parse_result_tree(text),
+            "inputs": {
+                "project_name": f"プロジェクト{index}",
+                "project_genre": genres[index % len(genres)],
+                "launch_date": datetime.date(2025, 1, 1),
+                "total_marketing_budget": int(rng.choice([10_000, 30_000, 50_000])),
+                "selected_tactics": ["VTuberマーケティング: 大手5-10名", "デジタル広告: YouTube、Steam広告"],
+            },
+            "section_ids": [1, 2],
+            "tier": "full",
+            "model": "benchmark",
+        }, "benchmark")
+
+
+def write_access_log(rows, seed=0):
+    """logs/access_log.csv に指定行数のログを書き出す（カレントディレクトリ基準）"""
+    rng = np.random.default_rng(seed)
+    log_file = os.path.join(ensure_log_directory(), "access_log.csv")
+
+    # 大きなログでもメモリに載せすぎないよう分割して書き込む
+    chunk_size = 1_000_000
+    start = pd.Timestamp("2024-01-01")
+    written = 0
+    with open(log_file, "w", newline="", encoding="utf-8") as f:
+        while written < rows:
+            n = min(chunk_size, rows - written)
+            offsets = pd.to_timedelta(np.arange(written, written + n) * 10, unit="s")
+            user_ids = rng.integers(0, 50, size=n)
+            chunk = pd.DataFrame({
+                "timestamp": (start + offsets).strftime("%Y-%m-%d %H:%M:%S"),
+                "username": [f"user{i}" for i in user_ids],
+                "display_name": [f"ユーザー{i}" for i in user_ids],
+                "action": np.array(_LOG_ACTIONS)[rng.integers(0, len(_LOG_ACTIONS), size=n)],
+                "details": "プロジェクト: benchmark, 予算: 50000万円",
+            })
+            chunk.to_csv(f, index=False, header=(written == 0))
+            written += n
+
+    return log_file
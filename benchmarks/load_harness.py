@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""同時セッション数に対する負荷試験
+
+N個のセッションをそれぞれ別プロセスのAppTestで同時に実行し、ログイン・フォーム編集・分析実行・
+管理者ログ表示の各フェーズを計測する（AppTestはスレッドセーフではないため、1プロセスに1セッション）。
+LLMはモックトランスポートを使うため、APIキーやネットワークは不要。
+いずれかのセッションでエラーが起きると終了コード1で終わる。
+
+実行方法（リポジトリ直下で）:
+    python -m benchmarks.load_harness --sessions 1 2 4 8 16 --iterations 2
+    python -m benchmarks.load_harness --sessions 4 8 --output load_result.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "marketing_budget_optimizer_v2_step3_clean.py")
+
+PHASES = ["initial_load", "login", "form_edit", "analysis", "admin_logs"]
+
+LOAD_PASSWORD = "load-test"
+
+# スクリプト1回の実行の上限（モックの応答時間を含む）
+SCRIPT_TIMEOUT = 300
+
+# 全セッションのプロセスが起動し終えるまでの待ち時間の上限（streamlitの読み込みを含む）
+START_TIMEOUT = 300
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def current_rss_mb():
+    """現在の常駐メモリ（MB）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        # /procがない環境ではピーク値で代用（macOSはバイト単位）
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class RssSampler:
+    """計測中のピークRSSを一定間隔で記録"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_mb = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _by_label(widgets, label):
+    return next(w for w in widgets if w.label == label)
+
+
+def write_load_secrets(session_count):
+    """負荷試験用ユーザーを .streamlit/secrets.toml に書き出す（カレントディレクトリ基準）
+
+    セッションごとのプロセスはカレントディレクトリを引き継ぐので、ファイルで全セッションに渡す。
+    """
+    lines = ["[users.admin]", f'password = "{LOAD_PASSWORD}"', 'display_name = "管理者"', ""]
+    for i in range(session_count):
+        lines += [f"[users.load{i}]", f'password = "{LOAD_PASSWORD}"', f'display_name = "負荷試験{i}"', ""]
+
+    os.makedirs(".streamlit", exist_ok=True)
+    with open(os.path.join(".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def run_session(session_id, iterations, admin_every, start_barrier):
+    """1セッション分のシナリオを実行（セッションごとのプロセスで呼ばれる）
+
+    戻り値: フェーズごとの所要時間・失敗数・最初のエラー内容、計測区間の開始・終了時刻、ピークRSS
+    """
+    from streamlit.testing.v1 import AppTest
+
+    timings = {phase: [] for phase in PHASES}
+    errors = {phase: 0 for phase in PHASES}
+    messages = []
+    is_admin = admin_every > 0 and session_id % admin_every == 0
+    username = "admin" if is_admin else f"load{session_id}"
+
+    def timed(phase, action):
+        started = time.perf_counter()
+        try:
+            action()
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            timings[phase].append(time.perf_counter() - started)
+            return True
+        except Exception as e:
+            errors[phase] += 1
+            messages.append(f"{phase}: {type(e).__name__}: {e}")
+            return False
+
+    at = AppTest.from_file(APP_PATH, default_timeout=SCRIPT_TIMEOUT)
+
+    def login():
+        at.text_input(key="username_input").input(username)
+        at.text_input(key="password_input").input(LOAD_PASSWORD)
+        at.button[0].click().run()
+        # ログイン後の画面が出ていなければ以降のフェーズの計測は意味がないので失敗にする
+        if not any(s.value.startswith("ログイン中") for s in at.success):
+            raise RuntimeError("ログイン後の画面が表示されませんでした")
+
+    def scenario():
+        if not timed("initial_load", at.run) or not timed("login", login):
+            return
+
+        for iteration in range(iterations):
+            def edit_form():
+                _by_label(at.number_input, "総マーケティング予算(万円)").set_value(50000 + (session_id + iteration) * 1000).run()
+                _by_label(at.text_area, "その他の考慮事項").input(f"負荷試験 {session_id}-{iteration}").run()
+
+            def run_analysis():
+                _by_label(at.button, "予算最適化を実行").click().run()
+                if not any(s.value == "最適化完了" for s in at.success):
+                    raise RuntimeError("分析が完了しませんでした")
+
+            timed("form_edit", edit_form)
+            timed("analysis", run_analysis)
+
+            if is_admin:
+                timed("admin_logs", lambda: _by_label(at.button, "ログを表示").click().run())
+
+    # 全セッションの起動（streamlitの読み込み）を待ってから同時に始める
+    start_barrier.wait(START_TIMEOUT)
+    with RssSampler() as sampler:
+        started = time.time()
+        scenario()
+        finished = time.time()
+
+    return {
+        "timings": timings,
+        "errors": errors,
+        "messages": messages,
+        "started": started,
+        "finished": finished,
+        "peak_rss_mb": sampler.peak_mb,
+    }
+
+
+def run_level(session_count, iterations, admin_every):
+    """同時セッション数1段階分を実行して集計"""
+    write_load_secrets(session_count)
+    context = multiprocessing.get_context("spawn")
+    outcomes = []
+    crashed = []
+    with context.Manager() as manager:
+        start_barrier = manager.Barrier(session_count)
+        with ProcessPoolExecutor(max_workers=session_count, mp_context=context) as pool:
+            futures = [pool.submit(run_session, i, iterations, admin_every, start_barrier) for i in range(session_count)]
+            for session_id, future in enumerate(futures):
+                try:
+                    outcomes.append(future.result())
+                except Exception as e:
+                    # プロセスの異常終了・起動待ちのタイムアウトなど
+                    crashed.append(f"session {session_id}: {type(e).__name__}: {e}")
+
+    elapsed = (max(o["finished"] for o in outcomes) - min(o["started"] for o in outcomes)) if outcomes else 0.0
+
+    summary = {
+        "sessions": session_count,
+        "elapsed_s": round(elapsed, 2),
+        # セッションごとのプロセスのピークRSSの合計（プロセスごとのインタープリター分を含む）
+        "peak_rss_mb": round(sum(o["peak_rss_mb"] for o in outcomes), 1),
+        "phases": {},
+        "crashed_sessions": len(crashed),
+        "error_messages": crashed + [message for o in outcomes for message in o["messages"]],
+    }
+    completed_analyses = 0
+    for phase in PHASES:
+        values = [t for o in outcomes for t in o["timings"][phase]]
+        failed = sum(o["errors"][phase] for o in outcomes)
+        if phase == "analysis":
+            completed_analyses = len(values)
+        if not values and not failed:
+            continue
+        summary["phases"][phase] = {
+            "count": len(values),
+            "errors": failed,
+            "p50_ms": round(_percentile(values, 50) * 1000, 1) if values else None,
+            "p95_ms": round(_percentile(values, 95) * 1000, 1) if values else None,
+            "p99_ms": round(_percentile(values, 99) * 1000, 1) if values else None,
+            "mean_ms": round(statistics.mean(values) * 1000, 1) if values else None,
+        }
+    summary["analyses_per_min"] = round(completed_analyses / elapsed * 60, 2) if elapsed else 0.0
+    return summary
+
+
+def print_level(summary):
+    print(f"\n=== 同時セッション {summary['sessions']} "
+          f"（{summary['elapsed_s']}秒, ピークRSS {summary['peak_rss_mb']}MB, "
+          f"分析スループット {summary['analyses_per_min']}/分）")
+    print(f"{'フェーズ':<14}{'件数':>6}{'失敗':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for phase, stats in summary["phases"].items():
+        print(f"{phase:<14}{stats['count']:>6}{stats['errors']:>6}"
+              f"{stats['p50_ms'] or '-':>10}{stats['p95_ms'] or '-':>10}{stats['p99_ms'] or '-':>10}")
+    if summary["crashed_sessions"]:
+        print(f"異常終了したセッション: {summary['crashed_sessions']}")
+    for message in summary["error_messages"][:10]:
+        print(f"  エラー: {message}")
+
+
+def print_saturation_curve(levels):
+    print("\n=== 飽和曲線（分析フェーズ）")
+    print(f"{'セッション':>10}{'分析/分':>10}{'p95(ms)':>10}{'ピークRSS(MB)':>14}")
+    for summary in levels:
+        analysis = summary["phases"].get("analysis", {})
+        print(f"{summary['sessions']:>10}{summary['analyses_per_min']:>10}"
+              f"{analysis.get('p95_ms') or '-':>10}{summary['peak_rss_mb']:>14}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streamlitアプリの同時セッション負荷試験")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="同時セッション数（複数指定で段階実行）")
+    parser.add_argument("--iterations", type=int, default=2, help="1セッションあたりの編集＋分析の回数")
+    parser.add_argument("--admin-every", type=int, default=4, help="N番目ごとのセッションを管理者にする（0で無効）")
+    parser.add_argument("--output", default=None, help="結果をJSONで保存")
+    args = parser.parse_args(argv)
+
+    # 外部のモックサーバー指定がなければプロセス内のモックを使う
+    if not os.environ.get("LLM_BASE_URL"):
+        os.environ.setdefault("LLM_TRANSPORT", "mock")
+
+    levels = []
+    with tempfile.TemporaryDirectory() as workdir:
+        original_dir = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for session_count in args.sessions:
+                summary = run_level(session_count, args.iterations, args.admin_every)
+                print_level(summary)
+                levels.append(summary)
+        finally:
+            os.chdir(original_dir)
+
+    print_saturation_curve(levels)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"levels": levels, "transport": os.environ.get("LLM_TRANSPORT")}, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+    if any(summary["error_messages"] for summary in levels):
+        print("\nエラーが発生したセッションがあります", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""パーサー・プロンプト組み立て・ログ処理のオフラインベンチマーク
+
+実行方法（リポジトリ直下で）:
+    python -m benchmarks.run_benchmarks --save-baseline   # 基準値を保存
+    python -m benchmarks.run_benchmarks                   # 基準値と比較（劣化時は終了コード1）
+    python -m benchmarks.run_benchmarks --profile full    # 数MBの結果・10^7行のログまで計測
+
+計測の前に、高速化で結果が変わりやすい処理の確認（CHECKS）を行い、失敗すれば終了コード1。
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from access_log import log_access, get_access_logs
+from prompt_builder import build_analysis_prompt
+from growth_projection import build_growth_projection
+from roster_solver import roster_candidates, solve_roster
+from portfolio import optimize_portfolio
+from analysis_archive import search_analyses
+from result_parser import parse_markdown_table, parse_analysis_result, extract_metrics_from_text
+from benchmarks.fixtures import make_table, make_synthetic_result, make_reference_text, make_roster, make_portfolio, write_analysis_archive, write_access_log
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+PROFILES = {
+    "quick": {
+        "result_kb": [1, 64, 1024],
+        "table_rows": [1_000, 5_000],
+        "reference_groups": [1, 50],
+        "log_rows": [1_000, 10_000, 100_000],
+        "roster_creators": [100, 500],
+        "portfolio_titles": [12],
+        "archived_analyses": [500],
+    },
+    "full": {
+        "result_kb": [1, 64, 1024, 4096],
+        "table_rows": [1_000, 10_000],
+        "reference_groups": [1, 50, 500],
+        "log_rows": [1_000, 10_000, 100_000, 1_000_000, 10_000_000],
+        "roster_creators": [100, 500, 2000],
+        "portfolio_titles": [12, 48],
+        "archived_analyses": [500, 5000],
+    },
+}
+
+# これより短い処理は計測誤差が大きいため劣化判定から除外
+NOISE_FLOOR_SECONDS = 0.002
+NOISE_FLOOR_MB = 1.0
+
+# log_accessの1回の計測で追記する件数
+LOG_APPEND_BATCH = 100
+
+
+def _prompt_inputs(reference_groups):
+    reference = make_reference_text(reference_groups)
+    return {
+        "project_name": "benchmark",
+        "project_genre": "サバイバル/クラフティング",
+        "launch_date": datetime.date(2025, 1, 1),
+        "target_sales": 100000,
+        "target_market": "日本のみ",
+        "total_marketing_budget": 50000,
+        "campaign_period": "3ヶ月",
+        "optimization_focus": "ROI最大化",
+        "selected_tactics": ["VTuberマーケティング: 大手5-10名", "デジタル広告: YouTube"],
+        "vtuber_reference": reference,
+        "other_reference": reference,
+        "constraints": "",
+        "additional_context": "",
+        "compact_reference": True,
+    }
+
+
+def _append_logs():
+    for i in range(LOG_APPEND_BATCH):
+        log_access("bench", "analysis_executed", f"benchmark {i}", display_name="ベンチマーク")
+
+
+def build_cases(profile):
+    """(ケース名, 準備関数) のリスト。準備関数は計測対象の関数を返す"""
+    settings = PROFILES[profile]
+    cases = []
+
+    for rows in settings["table_rows"]:
+        def setup(rows=rows):
+            text = make_table(rows)
+            return lambda: parse_markdown_table(text)
+        cases.append((f"parse_markdown_table[{rows}rows]", setup))
+
+    for size_kb in settings["result_kb"]:
+        def setup(size_kb=size_kb):
+            text = make_synthetic_result(size_kb)
+            return lambda: parse_analysis_result(text)
+        cases.append((f"parse_analysis_result[{size_kb}KB]", setup))
+
+        def setup(size_kb=size_kb):
+            text = make_synthetic_result(size_kb)
+            return lambda: extract_metrics_from_text(text)
+        cases.append((f"extract_metrics_from_text[{size_kb}KB]", setup))
+
+    for groups in settings["reference_groups"]:
+        def setup(groups=groups):
+            inputs = _prompt_inputs(groups)
+            return lambda: build_analysis_prompt(inputs)
+        cases.append((f"build_analysis_prompt[{groups}groups]", setup))
+
+        def setup(groups=groups):
+            reference = make_reference_text(groups)
+            return lambda: build_growth_projection(reference)
+        cases.append((f"build_growth_projection[{groups * 4}items]", setup))
+
+    for creators in settings["roster_creators"]:
+        def setup(creators=creators):
+            candidates = roster_candidates(make_roster(creators))
+            return lambda: solve_roster(candidates, 5e7, min_shares={"100万人以上": 0.2})
+        cases.append((f"solve_roster[{creators}creators]", setup))
+
+    # プロセスの起動時間を含めないよう、タイトルごとの計算は順番に行う
+    for titles in settings["portfolio_titles"]:
+        def setup(titles=titles):
+            portfolio = make_portfolio(titles)
+            return lambda: optimize_portfolio(portfolio, 5e8, parallel=False)
+        cases.append((f"optimize_portfolio[{titles}titles]", setup))
+
+    for analyses in settings["archived_analyses"]:
+        def setup(analyses=analyses):
+            write_analysis_archive(analyses)
+            return lambda: search_analyses("サバイバル 3億")
+        cases.append((f"search_analyses[{analyses}analyses]", setup))
+
+    for rows in settings["log_rows"]:
+        def setup(rows=rows):
+            write_access_log(rows)
+            return _append_logs
+        cases.append((f"log_access[x{LOG_APPEND_BATCH},{rows}rows]", setup))
+
+        def setup(rows=rows):
+            write_access_log(rows)
+            return get_access_logs
+        cases.append((f"get_access_logs[{rows}rows]", setup))
+
+    return cases
+
+
+def check_roster_minimum_share():
+    """最低割合のあるグループで、予算ごとの最大値の組み合わせが下限を満たさなくても、満たす別の組み合わせを選ぶ"""
+    candidates = pd.DataFrame({
+        "label": ["A", "B", "C"],
+        "group": ["g", "g", "free"],
+        "cost_yen": [10_001, 19_999, 20_000],
+        "views": [100, 50, 1_000],
+        "ctr": 0.29,
+        "max_count": 1,
+    })
+    selection, summary = solve_roster(candidates, 40_000, min_shares={"g": 0.4})
+    if sorted(selection["候補"]) != ["B", "C"]:
+        return f"solve_roster: B+C（1,050視聴）を期待したところ {'+'.join(selection['候補'])}（{summary['views']:,.0f}視聴）"
+    return None
+
+
+CHECKS = [check_roster_minimum_share]
+
+
+def run_checks():
+    """結果の確認。失敗の説明のリストを返す"""
+    failures = [message for message in (check() for check in CHECKS) if message]
+    for message in failures:
+        print(f"結果の確認に失敗: {message}")
+    return failures
+
+
+def measure(func, repeat):
+    """最速の実行時間（秒）とピークメモリ（MB）"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    # メモリは計測のオーバーヘッドがあるため時間とは別に1回だけ計測
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak / 1024 / 1024
+
+
+def run(profile, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        original_dir = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for name, setup in build_cases(profile):
+                func = setup()
+                seconds, peak_mb = measure(func, repeat)
+                results[name] = {"seconds": round(seconds, 6), "peak_mb": round(peak_mb, 3)}
+                print(f"{name:<48} {seconds * 1000:>10.2f} ms {peak_mb:>10.2f} MB")
+        finally:
+            os.chdir(original_dir)
+    return results
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    """基準値と比較し、劣化したケースの説明を返す"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        if current["seconds"] > base["seconds"] * threshold and current["seconds"] - base["seconds"] > NOISE_FLOOR_SECONDS:
+            regressions.append(
+                f"{name}: 時間 {base['seconds'] * 1000:.2f}ms → {current['seconds'] * 1000:.2f}ms "
+                f"({current['seconds'] / base['seconds']:.2f}倍)"
+            )
+        if current["peak_mb"] > base["peak_mb"] * memory_threshold and current["peak_mb"] - base["peak_mb"] > NOISE_FLOOR_MB:
+            regressions.append(
+                f"{name}: メモリ {base['peak_mb']:.2f}MB → {current['peak_mb']:.2f}MB"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="オフラインベンチマーク")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--repeat", type=int, default=3, help="時間計測の繰り返し回数（最速値を採用）")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準値ファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準値として保存")
+    parser.add_argument("--threshold", type=float, default=1.5, help="時間の劣化判定倍率")
+    parser.add_argument("--memory-threshold", type=float, default=1.3, help="メモリの劣化判定倍率")
+    parser.add_argument("--allow-missing-baseline", action="store_true", help="基準値ファイルがなくても成功として終了")
+    args = parser.parse_args(argv)
+
+    if run_checks():
+        return 1
+
+    results = run(args.profile, args.repeat)
+
+    if args.save_baseline:
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                stored = json.load(f)
+        stored.setdefault("cases", {}).update(results)
+        stored["environment"] = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "saved_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(stored, f, ensure_ascii=False, indent=2)
+        print(f"基準値を保存しました: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("基準値ファイルがありません。--save-baseline で作成してください")
+        return 0 if args.allow_missing_baseline else 1
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f).get("cases", {})
+
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    if regressions:
+        print("性能劣化を検出しました:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+
+    print("基準値からの劣化はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
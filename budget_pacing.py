@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import datetime
+import math
+
+import numpy as np
+import pandas as pd
+
+from growth_projection import parse_growth_multipliers, fit_growth_curves
+
+# ============================================
+# 週次の予算ペーシング（ローンチ日・イベント日・成長の遅れを考慮した施策別の支出計画）
+# ============================================
+
+PERIOD_DAYS = {"1ヶ月": 30, "3ヶ月": 91, "6ヶ月": 182, "1年": 365}
+
+# キャンペーン期間のうちローンチ前に置く割合
+PRE_LAUNCH_TIME_SHARE = 0.6
+
+# 主なゲームイベントの例年の開催日（月, 日）。施策名に含まれるイベントはその週に支出する
+EVENT_CALENDAR = {
+    "東京ゲームショウ": (9, 25),
+    "BitSummit": (7, 18),
+    "gamescom": (8, 20),
+}
+
+# イベント費用のうち準備期間（出展料・ブース制作）に支出する割合と週数
+EVENT_PREP_SHARE = 0.3
+EVENT_PREP_WEEKS = 4
+
+# 配信者施策は視聴が遅れて伸びるため、Day30視聴のこの割合に達するまでの日数だけ前倒しする
+LAG_VIEW_FRACTION = 0.8
+
+# 施策名のキーワード → 支出の形
+#   pre_share: ローンチ前に使う割合
+#   focus: ローンチ（山）への集中度。山からの距離の減衰幅を片側の週数に対する割合で指定（Noneは均等）
+#   lag: 成長曲線の遅れだけ山を前倒しする
+#   event: イベント日に合わせて支出する
+TACTIC_PROFILES = [
+    (("イベント", "出展", "ブース") + tuple(EVENT_CALENDAR), {"event": True}),
+    (("VTuber", "インフルエンサー", "配信者"), {"pre_share": 0.7, "focus": 0.5, "lag": True}),
+    (("広告", "CPM", "CPC"), {"pre_share": 0.5, "focus": 0.3}),
+    (("PR", "メディア", "プレス", "記事"), {"pre_share": 0.6, "focus": 0.25}),
+    (("コミュニティ", "Discord"), {"pre_share": 0.5, "focus": None}),
+]
+DEFAULT_PROFILE = {"pre_share": 0.6, "focus": 0.5}
+
+TOTAL_ROW_PATTERN = r'^\**\s*(?:合計|小計|総計)'
+
+
+def tactic_profile(tactic):
+    for keywords, profile in TACTIC_PROFILES:
+        if any(keyword.lower() in str(tactic).lower() for keyword in keywords):
+            return profile
+    return DEFAULT_PROFILE
+
+
+def campaign_weeks(launch_date, campaign_period):
+    """キャンペーン期間の各週の開始日（月曜）と、ローンチ週の位置"""
+    total_weeks = max(1, math.ceil(PERIOD_DAYS.get(campaign_period, 91) / 7))
+    pre_weeks = min(total_weeks - 1, round(total_weeks * PRE_LAUNCH_TIME_SHARE))
+    launch_monday = launch_date - datetime.timedelta(days=launch_date.weekday())
+    start = launch_monday - datetime.timedelta(weeks=pre_weeks)
+    weeks = [start + datetime.timedelta(weeks=week) for week in range(total_weeks)]
+    return weeks, pre_weeks
+
+
+def growth_lag_weeks(reference_text):
+    """配信者施策の視聴がDay30視聴のLAG_VIEW_FRACTIONに達するまでの週数"""
+    curve = fit_growth_curves(parse_growth_multipliers(reference_text))[1]
+    lag_days = int(np.argmax(curve >= curve[-1] * LAG_VIEW_FRACTION)) + 1
+    return round(lag_days / 7)
+
+
+def find_event_weeks(tactic, weeks):
+    """施策名に含まれるイベント（なければ期間中の全イベント）の開催週の位置と名前"""
+    first, last = weeks[0], weeks[-1] + datetime.timedelta(days=6)
+    named = [name for name in EVENT_CALENDAR if name.lower() in str(tactic).lower()]
+    events = []
+    for name in named or EVENT_CALENDAR:
+        month, day = EVENT_CALENDAR[name]
+        for year in range(first.year, last.year + 1):
+            event_date = datetime.date(year, month, day)
+            if first <= event_date <= last:
+                events.append(((event_date - first).days // 7, name))
+    return events
+
+
+def _launch_weights(week_count, launch_index, profile, lag_weeks):
+    """ローンチ（前倒し後の山）に向けて増え、その後減る支出の重み（合計1）"""
+    positions = np.arange(week_count)
+    pre = positions < launch_index
+    pre_share = profile["pre_share"] if pre.any() and (~pre).any() else float(pre.all())
+
+    if profile["focus"] is None:
+        weights = np.ones(week_count)
+    else:
+        peak = max(0, launch_index - (lag_weeks if profile.get("lag") else 0))
+        scale = np.where(
+            positions < peak,
+            max(peak, 1) * profile["focus"],
+            max(week_count - peak, 1) * profile["focus"]
+        )
+        weights = np.exp(-np.abs(positions - peak) / np.maximum(scale, 1e-9))
+
+    result = np.zeros(week_count)
+    if pre.any():
+        result[pre] = weights[pre] / weights[pre].sum() * pre_share
+    if (~pre).any():
+        result[~pre] = weights[~pre] / weights[~pre].sum() * (1 - pre_share)
+    return result
+
+
+def _event_weights(week_count, launch_index, events):
+    """イベント週に集中し、直前の準備期間にも一部を支出する重み（合計1）"""
+    event_indexes = [index for index, _ in events] or [min(launch_index, week_count - 1)]
+    weights = np.zeros(week_count)
+    for index in event_indexes:
+        prep = np.arange(max(0, index - EVENT_PREP_WEEKS), index)
+        share = 1 / len(event_indexes)
+        if len(prep):
+            weights[prep] += share * EVENT_PREP_SHARE / len(prep)
+            weights[index] += share * (1 - EVENT_PREP_SHARE)
+        else:
+            weights[index] += share
+    return weights
+
+
+def build_pacing_schedule(allocations, launch_date, campaign_period, reference_text=""):
+    """施策別の配分額（施策・配分額(万円)）から週次の支出計画を作る
+
+    戻り値は (週×施策の支出表, 注記のリスト)。支出表の列は 週開始・週・各施策・合計（万円）で、
+    各施策の合計は配分額と一致する。
+    """
+    allocations = allocations.dropna(subset=["配分額(万円)"])
+    allocations = allocations[allocations["配分額(万円)"] > 0]
+    # 表の合計行は施策ではないので除く
+    allocations = allocations[~allocations["施策"].astype(str).str.contains(TOTAL_ROW_PATTERN)]
+    if allocations.empty:
+        return pd.DataFrame(), []
+
+    # 同じ施策が複数行ある場合はまとめる（表の並び順は維持）
+    totals = allocations.groupby("施策", sort=False)["配分額(万円)"].sum()
+
+    weeks, launch_index = campaign_weeks(launch_date, campaign_period)
+    lag_weeks = growth_lag_weeks(reference_text)
+    notes = []
+
+    weights = np.zeros((len(totals), len(weeks)))
+    for row, tactic in enumerate(totals.index):
+        profile = tactic_profile(tactic)
+        if profile.get("event"):
+            events = find_event_weeks(tactic, weeks)
+            weights[row] = _event_weights(len(weeks), launch_index, events)
+            for index, name in events:
+                notes.append(f"{tactic}: {name}（{weeks[index]:%Y-%m-%d}の週）に集中")
+            if not events:
+                notes.append(f"{tactic}: 期間中に既知のイベントがないためローンチ週に計上")
+        else:
+            weights[row] = _launch_weights(len(weeks), launch_index, profile, lag_weeks)
+            if profile.get("lag") and lag_weeks:
+                notes.append(f"{tactic}: 視聴の伸びの遅れ（約{lag_weeks}週）だけ山を前倒し")
+
+    # 0.1万円単位に丸め、丸め誤差は各施策で最も大きい週に寄せて合計を配分額に合わせる
+    amounts = np.round(weights * totals.to_numpy()[:, None], 1)
+    peaks = amounts.argmax(axis=1)
+    amounts[np.arange(len(totals)), peaks] += np.round(totals.to_numpy() - amounts.sum(axis=1), 1)
+
+    schedule = pd.DataFrame(amounts.T, columns=totals.index)
+    schedule.insert(0, "週", [
+        "ローンチ週" if index == launch_index else f"ローンチ{index - launch_index:+d}週"
+        for index in range(len(weeks))
+    ])
+    schedule.insert(0, "週開始", weeks)
+    schedule.columns.name = None
+    schedule["合計"] = schedule[list(totals.index)].sum(axis=1).round(1)
+    return schedule, notes
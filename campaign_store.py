@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pandas as pd
+
+from amount_normalizer import normalize_values, parse_header_unit
+from log_files import file_signature
+
+# ============================================
+# 過去施策実績のカラムナストア（Parquet）
+# ============================================
+
+STORE_FILE = os.path.join("data", "campaigns.parquet")
+
+# 取り込み時の列名の表記ゆれ → 保存する列名
+COLUMN_ALIASES = {
+    "配信日": "date",
+    "実施日": "date",
+    "日付": "date",
+    "ジャンル": "genre",
+    "市場": "market",
+    "ターゲット市場": "market",
+    "地域": "market",
+    "プラットフォーム": "platform",
+    "配信者": "creator",
+    "配信者名": "creator",
+    "クリエイター": "creator",
+    "フォロワー数": "followers",
+    "登録者数": "followers",
+    "コスト": "cost_yen",
+    "費用": "cost_yen",
+    "7日視聴": "views_7d",
+    "7日視聴数": "views_7d",
+    "CPV": "cpv",
+    "CTR": "ctr",
+    "ENG率": "engagement_rate",
+    "エンゲージメント率": "engagement_rate",
+}
+
+KEY_COLUMNS = ["date", "creator", "platform", "genre"]
+NUMERIC_COLUMNS = ["followers", "cost_yen", "views_7d", "cpv", "ctr", "engagement_rate"]
+STORE_COLUMNS = ["genre", "market", "platform", "tier", "date", "creator"] + NUMERIC_COLUMNS
+
+# 市場の列がないファイルの値
+UNKNOWN_MARKET = "未設定"
+
+# フォロワー規模の区分（参考データの「7万人級」「25万人級」に対応）
+TIER_EDGES = [0, 50_000, 100_000, 300_000, 500_000, 1_000_000, np.inf]
+TIER_LABELS = ["5万人未満", "5-10万人", "10-30万人", "30-50万人", "50-100万人", "100万人以上"]
+
+# 参考レンジに使う分位点（外れ値を除いた「よくある範囲」）
+RANGE_QUANTILES = (0.1, 0.9)
+
+# Parquetの行グループ（genre・platform順に並べて保存し、絞り込み時に不要な行グループを読まない）
+ROW_GROUP_SIZE = 5000
+
+
+def _canonical_column(header):
+    """「コスト(万円)」→ "cost_yen" のように単位を除いた列名で対応付け"""
+    name = str(header).strip()
+    base = name.split("(")[0].split("（")[0].strip()
+    return COLUMN_ALIASES.get(name) or COLUMN_ALIASES.get(base)
+
+
+def normalize_campaigns(raw_df):
+    """取り込んだ表を保存形式（数値は円・件数・%）に変換"""
+    columns = {}
+    for header in raw_df.columns:
+        canonical = _canonical_column(header)
+        if canonical and canonical not in columns:
+            columns[canonical] = header
+
+    missing = {"platform", "followers"} - set(columns)
+    if missing:
+        raise ValueError(f"必須列がありません: {', '.join(sorted(missing))}")
+
+    df = pd.DataFrame(index=raw_df.index)
+    for column in NUMERIC_COLUMNS:
+        if column not in columns:
+            df[column] = np.nan
+            continue
+        header = columns[column]
+        multiplier, _ = parse_header_unit(header)
+        values = raw_df[header]
+        df[column] = normalize_values(
+            values.astype("string"),
+            header_multipliers=pd.Series(multiplier, index=values.index)
+        )["point"]
+
+    # CPVがなければコストと視聴数から算出
+    df["cpv"] = df["cpv"].fillna(df["cost_yen"] / df["views_7d"].where(df["views_7d"] > 0))
+
+    df["platform"] = raw_df[columns["platform"]].astype("string").str.strip()
+    df["genre"] = raw_df[columns["genre"]].astype("string").str.strip() if "genre" in columns else pd.NA
+    df["market"] = raw_df[columns["market"]].astype("string").str.strip() if "market" in columns else pd.NA
+    df["creator"] = raw_df[columns["creator"]].astype("string").str.strip() if "creator" in columns else pd.NA
+    df["date"] = pd.to_datetime(raw_df[columns["date"]], errors="coerce") if "date" in columns else pd.NaT
+    df["tier"] = pd.cut(df["followers"], TIER_EDGES, labels=TIER_LABELS, right=False)
+
+    df = df.dropna(subset=["platform", "followers"])
+    df["genre"] = df["genre"].fillna("未分類")
+    df["market"] = df["market"].fillna(UNKNOWN_MARKET)
+    return df[STORE_COLUMNS]
+
+
+def read_campaign_file(file, file_name=None):
+    """CSV/Excelの実績ファイルを読み込む（アップロードされたファイルも可）"""
+    name = (file_name or getattr(file, "name", None) or str(file)).lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        return pd.read_excel(file, dtype=str)
+    return pd.read_csv(file, dtype=str)
+
+
+def load_campaigns(genre=None, platform=None, columns=None, store_file=STORE_FILE):
+    """保存済みの実績を読み込む（ジャンル・プラットフォームでの絞り込みは読み込み時に適用）"""
+    if not os.path.exists(store_file):
+        return None
+
+    filters = []
+    if genre:
+        filters.append(("genre", "==", genre))
+    if platform:
+        filters.append(("platform", "==", platform))
+
+    df = pd.read_parquet(store_file, columns=columns, filters=filters or None)
+    if columns is None and "market" not in df:
+        # 市場の列を追加する前に作成したストア
+        df["market"] = UNKNOWN_MARKET
+    if "tier" in df:
+        df["tier"] = pd.Categorical(df["tier"], categories=TIER_LABELS, ordered=True)
+    return df
+
+
+def write_campaigns(df, store_file=STORE_FILE):
+    """ストアを書き出す（一時ファイルに書いてから置き換え）"""
+    os.makedirs(os.path.dirname(store_file), exist_ok=True)
+
+    ordered = df.sort_values(["genre", "platform", "tier", "date"], na_position="last").reset_index(drop=True)
+    for column in ["genre", "market", "platform"]:
+        ordered[column] = ordered[column].astype("string")
+    ordered["tier"] = ordered["tier"].astype("string")
+
+    temp_file = f"{store_file}.tmp"
+    ordered.to_parquet(temp_file, index=False, row_group_size=ROW_GROUP_SIZE)
+    os.replace(temp_file, store_file)
+
+
+def ingest_campaigns(raw_df, store_file=STORE_FILE):
+    """実績表をストアに追加（同じ配信日・配信者・プラットフォーム・ジャンルの行は新しい値で上書き）
+
+    戻り値は (追加した行数, ストアの総行数)
+    """
+    new_rows = normalize_campaigns(raw_df)
+    existing = load_campaigns(store_file=store_file)
+
+    combined = new_rows if existing is None else pd.concat([existing, new_rows], ignore_index=True)
+    # 日付・配信者がない行は重複判定できないためすべて残す
+    keyed = combined[KEY_COLUMNS].notna().all(axis=1)
+    combined = pd.concat([
+        combined[keyed].drop_duplicates(subset=KEY_COLUMNS, keep="last"),
+        combined[~keyed],
+    ], ignore_index=True)
+
+    write_campaigns(combined, store_file)
+    return len(new_rows), len(combined)
+
+
+def get_store_signature(store_file=STORE_FILE):
+    """ストアの更新検知用キー（更新時刻とサイズ）"""
+    return file_signature(store_file)
+
+
+def list_genres(store_file=STORE_FILE):
+    df = load_campaigns(columns=["genre"], store_file=store_file)
+    if df is None:
+        return []
+    return sorted(df["genre"].dropna().unique().tolist())
+
+
+# ============================================
+# 集計と参考データの生成
+# ============================================
+
+# 参考データに出力する指標（表示名, 列名, 単位, 表示単位の倍率）
+TIER_FIELDS = [("コスト", "cost_yen", "万円", 1e4), ("CPV", "cpv", "円", 1), ("7日視聴", "views_7d", "", 1)]
+PLATFORM_FIELDS = [("CPV", "cpv", "円", 1), ("CTR", "ctr", "%", 1), ("ENG率", "engagement_rate", "%", 1)]
+
+
+def summarize_ranges(df, by):
+    """グループごとの指標レンジ（分位点の下限・上限）と件数"""
+    grouped = df.groupby(by, observed=True)
+    low_q, high_q = RANGE_QUANTILES
+    metrics = grouped[NUMERIC_COLUMNS]
+    summary = pd.concat(
+        {"low": metrics.quantile(low_q), "high": metrics.quantile(high_q)},
+        axis=1
+    )
+    summary["count", "rows"] = grouped.size()
+    return summary
+
+
+def _format_number(value):
+    if pd.isna(value):
+        return None
+    if abs(value) >= 100:
+        return f"{round(value):,}"
+    return f"{value:.2g}" if abs(value) < 1 else f"{value:.3g}"
+
+
+def _format_range(low, high, unit="", scale=1.0):
+    low_text = _format_number(low / scale)
+    high_text = _format_number(high / scale)
+    if low_text is None or high_text is None:
+        return None
+    if low_text == high_text:
+        return f"{low_text}{unit}"
+    return f"{low_text}-{high_text}{unit}"
+
+
+def format_summary_fields(row, fields):
+    """summarize_rangesの1行を「CPV 3-10円」形式の項目リストに変換
+
+    fields: [(表示名, 列名, 単位, 表示単位の倍率)]
+    """
+    parts = []
+    for metric, column, unit, scale in fields:
+        text = _format_range(row[("low", column)], row[("high", column)], unit, scale)
+        if text:
+            parts.append(f"{metric} {text}")
+    return parts
+
+
+def build_reference_text(df, genre=None):
+    """実績から参考データ欄の箇条書きを生成（手入力と同じ形式）"""
+    if df is None or df.empty:
+        return ""
+
+    title = genre or "全ジャンル"
+    lines = [f"【過去実績データ（{title}、{len(df):,}件）】", ""]
+
+    lines.append("■ フォロワー規模別の実績:")
+    for tier, row in summarize_ranges(df, "tier").iterrows():
+        parts = format_summary_fields(row, TIER_FIELDS) + [f"件数 {int(row['count'].iloc[0])}件"]
+        lines.append(f"- {tier}: {'、'.join(parts)}")
+
+    lines += ["", "■ プラットフォーム別:"]
+    for platform, row in summarize_ranges(df, "platform").iterrows():
+        parts = format_summary_fields(row, PLATFORM_FIELDS) + [f"件数 {int(row['count'].iloc[0])}件"]
+        lines.append(f"- {platform}: {'、'.join(parts)}")
+
+    overall = summarize_ranges(df.assign(_all=0), "_all").iloc[0]
+    engagement = [
+        ("平均ENG率", _format_range(overall[("low", "engagement_rate")], overall[("high", "engagement_rate")], "%")),
+        ("平均CTR", _format_range(overall[("low", "ctr")], overall[("high", "ctr")], "%")),
+    ]
+    engagement = [(name, text) for name, text in engagement if text]
+    if engagement:
+        lines += ["", "■ エンゲージメント:"]
+        lines += [f"- {name}: {text}" for name, text in engagement]
+
+    low_q, high_q = RANGE_QUANTILES
+    lines += ["", f"※ 各レンジは実績の{int(low_q * 100)}-{int(high_q * 100)}パーセンタイル"]
+    return "\n".join(lines)
+
+
+def generate_reference_text(genre=None, store_file=STORE_FILE):
+    """ストアから参考データ欄のテキストを生成（ストアがなければ空文字）"""
+    df = load_campaigns(genre=genre, store_file=store_file)
+    return build_reference_text(df, genre)
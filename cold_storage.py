@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""古いログ・分析結果の圧縮アーカイブ（コールド層）
+
+実行方法（リポジトリ直下で、cron等から定期実行）:
+    python -m cold_storage              # COLD_AFTER_DAYS日より古いデータを圧縮
+    python -m cold_storage --days 30
+"""
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from analysis_archive import archive_cold_analyses
+from log_files import file_signature, locked_file
+
+# ============================================
+# ログのコールド層（月ごとのgzip圧縮CSVと索引）
+# ============================================
+#
+# 普段の画面表示は logs/ の直近のCSV（ホット層）だけを読む。期間全体の集計・CSV出力では
+# include_archived=True で索引から対象の圧縮ファイルを探して透過的に展開する。
+
+LOG_DIR = "logs"
+COLD_DIR = os.path.join(LOG_DIR, "archive")
+INDEX_FILE = os.path.join(COLD_DIR, "index.json")
+
+# この日数より古い行・分析結果を圧縮する
+COLD_AFTER_DAYS = int(os.environ.get("COLD_STORAGE_AFTER_DAYS", "90"))
+
+# 圧縮の対象（logs/ 直下のtimestamp列を持つCSV）
+TIERED_LOGS = ["access_log.csv", "api_metrics.csv", "quota_charges.csv", "speculation_log.csv", "trace_spans.csv"]
+
+def load_index():
+    """圧縮ファイルの索引 [{source, file, first, last, rows, bytes, compressed_bytes}]"""
+    try:
+        with open(INDEX_FILE, encoding="utf-8") as f:
+            return json.load(f)["chunks"]
+    except FileNotFoundError:
+        return []
+
+
+def _save_index(chunks):
+    os.makedirs(COLD_DIR, exist_ok=True)
+    temp_file = INDEX_FILE + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump({"chunks": chunks}, f, ensure_ascii=False, indent=1)
+    os.replace(temp_file, INDEX_FILE)
+
+
+def get_index_signature():
+    """索引の更新検知用キー（キャッシュのキーに使う）"""
+    return file_signature(INDEX_FILE)
+
+
+def _write_chunk(source, month, df):
+    """1か月分の行を圧縮して書き出し、索引の1件を返す"""
+    name = os.path.splitext(source)[0]
+    os.makedirs(os.path.join(COLD_DIR, name), exist_ok=True)
+    sequence = 1
+    while os.path.exists(os.path.join(COLD_DIR, name, f"{month}-{sequence}.csv.gz")):
+        sequence += 1
+    relative = os.path.join(name, f"{month}-{sequence}.csv.gz")
+
+    raw = df.to_csv(index=False).encode("utf-8")
+    with gzip.open(os.path.join(COLD_DIR, relative), "wb") as f:
+        f.write(raw)
+    return {
+        "source": source,
+        "file": relative,
+        "first": str(df["timestamp"].min()),
+        "last": str(df["timestamp"].max()),
+        "rows": len(df),
+        "bytes": len(raw),
+        "compressed_bytes": os.path.getsize(os.path.join(COLD_DIR, relative)),
+    }
+
+
+def archive_log(source, cutoff):
+    """logs/source のcutoffより古い行を月ごとの圧縮ファイルに移し、圧縮した行数を返す
+
+    読み込みから置き換えまで追記と同じロック（log_files.locked_file）を取るので、
+    その間の追記は置き換え後のファイルに書かれる。
+    索引は直近のファイルを置き換える前に更新する（途中で止まっても圧縮した行が索引から漏れない。
+    その場合は同じ行が両方に残る）。
+    """
+    path = os.path.join(LOG_DIR, source)
+    if not os.path.exists(path):
+        return 0
+
+    with locked_file(path):
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        if df.empty or "timestamp" not in df.columns:
+            return 0
+
+        timestamps = pd.to_datetime(df["timestamp"], errors="coerce")
+        cold = timestamps < cutoff
+        if not cold.any():
+            return 0
+
+        chunks = [
+            _write_chunk(source, month, df[cold & (timestamps.dt.strftime("%Y-%m") == month)])
+            for month in sorted(timestamps[cold].dt.strftime("%Y-%m").unique())
+        ]
+
+        # 索引の読み込みから書き込みまでプロセス間でも排他（cronと管理画面からの同時実行で索引が失われないように）
+        with locked_file(INDEX_FILE):
+            _save_index(load_index() + chunks)
+
+        # 直近の行だけのファイルに置き換える
+        temp_file = path + ".tmp"
+        df[~cold].to_csv(temp_file, index=False, encoding="utf-8")
+        os.replace(temp_file, path)
+
+    return int(cold.sum())
+
+
+def read_archived_log(source, since=None):
+    """圧縮済みの行（sinceより新しい月のファイルだけを展開）。なければNone"""
+    frames = []
+    for chunk in load_index():
+        if chunk["source"] != source or (since is not None and pd.Timestamp(chunk["last"]) < since):
+            continue
+        frames.append(pd.read_csv(os.path.join(COLD_DIR, chunk["file"]), compression="gzip"))
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def with_archived_rows(source, hot_df, since=None):
+    """直近のCSVの内容の前に圧縮済みの行を足す（古い順）"""
+    cold_df = read_archived_log(source, since)
+    if cold_df is None:
+        return hot_df
+    if hot_df is None:
+        return cold_df
+    return pd.concat([cold_df, hot_df], ignore_index=True)
+
+
+def summarize_storage():
+    """ソース別の圧縮済みの行数・サイズ（管理画面用）"""
+    chunks = pd.DataFrame(load_index())
+    if chunks.empty:
+        return chunks
+    summary = chunks.groupby("source").agg(
+        ファイル数=("file", "count"),
+        行数=("rows", "sum"),
+        最古=("first", "min"),
+        最新=("last", "max"),
+        元のサイズ=("bytes", "sum"),
+        圧縮後=("compressed_bytes", "sum"),
+    )
+    summary["圧縮率(%)"] = (summary["圧縮後"] / summary["元のサイズ"] * 100).round(1)
+    summary["元のサイズ"] = (summary["元のサイズ"] / 1024).round(1).astype(str) + " KB"
+    summary["圧縮後"] = (summary["圧縮後"] / 1024).round(1).astype(str) + " KB"
+    return summary.rename_axis("ログ").reset_index()
+
+
+def run_tiering(days=COLD_AFTER_DAYS):
+    """days日より古いログの行と分析結果を圧縮する。戻り値は {対象: 圧縮した件数}"""
+    cutoff = datetime.now() - timedelta(days=days)
+    results = {}
+    for source in TIERED_LOGS:
+        try:
+            results[source] = archive_log(source, cutoff)
+        except Exception as e:
+            print(f"ログ圧縮エラー（{source}）: {e}")
+            results[source] = 0
+    try:
+        results["analyses"] = archive_cold_analyses(cutoff)
+    except Exception as e:
+        print(f"分析結果の圧縮エラー: {e}")
+        results["analyses"] = 0
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="古いログ・分析結果の圧縮")
+    parser.add_argument("--days", type=int, default=COLD_AFTER_DAYS, help="この日数より古いデータを圧縮")
+    args = parser.parse_args(argv)
+
+    for target, count in run_tiering(args.days).items():
+        print(f"{target}: {count:,}件を圧縮")
+
+
+if __name__ == "__main__":
+    main()
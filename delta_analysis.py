@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import re
+
+from prompt_builder import (
+    ALL_SECTION_IDS,
+    build_output_format,
+    format_reference_for_prompt,
+    get_report_sections,
+)
+from result_parser import parse_result_tree
+
+# ============================================
+# 差分による再最適化（変更のあった入力に関係するセクションだけ再生成）
+# ============================================
+
+FIELD_LABELS = {
+    "project_name": "プロジェクト名",
+    "project_genre": "ジャンル",
+    "launch_date": "ローンチ予定日",
+    "target_sales": "目標販売本数",
+    "target_market": "ターゲット市場",
+    "total_marketing_budget": "総マーケティング予算(万円)",
+    "campaign_period": "キャンペーン期間",
+    "optimization_focus": "最適化の重点",
+    "selected_tactics": "実施予定のマーケティング施策",
+    "vtuber_reference": "参考データ - VTuber/インフルエンサー施策",
+    "other_reference": "参考データ - その他施策",
+    "retrieved_reference": "参考データ - 類似する過去実績",
+    "constraints": "制約条件",
+    "additional_context": "その他の考慮事項",
+}
+
+# 入力項目ごとに内容が変わりうるセクション（1: 概要は入力の整理なので多くの項目に依存）
+_ALLOCATION_DEPENDENT = {1, 2, 3, 4, 5, 6, 7, 8}
+SECTION_DEPENDENCIES = {
+    "project_name": {1},
+    "project_genre": _ALLOCATION_DEPENDENT,
+    "launch_date": {1, 4, 7, 8},
+    "target_sales": {1, 2, 3, 5},
+    "target_market": _ALLOCATION_DEPENDENT,
+    "total_marketing_budget": {1, 2, 3, 4, 5, 7},
+    "campaign_period": {1, 2, 4, 5, 7, 8},
+    "optimization_focus": {1, 2, 3, 7},
+    "selected_tactics": _ALLOCATION_DEPENDENT,
+    "vtuber_reference": {2, 3, 5},
+    "other_reference": {2, 3, 5},
+    "retrieved_reference": {2, 3, 5},
+    "constraints": {1, 2, 3, 4, 7},
+    "additional_context": {1, 2, 6, 7},
+}
+
+# 差分プロンプトで新しい値をそのまま示す項目（長い参考データは圧縮形式で送る）
+_REFERENCE_FIELDS = {"vtuber_reference", "other_reference", "retrieved_reference"}
+
+# 参考データの単価（CPV・CPM・CPC）に沿って金額を決めるセクション。再生成するときは参考データも送る
+_PRICING_SECTIONS = SECTION_DEPENDENCIES["vtuber_reference"]
+
+_SECTION_NUMBER_PATTERN = re.compile(r'^(\d+)\.')
+
+
+def section_number(title):
+    """「2. マーケティング予算配分案」→ 2（番号がなければNone）"""
+    match = _SECTION_NUMBER_PATTERN.match(title)
+    return int(match.group(1)) if match else None
+
+
+def diff_inputs(previous, current):
+    """前回と今回の入力値で変わった項目のキー（FIELD_LABELSの順）"""
+    return [key for key in FIELD_LABELS if previous.get(key) != current.get(key)]
+
+
+def plan_delta(previous_analysis, inputs, section_ids):
+    """再生成するセクションと前回の結果を使い回すセクションを決める
+
+    戻り値は (変更項目, 再生成するセクション番号, 再利用するセクション番号)
+    """
+    changed = diff_inputs(previous_analysis["inputs"], inputs)
+
+    affected = set()
+    for key in changed:
+        affected |= SECTION_DEPENDENCIES[key]
+
+    available = {section_number(section["title"]) for section in previous_analysis["tree"]}
+    regenerate = [sid for sid in section_ids if sid in affected or sid not in available]
+    reuse = [sid for sid in section_ids if sid not in regenerate]
+    return changed, regenerate, reuse
+
+
+def is_delta_applicable(previous_analysis, regenerate_ids):
+    """差分で更新できるか（前回の結果にないセクションは前提となる全情報が必要なので通常実行）"""
+    available = {section_number(section["title"]) for section in previous_analysis["tree"]}
+    return all(sid in available for sid in regenerate_ids)
+
+
+def _format_field_value(key, value, compact):
+    if key in _REFERENCE_FIELDS:
+        return format_reference_for_prompt(value, compact) or "（なし）"
+    if key == "selected_tactics":
+        return "\n".join(f"- {tactic}" for tactic in value) or "（なし）"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return str(value) if value else "（なし）"
+
+
+def build_delta_prompt(previous_analysis, inputs, changed, regenerate_ids):
+    """前回の該当セクションと変更項目だけを送る差分プロンプト
+
+    参考データの単価で金額を決めるセクション（2, 3, 5）を再生成する場合は、変更の有無にかかわらず
+    参考データを圧縮形式で送る（単価の上限を守らせるため）。
+    """
+    compact = inputs.get("compact_reference", True)
+    regenerate = set(regenerate_ids)
+
+    references = []
+    if regenerate & _PRICING_SECTIONS:
+        references = [
+            f"【{FIELD_LABELS[key]}】\n{_format_field_value(key, inputs.get(key), compact)}"
+            for key in FIELD_LABELS
+            if key in _REFERENCE_FIELDS and inputs.get(key)
+        ]
+
+    changes = []
+    for key in changed:
+        label = FIELD_LABELS[key]
+        old_value = previous_analysis["inputs"].get(key)
+        new_value = inputs.get(key)
+        if key in _REFERENCE_FIELDS and references:
+            changes.append(f"■ {label}: 変更あり（変更後の内容は下記の参考データに記載）")
+        elif key in _REFERENCE_FIELDS or key == "selected_tactics":
+            # 長い項目は新しい値のみ
+            changes.append(f"■ {label}（変更後）\n{_format_field_value(key, new_value, compact)}")
+        else:
+            changes.append(
+                f"■ {label}: {_format_field_value(key, old_value, compact)} → {_format_field_value(key, new_value, compact)}"
+            )
+
+    previous_sections = [
+        f"## {section['title']}\n{section['text']}"
+        for section in previous_analysis["tree"]
+        if section_number(section["title"]) in regenerate
+    ]
+    previous_text = "\n\n".join(previous_sections) if previous_sections else "（該当セクションなし）"
+
+    reference_block = ""
+    instructions = [
+        "変更点に関係する数値・配分・説明だけを更新し、それ以外は前回の内容を維持してください",
+        "配分合計は総マーケティング予算と一致させてください",
+    ]
+    if references:
+        reference_block = "\n" + "\n\n".join(references) + "\n"
+        instructions.append("参考データに記載されたCPV、CPM、CPC、コスト範囲を超えないでください")
+    instructions.append("以下に示したセクションのみを、同じ見出し・同じ形式で出力してください")
+    instruction_text = "\n".join(f"{number}. {text}" for number, text in enumerate(instructions, start=1))
+
+    output_format = build_output_format(regenerate_ids, inputs["total_marketing_budget"])
+
+    return f"""
+あなたはゲームパブリッシングのマーケティング予算最適化の専門家です。前回作成した予算配分案に対して入力条件が変更されました。変更点を反映して該当セクションを更新してください。
+
+【プロジェクト】
+- プロジェクト名: {inputs["project_name"]}
+- ジャンル: {inputs["project_genre"]}
+- ターゲット市場: {inputs["target_market"]}
+- 総マーケティング予算: {inputs["total_marketing_budget"]:,}万円
+- キャンペーン期間: {inputs["campaign_period"]}
+
+【変更された入力】
+{chr(10).join(changes)}
+{reference_block}
+【前回の結果（更新対象のセクション）】
+{previous_text}
+
+**【重要な指示】**
+{instruction_text}
+
+以下の形式で回答してください:
+
+{output_format}
+"""
+
+
+class IncompleteDeltaError(Exception):
+    """差分の応答に再生成したはずのセクションがない"""
+
+    def __init__(self, missing_ids):
+        self.missing_ids = sorted(missing_ids)
+        super().__init__(f"差分の応答にセクション{', '.join(map(str, self.missing_ids))}がありません")
+
+
+def merge_results(previous_analysis, delta_text, section_ids, regenerate_ids):
+    """再生成したセクションと前回のセクションを番号順に組み合わせた結果テキスト
+
+    再生成したはずのセクションが応答にない場合は IncompleteDeltaError
+    （前回のセクションで補うと、古い内容が新しい入力の結果として保存されてしまうため）。
+    """
+    new_sections = {
+        section_number(section["title"]): section
+        for section in parse_result_tree(delta_text)
+        if section_number(section["title"]) is not None
+    }
+    missing_ids = set(regenerate_ids) - set(new_sections)
+    if missing_ids:
+        raise IncompleteDeltaError(missing_ids)
+    previous_sections = {
+        section_number(section["title"]): section
+        for section in previous_analysis["tree"]
+        if section_number(section["title"]) is not None
+    }
+
+    merged = []
+    for sid in sorted(section_ids):
+        section = new_sections[sid] if sid in regenerate_ids else previous_sections.get(sid)
+        if section is not None:
+            merged.append(f"## {section['title']}\n{section['text']}")
+    return "\n\n".join(merged)
+
+
+def describe_plan(changed, regenerate_ids, reuse_ids):
+    """画面表示用の差分の説明"""
+    titles = {section["id"]: section["title"] for section in get_report_sections(ALL_SECTION_IDS)}
+    return {
+        "changed": [FIELD_LABELS[key] for key in changed],
+        "regenerate": [titles[sid] for sid in regenerate_ids],
+        "reuse": [titles[sid] for sid in reuse_ids],
+    }
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date, datetime
+
+import pandas as pd
+
+from telemetry import run_instrumented_call, get_api_metrics, CallCancelled
+from tracing import span
+from log_files import append_csv_rows
+
+# ============================================
+# API呼び出しの利用枠と公平なスケジューリング
+# ============================================
+#
+# - ユーザーごとの1日のリクエスト数・トークン数の上限（st.secrets["users"] の各ユーザーの設定）
+# - 同時に実行するAPI呼び出しを MAX_CONCURRENT_CALLS に制限し、空きを待つ呼び出しは
+#   ユーザーごとのキューに入れて重み付きラウンドロビンで順番を決める
+# - 管理者は優先レーン（一般ユーザーのキューより先に実行）
+#
+# Secretsの例:
+#   [users.tanaka]
+#   password = "..."
+#   daily_request_quota = 50
+#   daily_token_quota = 500000
+#   weight = 2
+
+# 同時に実行するAPI呼び出しの上限（プロセス全体）
+MAX_CONCURRENT_CALLS = int(os.environ.get("LLM_MAX_CONCURRENT_CALLS", "4"))
+
+# 実行待ちの上限（秒）
+QUEUE_TIMEOUT_SECONDS = 300
+
+# キャンセルの確認間隔（秒）
+CANCEL_POLL_SECONDS = 0.5
+
+# Secretsに設定がないユーザーの既定値（0は無制限）
+DEFAULT_DAILY_REQUEST_QUOTA = int(os.environ.get("LLM_DAILY_REQUEST_QUOTA", "0"))
+DEFAULT_DAILY_TOKEN_QUOTA = int(os.environ.get("LLM_DAILY_TOKEN_QUOTA", "0"))
+DEFAULT_WEIGHT = 1
+
+ADMIN_USERS = {"admin"}
+
+# 実行時にはリクエスト数に数えないタスク（先読みは結果が使われたときに charge_quota で数える）。
+# 消費したトークンは結果が使われなくても実行時に数える
+UNCHARGED_TASKS = {"analysis_speculative"}
+
+# 実行後に数えたリクエスト（使われた先読み）の記録。再起動後の利用枠の復元に使う
+DEFERRED_CHARGES_FILE = os.path.join("logs", "quota_charges.csv")
+DEFERRED_CHARGE_FIELDS = ["timestamp", "username", "task"]
+
+
+class QuotaExceeded(Exception):
+    """1日の利用枠を使い切った"""
+
+
+class QueueTimeout(Exception):
+    """実行待ちがQUEUE_TIMEOUT_SECONDSを超えた"""
+
+
+def get_user_policy(username, user_config=None):
+    """ユーザー設定（st.secrets["users"][username]）から利用枠・重み・優先レーンを決める"""
+    config = dict(user_config or {})
+    return {
+        "daily_requests": int(config.get("daily_request_quota", DEFAULT_DAILY_REQUEST_QUOTA) or 0),
+        "daily_tokens": int(config.get("daily_token_quota", DEFAULT_DAILY_TOKEN_QUOTA) or 0),
+        "weight": max(1, int(config.get("weight", DEFAULT_WEIGHT) or DEFAULT_WEIGHT)),
+        "priority": username in ADMIN_USERS or config.get("role") == "admin",
+    }
+
+
+def _consumed_tokens(record):
+    return int((record.get("input_tokens") or 0) + (record.get("output_tokens") or 0))
+
+
+class UsageLedger:
+    """当日のユーザー別のリクエスト数・トークン数（初回と日付が変わったときにメトリクスログから復元）"""
+
+    def __init__(self):
+        self._day = None
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def _load_day(self, day):
+        """メトリクスログから当日の利用数を集計
+
+        トークン数は全ての呼び出し、リクエスト数は実行時に数えた呼び出し（charged列。列がない古い行は
+        UNCHARGED_TASKS 以外）と、後から数えた呼び出し（DEFERRED_CHARGES_FILE）の合計。
+        """
+        usage = {}
+        try:
+            df = get_api_metrics()
+            charges = pd.read_csv(DEFERRED_CHARGES_FILE, dtype=str) if os.path.exists(DEFERRED_CHARGES_FILE) else None
+        except Exception as e:
+            print(f"利用枠の復元エラー: {e}")
+            df = charges = None
+
+        if df is not None and not df.empty:
+            today = df[df["timestamp"].dt.date == day]
+            charged = ~today["task"].isin(UNCHARGED_TASKS)
+            if "charged" in today:
+                charged = today["charged"].fillna(charged.astype(int)).astype(bool)
+            tokens = today[["input_tokens", "output_tokens"]].fillna(0).sum(axis=1)
+            usernames = today["username"].astype(str)
+            for username, group in tokens.groupby(usernames):
+                usage[username] = {"requests": int(charged[group.index].sum()), "tokens": int(group.sum())}
+
+        if charges is not None and not charges.empty:
+            charged_today = charges[pd.to_datetime(charges["timestamp"]).dt.date == day]
+            for username, count in charged_today["username"].value_counts().items():
+                usage.setdefault(username, {"requests": 0, "tokens": 0})["requests"] += int(count)
+        return usage
+
+    def _current(self):
+        """当日の集計（ロック内で呼ぶ）"""
+        today = date.today()
+        if self._day != today:
+            self._usage = self._load_day(today)
+            self._day = today
+        return self._usage
+
+    def _check(self, usage, policy):
+        if policy["daily_requests"] and usage["requests"] >= policy["daily_requests"]:
+            raise QuotaExceeded(f"本日のリクエスト上限（{policy['daily_requests']:,}回）に達しました")
+        if policy["daily_tokens"] and usage["tokens"] >= policy["daily_tokens"]:
+            raise QuotaExceeded(f"本日のトークン上限（{policy['daily_tokens']:,}トークン）に達しました")
+
+    def check(self, username, policy):
+        """数えずに上限だけを確認する。上限に達していればQuotaExceeded"""
+        with self._lock:
+            self._check(self._current().get(username, {"requests": 0, "tokens": 0}), policy)
+
+    def reserve(self, username, policy):
+        """リクエストを1件数える。上限に達していればQuotaExceeded"""
+        with self._lock:
+            usage = self._current().setdefault(username, {"requests": 0, "tokens": 0})
+            self._check(usage, policy)
+            usage["requests"] += 1
+
+    def refund(self, username):
+        """実行されなかったリクエストを数えから戻す"""
+        with self._lock:
+            usage = self._current().get(username)
+            if usage is not None and usage["requests"] > 0:
+                usage["requests"] -= 1
+
+    def settle(self, username, tokens):
+        """呼び出しで消費したトークンを加算"""
+        with self._lock:
+            usage = self._current().setdefault(username, {"requests": 0, "tokens": 0})
+            usage["tokens"] += tokens
+
+    def usage(self, username):
+        with self._lock:
+            return dict(self._current().get(username, {"requests": 0, "tokens": 0}))
+
+    def all_usage(self):
+        with self._lock:
+            return {username: dict(usage) for username, usage in self._current().items()}
+
+
+class _Ticket:
+    def __init__(self, username, weight, priority):
+        self.username = username
+        self.weight = weight
+        self.priority = priority
+        self.granted = threading.Event()
+
+
+class FairShareScheduler:
+    """同時実行数を制限し、空きが出たら優先レーン→重み付きラウンドロビンの順に次の呼び出しを選ぶ
+
+    重み付きラウンドロビンは平滑化版（各ユーザーに重みを加算し、最大のユーザーを選んで合計を引く）。
+    1人が多数の呼び出しを積んでも、他のユーザーの呼び出しは重みの比率で割り込める。
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_CALLS):
+        self.max_concurrent = max(1, max_concurrent)
+        self._active = 0
+        self._priority = deque()
+        self._queues = OrderedDict()
+        self._credits = {}
+        self._lock = threading.Lock()
+
+    def _waiting(self):
+        return len(self._priority) + sum(len(queue) for queue in self._queues.values())
+
+    def _pick_next(self):
+        """次に実行する呼び出し（ロック内で呼ぶ）"""
+        if self._priority:
+            return self._priority.popleft()
+        if not self._queues:
+            return None
+
+        total = 0
+        for username, queue in self._queues.items():
+            weight = queue[0].weight
+            self._credits[username] = self._credits.get(username, 0) + weight
+            total += weight
+        chosen = max(self._queues, key=lambda username: self._credits[username])
+        self._credits[chosen] -= total
+
+        queue = self._queues[chosen]
+        ticket = queue.popleft()
+        if not queue:
+            del self._queues[chosen]
+            del self._credits[chosen]
+        return ticket
+
+    def _remove(self, ticket):
+        """待機中の呼び出しを取り消す（ロック内で呼ぶ）"""
+        if ticket.priority:
+            self._priority.remove(ticket)
+            return
+        queue = self._queues[ticket.username]
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.username]
+            self._credits.pop(ticket.username, None)
+
+    def acquire(self, username, weight=DEFAULT_WEIGHT, priority=False, timeout=QUEUE_TIMEOUT_SECONDS, cancel_event=None):
+        """実行枠を1つ確保する（空くまで待つ）。戻り値をreleaseに渡す
+
+        待機中にcancel_eventがセットされたらCallCancelled、timeout秒を超えたらQueueTimeout。
+        """
+        ticket = _Ticket(username, weight, priority)
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiting():
+                self._active += 1
+                ticket.granted.set()
+                return ticket
+            if priority:
+                self._priority.append(ticket)
+            else:
+                self._queues.setdefault(username, deque()).append(ticket)
+
+        deadline = time.monotonic() + timeout
+        while not ticket.granted.wait(min(CANCEL_POLL_SECONDS, max(0.0, deadline - time.monotonic()))):
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            if cancelled or time.monotonic() >= deadline:
+                with self._lock:
+                    # 取り消す直前に枠を渡された場合はそのまま返す
+                    if not ticket.granted.is_set():
+                        self._remove(ticket)
+                        if cancelled:
+                            raise CallCancelled()
+                        raise QueueTimeout(f"実行待ちが{timeout}秒を超えました。しばらくしてから再度お試しください")
+                break
+        return ticket
+
+    def release(self, ticket):
+        """実行枠を返し、待機中の呼び出しがあれば枠をそのまま渡す"""
+        with self._lock:
+            next_ticket = self._pick_next()
+            if next_ticket is None:
+                self._active -= 1
+            else:
+                next_ticket.granted.set()
+
+    def snapshot(self):
+        """実行中の数と、ユーザー別の待機数"""
+        with self._lock:
+            waiting = {username: len(queue) for username, queue in self._queues.items()}
+            for ticket in self._priority:
+                waiting[ticket.username] = waiting.get(ticket.username, 0) + 1
+            return {"active": self._active, "max_concurrent": self.max_concurrent, "waiting": waiting}
+
+
+# プロセス全体で共有（全セッション・全スレッド共通）
+_default_ledger = UsageLedger()
+_default_scheduler = FairShareScheduler()
+
+
+def run_scheduled_call(client, username, policy, task, model, max_tokens, messages,
+                       requested_at=None, tier=None, cancel_event=None, record_out=None):
+    """利用枠を確認し、実行枠の順番を待ってから run_instrumented_call を呼ぶ
+
+    待ち時間はメトリクスのキュー時間（requested_atから開始まで）に含まれる。
+    上限に達していればQuotaExceeded、待ちが長すぎればQueueTimeout。
+    UNCHARGED_TASKS のタスクは上限の確認だけを行い、リクエスト数には数えない（トークン数は数える）。
+    """
+    if requested_at is None:
+        requested_at = time.perf_counter()
+    record = {} if record_out is None else record_out
+    charged = task not in UNCHARGED_TASKS
+
+    if charged:
+        _default_ledger.reserve(username, policy)
+    else:
+        _default_ledger.check(username, policy)
+    try:
+        with span("queue_wait"):
+            ticket = _default_scheduler.acquire(
+                username,
+                weight=policy["weight"],
+                priority=policy["priority"],
+                cancel_event=cancel_event
+            )
+    except (CallCancelled, QueueTimeout):
+        if charged:
+            _default_ledger.refund(username)
+        raise
+    try:
+        return run_instrumented_call(
+            client,
+            username=username,
+            task=task,
+            model=model,
+            max_tokens=max_tokens,
+            messages=messages,
+            requested_at=requested_at,
+            tier=tier,
+            cancel_event=cancel_event,
+            record_out=record,
+            charged=charged
+        )
+    finally:
+        _default_scheduler.release(ticket)
+        # 打ち切られた・使われなかった先読みも含め、消費したトークンは数える
+        _default_ledger.settle(username, _consumed_tokens(record))
+
+
+def charge_quota(username, policy, record):
+    """実行時に数えなかった呼び出し（使われた先読み）を1リクエストとして数える
+
+    トークン数は実行時に数えているのでここでは数えない。上限に達していればQuotaExceeded（結果は使わない）。
+    """
+    _default_ledger.reserve(username, policy)
+    try:
+        append_csv_rows(DEFERRED_CHARGES_FILE, DEFERRED_CHARGE_FIELDS, [{
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "username": username,
+            "task": record.get("task", ""),
+        }])
+    except Exception as e:
+        print(f"利用枠の記録エラー: {e}")
+
+
+def get_quota_usage(username):
+    """当日の利用数 {"requests", "tokens"}"""
+    return _default_ledger.usage(username)
+
+
+def get_all_quota_usage():
+    return _default_ledger.all_usage()
+
+
+def get_scheduler_status():
+    return _default_scheduler.snapshot()
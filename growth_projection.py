@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import re
+
+import numpy as np
+import pandas as pd
+
+from amount_normalizer import normalize_values
+
+# ============================================
+# 視聴数の推移予測（Day1→Day30の成長倍率から日別の累計視聴数を算出）
+# ============================================
+
+# 参考データの「Day1→Day7: 1.8-5倍」
+_GROWTH_PATTERN = re.compile(
+    r'Day\s*1\s*(?:→|->|～|〜|~)\s*Day\s*(?P<day>\d+)\s*[:：]\s*'
+    r'(?P<low>\d+(?:\.\d+)?)\s*(?:[-~〜～]\s*(?P<high>\d+(?:\.\d+)?))?\s*倍'
+)
+
+# 参考データに成長パターンがない場合の既定値（Switch向けゲームの過去実績）
+DEFAULT_GROWTH_MULTIPLIERS = {3: (1.2, 3.0), 7: (1.8, 5.0), 30: (2.5, 6.0)}
+
+PROJECTION_DAYS = 30
+
+# 7日視聴を基準に曲線を合わせる（参考データの視聴数は7日時点）
+ANCHOR_DAY = 7
+
+# シナリオ: 保守は視聴数・成長倍率の下限とコストの上限、楽観はその逆
+SCENARIOS = ["保守", "中央", "楽観"]
+
+# 「- 10万人級: コスト 10-15万円、CPV 6-10円、7日視聴 14,000-25,000」
+_LINE_PATTERN = re.compile(r'^\s*[-*・]\s*(?P<label>[^:：]+?)\s*[:：]\s*(?P<body>.+)$')
+_RANGE_VALUE = r'(?P<value>\d[\d,]*(?:\.\d+)?\s*(?:億|万|千)?\s*円?(?:\s*[-~〜～]\s*\d[\d,]*(?:\.\d+)?\s*(?:億|万|千)?\s*円?)?)'
+_COST_PATTERN = re.compile(r'コスト\s*' + _RANGE_VALUE)
+_VIEWS_PATTERN = re.compile(r'7日視聴\s*' + _RANGE_VALUE)
+
+# 要約表に出す日
+SUMMARY_DAYS = [1, 3, 7, 14, 30]
+
+
+def parse_growth_multipliers(reference_text):
+    """参考データから Day1→DayN の成長倍率 {N: (下限, 上限)} を取得（なければ既定値）"""
+    multipliers = {}
+    for match in _GROWTH_PATTERN.finditer(reference_text or ""):
+        low = float(match.group("low"))
+        high = float(match.group("high") or low)
+        multipliers[int(match.group("day"))] = (min(low, high), max(low, high))
+    return multipliers or dict(DEFAULT_GROWTH_MULTIPLIERS)
+
+
+def fit_growth_curves(multipliers, days=PROJECTION_DAYS):
+    """シナリオ別の成長曲線（Day1を1とする累計視聴の倍率）を shape (シナリオ数, 日数) で返す
+
+    アンカー（Day1=1倍と参考データの各日）の間を対数日数で線形補間する。
+    最後のアンカー以降は横ばい、累計なので単調増加に補正する。
+    """
+    anchor_days = np.array([1] + sorted(day for day in multipliers if day > 1), dtype=float)
+    low = np.array([1.0] + [multipliers[int(day)][0] for day in anchor_days[1:]])
+    high = np.array([1.0] + [multipliers[int(day)][1] for day in anchor_days[1:]])
+    anchors = np.stack([low, (low + high) / 2, high])
+
+    log_days = np.log(np.arange(1, days + 1, dtype=float))
+    log_anchor_days = np.log(anchor_days)
+    curves = np.stack([np.interp(log_days, log_anchor_days, values) for values in anchors])
+    return np.maximum.accumulate(curves, axis=1)
+
+
+def parse_line_items(reference_text):
+    """参考データからコストと7日視聴のある行（フォロワー規模別の実績など）を取り出す
+
+    戻り値の列: label, cost_min, cost_max（円）, views_min, views_max
+    """
+    labels, costs, views = [], [], []
+    for line in (reference_text or "").splitlines():
+        match = _LINE_PATTERN.match(line)
+        if not match:
+            continue
+        cost = _COST_PATTERN.search(match.group("body"))
+        view = _VIEWS_PATTERN.search(match.group("body"))
+        if cost and view:
+            labels.append(match.group("label"))
+            costs.append(cost.group("value").strip())
+            views.append(view.group("value").strip())
+
+    if not labels:
+        return pd.DataFrame(columns=["label", "cost_min", "cost_max", "views_min", "views_max"])
+
+    # コストと視聴数を1回の正規化でまとめて数値化
+    normalized = normalize_values(pd.Series(costs + views))
+    count = len(labels)
+    items = pd.DataFrame({
+        "label": labels,
+        "cost_min": normalized["min"].to_numpy()[:count],
+        "cost_max": normalized["max"].to_numpy()[:count],
+        "views_min": normalized["min"].to_numpy()[count:],
+        "views_max": normalized["max"].to_numpy()[count:],
+    })
+    return items.dropna(subset=["cost_min", "views_min"]).reset_index(drop=True)
+
+
+def project_views(items, curves, anchor_day=ANCHOR_DAY):
+    """全施策・全日の累計視聴数とCPVを一括で計算
+
+    戻り値は (累計視聴, CPV) で、どちらも shape (シナリオ数, 施策数, 日数)。
+    """
+    views_7d = np.stack([
+        items["views_min"].to_numpy(dtype=float),
+        (items["views_min"].to_numpy(dtype=float) + items["views_max"].to_numpy(dtype=float)) / 2,
+        items["views_max"].to_numpy(dtype=float),
+    ])
+    cost = np.stack([
+        items["cost_max"].to_numpy(dtype=float),
+        (items["cost_min"].to_numpy(dtype=float) + items["cost_max"].to_numpy(dtype=float)) / 2,
+        items["cost_min"].to_numpy(dtype=float),
+    ])
+
+    # 7日時点の視聴数を通るように7日目の倍率で割る。7日目以降の伸び（Day30/Day7）は下限側の曲線の方が
+    # 大きくなりうるため、保守・楽観は日ごとに各曲線の最小・最大をとる
+    ratios = curves / curves[:, anchor_day - 1:anchor_day]
+    ratios = np.stack([ratios.min(axis=0), ratios[1], ratios.max(axis=0)])
+    views = views_7d[:, :, None] * ratios[:, None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cpv = np.where(views > 0, cost[:, :, None] / views, np.nan)
+    return views, cpv
+
+
+def build_growth_projection(reference_text, days=PROJECTION_DAYS):
+    """参考データから視聴数の推移予測を作成
+
+    戻り値は (要約表, 日別の推移)。日別の推移は 日数・施策・シナリオ・累計視聴・CPV(円) の縦持ち。
+    コストと7日視聴のある行がなければ空のDataFrameを返す。
+    """
+    items = parse_line_items(reference_text)
+    if items.empty:
+        return pd.DataFrame(), pd.DataFrame()
+
+    days = max(days, ANCHOR_DAY)
+    curves = fit_growth_curves(parse_growth_multipliers(reference_text), days)
+    views, cpv = project_views(items, curves)
+
+    # 同じ名前の行（ジャンル別に同じ規模がある等）は番号を付けて区別
+    labels = items["label"].where(~items["label"].duplicated(keep=False), items["label"] + " #" + (items.index + 1).astype(str))
+
+    scenario_count, item_count, day_count = views.shape
+    curve_df = pd.DataFrame({
+        "日数": np.tile(np.arange(1, day_count + 1), scenario_count * item_count),
+        "施策": np.tile(np.repeat(labels.to_numpy(), day_count), scenario_count),
+        "シナリオ": np.repeat(SCENARIOS, item_count * day_count),
+        "累計視聴": views.ravel().round(0),
+        "CPV(円)": cpv.ravel().round(2),
+    })
+
+    middle = SCENARIOS.index("中央")
+    summary = pd.DataFrame({"施策": labels, "コスト(万円)": ((items["cost_min"] + items["cost_max"]) / 2 / 1e4).round(1)})
+    for day in [day for day in SUMMARY_DAYS if day <= day_count]:
+        summary[f"Day{day}視聴"] = views[middle, :, day - 1].round(0)
+    summary[f"Day{day_count}視聴(保守)"] = views[0, :, -1].round(0)
+    summary[f"Day{day_count}視聴(楽観)"] = views[-1, :, -1].round(0)
+    summary["CPV Day7(円)"] = cpv[middle, :, ANCHOR_DAY - 1].round(2)
+    summary[f"CPV Day{day_count}(円)"] = cpv[middle, :, -1].round(2)
+    return summary, curve_df
@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+"""Anthropic APIの記録・再生・モック用トランスポート
+
+環境変数 LLM_TRANSPORT で切り替える:
+    live   : 通常どおりAnthropic APIへ接続（既定）
+    record : APIへの要求と応答（ストリーミングイベント・usageを含む）をカセットに記録
+    replay : カセットから応答を再生（ネットワーク不要）
+    mock   : 合成応答を返す（遅延・トークン速度・エラー注入を設定可能）
+
+record/replay/mock ではローカルにMessages API互換のHTTPサーバーを起動し、
+SDKの base_url をそこへ向ける。SDKのストリーミング処理やリトライもそのまま動く。
+
+単体起動（負荷試験で別プロセスから使う場合）:
+    python -m llm_transport --mode mock --port 8765
+    LLM_BASE_URL=http://127.0.0.1:8765 streamlit run marketing_budget_optimizer_v2_step3_clean.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import anthropic
+
+TRANSPORT_MODES = ("live", "record", "replay", "mock")
+
+DEFAULT_CASSETTE = os.path.join("logs", "llm_cassette.jsonl")
+
+UPSTREAM_URL = "https://api.anthropic.com"
+
+# モックの既定値（環境変数 LLM_MOCK_* で上書き）
+DEFAULT_MOCK_SETTINGS = {
+    "latency_ms": 800,          # 最初のトークンまでの待ち時間
+    "jitter_ms": 200,           # 待ち時間のばらつき
+    "tokens_per_second": 80,    # 出力速度
+    "error_rate": 0.0,          # エラーを返す確率（0-1）
+    "error_kinds": "429,529,timeout",
+    "timeout_seconds": 30,      # timeout注入時に応答を止める秒数
+    "seed": "",
+}
+
+# 再生時に記録時の間隔を再現するか
+REPLAY_REALTIME_ENV = "LLM_REPLAY_REALTIME"
+
+
+class CassetteMissError(Exception):
+    """カセットに該当する記録がない"""
+
+
+# ============================================
+# 設定
+# ============================================
+
+def get_transport_mode():
+    """現在のトランスポートモード"""
+    mode = os.environ.get("LLM_TRANSPORT", "live").strip().lower()
+    if mode not in TRANSPORT_MODES:
+        raise ValueError(f"LLM_TRANSPORT は {', '.join(TRANSPORT_MODES)} のいずれかを指定してください: {mode}")
+    return mode
+
+
+def is_offline_transport():
+    """APIキーなしで動作するモードか"""
+    return bool(os.environ.get("LLM_BASE_URL")) or get_transport_mode() in ("replay", "mock")
+
+
+def load_mock_settings():
+    """環境変数からモック設定を読み込み"""
+    settings = dict(DEFAULT_MOCK_SETTINGS)
+    for key, default in DEFAULT_MOCK_SETTINGS.items():
+        value = os.environ.get(f"LLM_MOCK_{key.upper()}")
+        if value is None:
+            continue
+        settings[key] = type(default)(value) if not isinstance(default, str) else value
+    return settings
+
+
+def request_key(path, body):
+    """要求内容から再生用のキーを作成"""
+    canonical = json.dumps(body, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{path}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text):
+    """トークン数の概算（日本語はおおむね1-2文字で1トークン）"""
+    return max(1, len(text) // 2)
+
+
+def _request_text(body):
+    """messages/system内のテキストを連結"""
+    parts = [body.get("system") or ""] if isinstance(body.get("system"), str) else []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content or [] if isinstance(block, dict))
+    return "\n".join(parts)
+
+
+# ============================================
+# SSE（Messages APIのストリーミング形式）
+# ============================================
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _message_body(model, text, input_tokens, output_tokens, stop_reason):
+    return {
+        "id": f"msg_offline_{random.getrandbits(48):012x}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        },
+    }
+
+
+def _stream_events(message, chunks):
+    """(待ち秒数, SSEバイト列) のイテレータ"""
+    start = dict(message, content=[], stop_reason=None)
+    start["usage"] = dict(message["usage"], output_tokens=1)
+    yield 0, _sse("message_start", {"type": "message_start", "message": start})
+    yield 0, _sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+    for delay, text in chunks:
+        yield delay, _sse("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}})
+    yield 0, _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+    yield 0, _sse("message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]},
+    })
+    yield 0, _sse("message_stop", {"type": "message_stop"})
+
+
+# ============================================
+# 合成応答（mock）
+# ============================================
+
+def synthesize_response(prompt):
+    """プロンプトの回答形式に沿った合成応答"""
+    marker = "以下の形式で回答してください:"
+    if marker not in prompt:
+        return "API test successful!"
+
+    template = prompt.split(marker, 1)[1].strip()
+    rng = random.Random(len(template))
+
+    def fill(match):
+        return f"{rng.randint(1, 999):,}"
+
+    lines = []
+    for line in template.split("\n"):
+        line = re.sub(r'\.\.\.', fill, line)
+        lines.append(line)
+        if line.startswith("## ") and "2." not in line:
+            lines.append("")
+            lines.append("合成応答の本文です。参考データの範囲内で見積もっています。")
+    return "\n".join(lines)
+
+
+def _mock_chunks(text, settings, rng):
+    """出力テキストをトークン速度に合わせて分割"""
+    chunk_chars = 16
+    delay_per_chunk = (chunk_chars / 2) / max(settings["tokens_per_second"], 1e-6)
+    first_delay = max(0.0, (settings["latency_ms"] + rng.uniform(-1, 1) * settings["jitter_ms"]) / 1000)
+    for i in range(0, len(text), chunk_chars):
+        yield (first_delay if i == 0 else delay_per_chunk), text[i:i + chunk_chars]
+
+
+# ============================================
+# HTTPサーバー
+# ============================================
+
+class _TransportHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # アクセスごとの標準出力は抑制
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0]
+
+        try:
+            if self.server.mode == "record":
+                self._record(path, body)
+            elif self.server.mode == "replay":
+                self._replay(path, body)
+            else:
+                self._mock(path, body)
+        except CassetteMissError as e:
+            self._send_error(404, "not_found_error", str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    # --- 共通 ---
+
+    def _send_json(self, status, data, extra_headers=None):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status, error_type, message):
+        headers = {"retry-after": "1"} if status in (429, 529) else None
+        self._send_json(status, {"type": "error", "error": {"type": error_type, "message": message}}, headers)
+
+    def _send_stream(self, events, realtime=True):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for delay, payload in events:
+            if realtime and delay > 0:
+                time.sleep(delay)
+            self.wfile.write(payload)
+            self.wfile.flush()
+        self.close_connection = True
+
+    # --- mock ---
+
+    def _mock(self, path, body):
+        settings = self.server.mock_settings
+        rng = self.server.rng
+        prompt = _request_text(body)
+
+        if path.endswith("/count_tokens"):
+            self._send_json(200, {"input_tokens": estimate_tokens(prompt)})
+            return
+
+        if settings["error_rate"] > 0 and rng.random() < settings["error_rate"]:
+            kinds = [k.strip() for k in settings["error_kinds"].split(",") if k.strip()]
+            kind = rng.choice(kinds) if kinds else "529"
+            if kind == "429":
+                self._send_error(429, "rate_limit_error", "モック: レート制限")
+                return
+            if kind == "timeout":
+                time.sleep(settings["timeout_seconds"])
+            self._send_error(529, "overloaded_error", "モック: 過負荷")
+            return
+
+        text = synthesize_response(prompt)
+        max_tokens = body.get("max_tokens", 4096)
+        stop_reason = "end_turn"
+        if estimate_tokens(text) > max_tokens:
+            text = text[:max_tokens * 2]
+            stop_reason = "max_tokens"
+
+        message = _message_body(body.get("model", "mock"), text, estimate_tokens(prompt), estimate_tokens(text), stop_reason)
+        chunks = list(_mock_chunks(text, settings, rng))
+
+        if body.get("stream"):
+            self._send_stream(_stream_events(message, chunks))
+        else:
+            time.sleep(sum(delay for delay, _ in chunks))
+            self._send_json(200, message)
+
+    # --- record ---
+
+    def _record(self, path, body):
+        request = urllib.request.Request(
+            self.server.upstream_url + path,
+            data=json.dumps(body).encode("utf-8"),
+            method="POST",
+        )
+        for name in ("x-api-key", "anthropic-version", "anthropic-beta", "content-type"):
+            if self.headers.get(name):
+                request.add_header(name, self.headers[name])
+
+        entry = {
+            "key": request_key(path, body),
+            "path": path,
+            "request": body,
+            "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+        try:
+            upstream = urllib.request.urlopen(request, timeout=600)
+        except urllib.error.HTTPError as e:
+            # エラー応答は記録せずそのまま返す
+            payload = e.read()
+            self.send_response(e.code)
+            self.send_header("Content-Type", e.headers.get("Content-Type", "application/json"))
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        with upstream:
+            if not body.get("stream"):
+                data = json.loads(upstream.read())
+                entry["status"] = upstream.status
+                entry["body"] = data
+                self.server.cassette.append(entry)
+                self._send_json(upstream.status, data)
+                return
+
+            self.send_response(upstream.status)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            events = []
+            started = time.perf_counter()
+            last = started
+            buffer = b""
+            for line in upstream:
+                buffer += line
+                self.wfile.write(line)
+                self.wfile.flush()
+                if line.strip():
+                    continue
+                # 空行でイベントが区切られる
+                now = time.perf_counter()
+                events.append([round(now - last, 4), buffer.decode("utf-8")])
+                last = now
+                buffer = b""
+
+            entry["status"] = upstream.status
+            entry["events"] = events
+            self.server.cassette.append(entry)
+            self.close_connection = True
+
+    # --- replay ---
+
+    def _replay(self, path, body):
+        entry = self.server.cassette.find(request_key(path, body))
+        if entry is None:
+            raise CassetteMissError(f"カセットに記録がありません: {path}")
+
+        if "events" in entry:
+            events = ((delay, text.encode("utf-8")) for delay, text in entry["events"])
+            self._send_stream(events, realtime=self.server.replay_realtime)
+        else:
+            self._send_json(entry.get("status", 200), entry["body"])
+
+
+class Cassette:
+    """要求と応答の記録（JSON Lines）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+
+    def find(self, key):
+        return self._entries.get(key)
+
+    def append(self, entry):
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def start_transport_server(mode, host="127.0.0.1", port=0, cassette_path=None, mock_settings=None):
+    """トランスポートサーバーをバックグラウンドで起動し、サーバーを返す"""
+    server = ThreadingHTTPServer((host, port), _TransportHandler)
+    server.daemon_threads = True
+    server.mode = mode
+    server.upstream_url = os.environ.get("LLM_UPSTREAM_URL", UPSTREAM_URL)
+    server.cassette = Cassette(cassette_path or os.environ.get("LLM_CASSETTE", DEFAULT_CASSETTE))
+    server.mock_settings = mock_settings or load_mock_settings()
+    seed = server.mock_settings.get("seed")
+    server.rng = random.Random(int(seed)) if seed not in ("", None) else random.Random()
+    server.replay_realtime = os.environ.get(REPLAY_REALTIME_ENV, "") == "1"
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# プロセス内で共有するサーバー（Streamlitの全セッションで1つ）
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_base_url():
+    """現在のモードで使う base_url（live では None）"""
+    if os.environ.get("LLM_BASE_URL"):
+        return os.environ["LLM_BASE_URL"]
+
+    mode = get_transport_mode()
+    if mode == "live":
+        return None
+
+    with _servers_lock:
+        if mode not in _servers:
+            _servers[mode] = start_transport_server(mode)
+        host, port = _servers[mode].server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def create_client(api_key, **kwargs):
+    """モードに応じたAnthropicクライアントを作成"""
+    base_url = get_base_url()
+    if base_url is None:
+        return anthropic.Anthropic(api_key=api_key, **kwargs)
+
+    if get_transport_mode() == "mock":
+        # タイムアウト注入時にクライアント側が先に打ち切るよう短めに設定
+        kwargs.setdefault("timeout", float(load_mock_settings()["timeout_seconds"]) / 2)
+    return anthropic.Anthropic(api_key=api_key or "offline", base_url=base_url, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Anthropic API 記録・再生・モックサーバー")
+    parser.add_argument("--mode", choices=["record", "replay", "mock"], default="mock")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cassette", default=None, help=f"カセットファイル（既定: {DEFAULT_CASSETTE}）")
+    args = parser.parse_args(argv)
+
+    server = start_transport_server(args.mode, args.host, args.port, args.cassette)
+    print(f"{args.mode} サーバー起動: http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import csv
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス内の排他だけ行う
+    fcntl = None
+
+# ============================================
+# ログ・データファイルの共通処理
+# ============================================
+#
+# トレーシング（アプリのimportより前に読み込まれる）からも使うので、標準ライブラリだけに依存する。
+#
+# CSVログへの追記と、古い行の圧縮（cold_storage）によるファイルの書き換えは、
+# 同じロック（ファイルごとの「<ファイル名>.lock」へのflock）を取ってから行う。
+# ロックなしで追記すると、書き換え中に追記した行が置き換え前のファイルに書かれて失われる。
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+_held = threading.local()
+
+# 追記のたびに開き直さないよう、ロック用ファイルはプロセスごとに開いたままにする
+# （fork後の子プロセスは親と同じファイルを共有するとflockで排他されないので、プロセスIDが変わったら開き直す）
+_lock_files = {}
+
+
+def file_signature(path):
+    """ファイルの更新検知用キー（更新時刻とサイズ）。ファイルがなければNone
+
+    st.cache_data のキーに渡し、ファイルが変わったときだけ再読込させる。
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@contextmanager
+def locked_file(path):
+    """pathへの書き込みの排他（プロセス内のスレッド間とプロセス間）。同じスレッドからは入れ子にできる"""
+    key = os.path.abspath(path)
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(key, threading.RLock())
+
+    with thread_lock:
+        depths = _held.__dict__.setdefault("depths", {})
+        depth = depths.get(key, 0)
+        depths[key] = depth + 1
+        try:
+            if depth == 0 and fcntl is not None:
+                lock_file = _lock_file(key)
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                yield
+        finally:
+            depths[key] = depth
+
+
+def _lock_file(key):
+    """keyのロック用ファイル（スレッドのロック内で呼ぶ）"""
+    pid, lock_file = _lock_files.get(key, (None, None))
+    if pid != os.getpid():
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        lock_file = open(key + ".lock", "a")
+        _lock_files[key] = (os.getpid(), lock_file)
+    return lock_file
+
+
+def append_csv_rows(path, fieldnames, rows, extrasaction="raise"):
+    """CSVに行を追記（ファイルがなければ見出しも書く）。locked_file のロック内で行う"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with locked_file(path):
+        file_exists = os.path.isfile(path)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction=extrasaction)
+            if not file_exists:
+                writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import streamlit as st
+
+# ============================================
+# ログイン試行のスライディングウィンドウ制限
+# ============================================
+
+# ユーザー名ごとの上限（WINDOW_SECONDS内の試行回数）
+MAX_ATTEMPTS_PER_USER = 5
+# 接続元ごとの上限（複数ユーザー名への総当たり対策）
+MAX_ATTEMPTS_PER_CLIENT = 20
+WINDOW_SECONDS = 300
+
+# 記録するキーの上限（大量のユーザー名を試されてもメモリが増え続けないように）
+MAX_TRACKED_KEYS = 10000
+
+# 前段にある信頼できるプロキシの数。0ならX-Forwarded-Forは使わず接続元IPを使う
+# （X-Forwarded-Forの先頭はクライアントが自由に書けるため、信頼できるプロキシが追記した値だけを使う）
+TRUSTED_PROXY_HOPS = int(os.environ.get("LOGIN_TRUSTED_PROXY_HOPS", "0"))
+
+# プロキシの内側で未設定のまま動かすと全員が同じ接続元（プロキシ）になり、接続元ごとの上限を共有してしまう
+if "LOGIN_TRUSTED_PROXY_HOPS" not in os.environ:
+    print("警告: LOGIN_TRUSTED_PROXY_HOPS が未設定のため、直接の接続元IPでログイン試行を制限します。"
+          "リバースプロキシの内側で動かす場合は信頼できるプロキシの段数を設定してください（直接公開する場合は0）")
+
+
+class SlidingWindowLimiter:
+    """キーごとに直近window_seconds秒の試行時刻を保持する制限器（スレッドセーフ）"""
+
+    def __init__(self, max_attempts, window_seconds, max_keys=MAX_TRACKED_KEYS):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and now - attempts[0] >= self.window_seconds:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return None
+        return attempts
+
+    def hit(self, key, now=None):
+        """試行を1回数え、許可なら (True, 0)、超過なら (False, 再試行までの秒数) を返す
+
+        超過した試行は数えない（制限中に試行を続けても解除が延びないように）。
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            attempts = self._prune(key, now)
+            if attempts is not None and len(attempts) >= self.max_attempts:
+                return False, self.window_seconds - (now - attempts[0])
+
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+            attempts.append(now)
+            self._attempts.move_to_end(key)
+
+            # 上限を超えたら最も古くから更新のないキーを捨てる
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+            return True, 0
+
+    def refund(self, key):
+        """直前に数えた試行を取り消す（別の制限で拒否された試行を数えないように）"""
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts:
+                attempts.pop()
+                if not attempts:
+                    del self._attempts[key]
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+class ThrottleEventAggregator:
+    """制限された試行をキーごと・ウィンドウごとに1件へ集約する"""
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [now, 1]
+            else:
+                entry[1] += 1
+
+    def drain(self, now=None):
+        """ウィンドウが終わった集計を [(キー, 件数)] で返して破棄"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [key for key, (started, _) in self._pending.items() if now - started >= self.window_seconds]
+            return [(key, self._pending.pop(key)[1]) for key in expired]
+
+
+# プロセス全体で共有（全セッション・全スレッド共通）
+_user_limiter = SlidingWindowLimiter(MAX_ATTEMPTS_PER_USER, WINDOW_SECONDS)
+_client_limiter = SlidingWindowLimiter(MAX_ATTEMPTS_PER_CLIENT, WINDOW_SECONDS)
+_throttle_events = ThrottleEventAggregator(WINDOW_SECONDS)
+
+
+def get_client_id(trusted_hops=TRUSTED_PROXY_HOPS):
+    """接続元の識別子。取得できなければNone
+
+    trusted_hopsが1以上なら、X-Forwarded-Forの末尾からtrusted_hops番目
+    （最も外側の信頼できるプロキシが追記した接続元）を使う。
+    """
+    try:
+        if trusted_hops > 0:
+            headers = st.context.headers
+            forwarded = headers.get("X-Forwarded-For") if headers else None
+            hops = [hop.strip() for hop in forwarded.split(",")] if forwarded else []
+            if len(hops) >= trusted_hops and hops[-trusted_hops]:
+                return hops[-trusted_hops]
+        return getattr(st.context, "ip_address", None)
+    except Exception:
+        return None
+
+
+def check_login_attempt(username, client_id=None):
+    """ログイン試行を許可するか判定。制限中なら再試行までの秒数を返す（許可なら0）
+
+    Secretsの参照やログ書き込みより前に呼ぶ。接続元の試行はユーザー名の制限を通った試行だけ数える
+    （制限中のユーザー名への試行で、同じ接続元（同じプロキシの内側）の他のユーザーまで締め出さないように）。
+    """
+    allowed, retry_after = _user_limiter.hit(f"user:{username}")
+    if not allowed:
+        _throttle_events.add(("user", username))
+        return retry_after
+
+    if client_id:
+        allowed, retry_after = _client_limiter.hit(f"client:{client_id}")
+        if not allowed:
+            _user_limiter.refund(f"user:{username}")
+            _throttle_events.add(("client", client_id))
+            return retry_after
+    return 0
+
+
+def record_login_success(username):
+    """ログイン成功時にユーザー名の試行回数をリセット"""
+    _user_limiter.reset(f"user:{username}")
+
+
+def pending_throttle_events():
+    """ウィンドウが終わった制限イベントを (ユーザー名, 詳細) のリストで返す
+
+    制限された試行はウィンドウごとに1件へまとめて記録する。
+    """
+    events = []
+    for (kind, value), count in _throttle_events.drain():
+        if kind == "user":
+            events.append((value, f"ログイン試行を{count}回制限（{WINDOW_SECONDS}秒間）"))
+        else:
+            events.append(("unknown", f"接続元 {value} からのログイン試行を{count}回制限（{WINDOW_SECONDS}秒間）"))
+    return events
@@ -1,12 +1,81 @@
 # -*- coding: utf-8 -*-
+from tracing import start_trace, start_span, traced
+
+# スクリプト1回の実行全体を最上位のスパンにする（APP_TRACING=1 のときだけ記録）
+script_span = start_trace("script_run")
+import_span = start_span("import")
+
 import streamlit as st
-import anthropic
 import pandas as pd
 from datetime import datetime
 import hmac
-import os
-import csv
-import re
+import math
+import time
+import uuid
+
+from access_log import log_access, get_access_logs, get_log_signature
+from login_throttle import check_login_attempt, record_login_success, pending_throttle_events, get_client_id
+from llm_transport import create_client, get_transport_mode, is_offline_transport
+from telemetry import (
+    get_api_metrics,
+    get_metrics_signature,
+    summarize_api_metrics,
+    summarize_by_tier,
+    daily_api_trend,
+)
+from fair_scheduler import (
+    run_scheduled_call,
+    charge_quota,
+    get_user_policy,
+    get_quota_usage,
+    get_all_quota_usage,
+    get_scheduler_status,
+    QuotaExceeded,
+    QueueTimeout,
+)
+from model_routing import route_model, get_tier_label, DRAFT_TIER, FULL_TIER
+from speculation import (
+    speculation_key,
+    schedule_speculation,
+    cancel_speculation,
+    take_speculation,
+    get_speculation_log,
+    get_speculation_signature,
+    summarize_speculation,
+    DEFAULT_DELAY_SECONDS,
+)
+from prompt_builder import (
+    format_reference_for_prompt,
+    count_prompt_tokens,
+    build_analysis_prompt,
+    estimate_max_tokens,
+    REPORT_SECTIONS,
+    ALL_SECTION_IDS,
+    TABLES_ONLY_SECTION_IDS,
+)
+from result_parser import parse_result_tree, table_to_dataframe
+from delta_analysis import plan_delta, is_delta_applicable, build_delta_prompt, merge_results, describe_plan, IncompleteDeltaError
+from amount_normalizer import build_pattern_comparison
+from growth_projection import build_growth_projection, SCENARIOS as PROJECTION_SCENARIOS
+from budget_pacing import build_pacing_schedule
+from roster_solver import (
+    tier_candidates,
+    roster_candidates,
+    solve_roster,
+    format_roster_constraint,
+    OBJECTIVES as ROSTER_OBJECTIVES,
+    DEFAULT_MAX_PER_TIER,
+)
+from portfolio import optimize_portfolio, TITLE_COLUMNS as PORTFOLIO_TITLE_COLUMNS
+from cold_storage import run_tiering, summarize_storage, get_index_signature, COLD_AFTER_DAYS
+from analysis_archive import archive_analysis, load_analysis, search_analyses
+from reference_import import file_digest, read_reference_workbook, combine_reference_sections
+from xlsx_export import build_result_workbook
+from reference_index import select_reference_text, DEFAULT_TOP_K
+from campaign_store import read_campaign_file, ingest_campaigns, list_genres, generate_reference_text, get_store_signature
+from tracing import get_trace_spans, get_trace_signature, summarize_spans, daily_span_trend, recent_traces, trace_breakdown
+
+import_span.end()
 
 # ページ設定
 st.set_page_config(
@@ -61,60 +130,11 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ============================================
-# ステップ3: アクセスログ記録機能
-# ============================================
-
-def ensure_log_directory():
-    """ログディレクトリの作成"""
-    log_dir = "logs"
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    return log_dir
-
-def log_access(username, action, details=""):
-    """アクセスログの記録"""
-    try:
-        log_dir = ensure_log_directory()
-        log_file = os.path.join(log_dir, "access_log.csv")
-        
-        log_entry = {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "username": username,
-            "display_name": st.session_state.get("user_display_name", username),
-            "action": action,
-            "details": details
-        }
-        
-        file_exists = os.path.isfile(log_file)
-        
-        with open(log_file, "a", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=["timestamp", "username", "display_name", "action", "details"])
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(log_entry)
-            
-    except Exception as e:
-        print(f"ログ記録エラー: {e}")
-
-def get_access_logs():
-    """アクセスログの取得"""
-    log_file = os.path.join("logs", "access_log.csv")
-    
-    if os.path.exists(log_file):
-        try:
-            df = pd.read_csv(log_file)
-            return df
-        except Exception as e:
-            st.error(f"ログファイルの読み込みに失敗しました: {e}")
-            return None
-    else:
-        return None
-
 # ============================================
 # ステップ2: ユーザー別パスワード認証
 # ============================================
 
+@traced("check_password")
 def check_password():
     """ユーザー名とパスワードによる認証"""
     
@@ -129,7 +149,12 @@ def check_password():
             submit = st.form_submit_button("ログイン", type="primary", use_container_width=True)
             
             if submit:
-                if "users" in st.secrets:
+                # 総当たり対策: Secretsの参照やログ書き込みより前に試行回数を制限
+                retry_after = check_login_attempt(username, get_client_id())
+
+                if retry_after:
+                    st.error(f"ログイン試行が多すぎます。{math.ceil(retry_after)}秒後に再度お試しください")
+                elif "users" in st.secrets:
                     users = st.secrets["users"]
                     
                     if username in users:
@@ -140,6 +165,7 @@ def check_password():
                             st.session_state["username"] = username
                             st.session_state["user_display_name"] = users[username].get("display_name", username)
                             
+                            record_login_success(username)
                             log_access(username, "login", "ログイン成功")
                             
                             st.rerun()
@@ -156,6 +182,7 @@ def check_password():
                         st.session_state["username"] = username
                         st.session_state["user_display_name"] = "管理者"
                         
+                        record_login_success(username)
                         log_access(username, "login", "ログイン成功（デフォルト認証）")
                         
                         st.rerun()
@@ -166,6 +193,10 @@ def check_password():
     #       st.caption("Secretsが未設定の場合、以下でログインできます：")
     #       st.code("ユーザー名: admin\nパスワード: krafton2024")
 
+    # ウィンドウが終わった制限イベントを記録（次のログイン送信を待たず、どのセッションの実行でも書き出す）
+    for throttled_user, details in pending_throttle_events():
+        log_access(throttled_user, "login_throttled", details, display_name=throttled_user)
+
     if "password_correct" not in st.session_state:
         login_form()
         return False
@@ -177,83 +208,36 @@ def check_password():
 
 # パスワード認証をチェック
 if not check_password():
+    script_span.end()
     st.stop()
 
-# ============================================
-# 結果パース関数（新規追加）
-# ============================================
-
-def parse_markdown_table(markdown_text):
-    """マークダウン表をDataFrameに変換"""
-    lines = markdown_text.strip().split('\n')
-    
-    if len(lines) < 2:
-        return None
-    
-    # ヘッダー行を取得
-    headers = [h.strip() for h in lines[0].split('|') if h.strip()]
-    
-    # データ行を取得（区切り線をスキップ）
-    data_rows = []
-    for line in lines[2:]:
-        if line.strip():
-            cells = [c.strip() for c in line.split('|') if c.strip()]
-            if len(cells) == len(headers):
-                data_rows.append(cells)
-    
-    if data_rows:
-        return pd.DataFrame(data_rows, columns=headers)
-    return None
-
-def extract_metrics_from_text(text):
-    """テキストから主要メトリクスを抽出"""
-    metrics = {}
-    
-    # 総計を抽出
-    total_match = re.search(r'総計.*?(\d+,?\d*)\s*万円', text)
-    if total_match:
-        metrics['総予算'] = total_match.group(1) + '万円'
-    
-    # 期待販売本数を抽出
-    sales_match = re.search(r'期待販売本数.*?(\d+,?\d*)\s*本', text)
-    if sales_match:
-        metrics['期待販売本数'] = sales_match.group(1) + '本'
-    
-    # ROIを抽出
-    roi_match = re.search(r'想定ROI.*?(\d+)', text)
-    if roi_match:
-        metrics['想定ROI'] = roi_match.group(1) + '%'
-    
-    return metrics
-
-def parse_analysis_result(result_text):
-    """分析結果をセクションごとに分割"""
-    sections = {}
-    current_section = None
-    current_content = []
-    
-    for line in result_text.split('\n'):
-        # セクションヘッダーを検出（## で始まる行）
-        if line.startswith('## '):
-            if current_section:
-                sections[current_section] = '\n'.join(current_content)
-            current_section = line.replace('## ', '').strip()
-            current_content = []
-        elif line.startswith('### '):
-            # サブセクションもコンテンツに含める
-            current_content.append(line)
-        else:
-            current_content.append(line)
-    
-    # 最後のセクションを追加
-    if current_section:
-        sections[current_section] = '\n'.join(current_content)
-    
-    return sections
-
 # ============================================
 # ここから通常のアプリコード
 # ============================================
+# 画面は独立して再実行されるフラグメントに分割する。
+# 入力欄を編集しても、そのフラグメントだけが再実行される。
+
+def get_current_user_policy():
+    """ログイン中のユーザーの利用枠・重み・優先レーン（st.secrets["users"] の設定）"""
+    username = st.session_state.get("username", "unknown")
+    users = st.secrets["users"] if "users" in st.secrets else {}
+    return get_user_policy(username, users.get(username))
+
+def render_quota_usage():
+    """本日の利用状況（上限がある項目は進捗バー）"""
+    policy = get_current_user_policy()
+    usage = get_quota_usage(st.session_state.get("username", "unknown"))
+    st.markdown("### 本日の利用状況")
+    for label, used, quota, unit in [
+        ("リクエスト", usage["requests"], policy["daily_requests"], "回"),
+        ("トークン", usage["tokens"], policy["daily_tokens"], ""),
+    ]:
+        if quota:
+            st.progress(min(used / quota, 1.0), text=f"{label}: {used:,} / {quota:,}{unit}")
+        else:
+            st.caption(f"{label}: {used:,}{unit}（上限なし）")
+    if policy["priority"]:
+        st.caption("優先レーンで実行されます")
 
 # ログインユーザー情報の表示
 with st.sidebar:
@@ -289,49 +273,15 @@ st.title("マーケティング予算最適化AI v2.0")
 st.caption("実績データに基づく現実的な予算配分案を提案")
 st.markdown("---")
 
-# アクセスログ表示（管理者のみ）
-if st.session_state.get("show_logs", False) and st.session_state.get("username") == "admin":
-    st.subheader("アクセスログ")
-    
-    logs_df = get_access_logs()
-    
-    if logs_df is not None and not logs_df.empty:
-        logs_df_sorted = logs_df.sort_values("timestamp", ascending=False)
-        
-        # 統計情報
-        col_stat1, col_stat2, col_stat3 = st.columns(3)
-        with col_stat1:
-            st.metric("総アクセス数", len(logs_df))
-        with col_stat2:
-            unique_users = logs_df["username"].nunique()
-            st.metric("ユニークユーザー数", unique_users)
-        with col_stat3:
-            login_count = len(logs_df[logs_df["action"] == "login"])
-            st.metric("ログイン回数", login_count)
-        
-        st.dataframe(
-            logs_df_sorted,
-            use_container_width=True,
-            height=300
-        )
-        
-        csv_data = logs_df.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            label="ログをCSVでダウンロード",
-            data=csv_data,
-            file_name=f"access_log_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv"
-        )
-    else:
-        st.info("まだアクセスログがありません")
-    
-    st.markdown("---")
-
 # サイドバー: APIキー入力
 with st.sidebar:
     st.header("設定")
     
-    if "ANTHROPIC_API_KEY" in st.secrets:
+    if is_offline_transport():
+        # 記録の再生・モック応答ではAPIキー不要
+        api_key = st.secrets.get("ANTHROPIC_API_KEY", "offline")
+        st.info(f"オフラインモード: {get_transport_mode()}")
+    elif "ANTHROPIC_API_KEY" in st.secrets:
         api_key = st.secrets["ANTHROPIC_API_KEY"]
         st.success("APIキー設定済み")
     else:
@@ -339,6 +289,12 @@ with st.sidebar:
         if api_key:
             st.success("APIキー入力済み")
     
+    # フラグメントの再実行時にも参照できるよう保存
+    st.session_state["api_key"] = api_key
+
+    st.markdown("---")
+    render_quota_usage()
+
     st.markdown("---")
     st.markdown("### 使い方")
     st.markdown("""
@@ -355,142 +311,375 @@ with st.sidebar:
     - 実績ベースの見積もり
     """)
 
-# メイン入力フォーム
-col1, col2 = st.columns(2)
-
-with col1:
-    st.subheader("プロジェクト情報")
-    project_name = st.text_input(
-        "プロジェクト名",
-        value="insert Project name...",
-        help="ゲームタイトルや製品名"
-    )
-    
-    project_genre = st.text_input(
-        "ジャンル",
-        value="サバイバル/クラフティング",
-        help="ゲームジャンルや製品カテゴリ"
-    )
-    
-    launch_date = st.date_input(
-        "ローンチ予定日",
-        help="発売日またはキャンペーン開始日"
-    )
-    
-    target_sales = st.number_input(
-        "目標販売本数",
-        min_value=0,
-        value=100000,
-        step=10000,
-        help="達成したい販売目標"
-    )
-
-with col2:
-    st.subheader("予算設定")
-    total_marketing_budget = st.number_input(
-        "総マーケティング予算(万円)",
-        min_value=0,
-        value=50000,
-        step=1000,
-        help="使用可能な総マーケティング予算"
-    )
-    
-    campaign_period = st.selectbox(
-        "キャンペーン期間",
-        ["1ヶ月", "3ヶ月", "6ヶ月", "1年"],
-        index=1,
-        help="マーケティング活動の期間"
-    )
-    
-    target_market = st.selectbox(
-        "主要ターゲット市場",
-        ["日本のみ", "日本+アジア", "グローバル"],
-        index=0
+@st.cache_data(show_spinner=False)
+def load_access_logs(log_signature, include_archived=False, archive_signature=None):
+    """アクセスログの読み込み（ファイル・圧縮済みログの索引の更新時のみ再読込）"""
+    return get_access_logs(include_archived)
+
+@st.cache_data(show_spinner=False)
+def load_api_metrics(metrics_signature, include_archived=False, archive_signature=None):
+    """APIメトリクスの読み込み（ファイル更新時のみ再読込）"""
+    return get_api_metrics(include_archived)
+
+@st.cache_data(show_spinner=False)
+def load_speculation_log(speculation_signature, include_archived=False, archive_signature=None):
+    """先読みログの読み込み（ファイル更新時のみ再読込）"""
+    return get_speculation_log(include_archived)
+
+@st.cache_data(show_spinner=False)
+def load_trace_spans(trace_signature, include_archived=False, archive_signature=None):
+    """トレースの読み込み（ファイル更新時のみ再読込）"""
+    return get_trace_spans(include_archived)
+
+@st.fragment
+def render_admin_panel():
+    """アクセスログ・パフォーマンス表示（管理者のみ）"""
+    include_archived = st.checkbox(
+        "圧縮済みの過去ログも含める",
+        key="include_archived_logs",
+        help=f"{COLD_AFTER_DAYS}日より古いログは圧縮して保存されています。含めると展開に時間がかかります"
     )
-    
-    optimization_focus = st.selectbox(
-        "最適化の重点",
-        ["認知度最大化", "購買転換率最大化", "ROI最大化", "リーチ最大化"],
-        index=2
-    )
-
-# マーケティング施策
-st.markdown("---")
-st.subheader("マーケティング施策候補")
+    archive_signature = get_index_signature() if include_archived else None
+
+    tab_log, tab_perf, tab_quota, tab_storage, tab_trace = st.tabs(["アクセスログ", "パフォーマンス", "利用枠", "ストレージ", "トレース"])
+
+    with tab_log:
+        logs_df = load_access_logs(get_log_signature(), include_archived, archive_signature)
+
+        if logs_df is not None and not logs_df.empty:
+            logs_df_sorted = logs_df.sort_values("timestamp", ascending=False)
+
+            # 統計情報
+            col_stat1, col_stat2, col_stat3 = st.columns(3)
+            with col_stat1:
+                st.metric("総アクセス数", len(logs_df))
+            with col_stat2:
+                unique_users = logs_df["username"].nunique()
+                st.metric("ユニークユーザー数", unique_users)
+            with col_stat3:
+                login_count = len(logs_df[logs_df["action"] == "login"])
+                st.metric("ログイン回数", login_count)
+
+            st.dataframe(
+                logs_df_sorted,
+                use_container_width=True,
+                height=300
+            )
+
+            csv_data = logs_df.to_csv(index=False).encode("utf-8")
+            st.download_button(
+                label="ログをCSVでダウンロード",
+                data=csv_data,
+                file_name=f"access_log_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv"
+            )
+        else:
+            st.info("まだアクセスログがありません")
 
-col3, col4 = st.columns(2)
+    with tab_perf:
+        try:
+            metrics_df = load_api_metrics(get_metrics_signature(), include_archived, archive_signature)
+        except Exception as e:
+            st.error(f"メトリクスファイルの読み込みに失敗しました: {e}")
+            metrics_df = None
+
+        if metrics_df is not None and not metrics_df.empty:
+            ok_df = metrics_df[metrics_df["status"] == "ok"]
+
+            col_perf1, col_perf2, col_perf3, col_perf4 = st.columns(4)
+            with col_perf1:
+                st.metric("API呼び出し数", len(metrics_df))
+            with col_perf2:
+                failure_rate = (metrics_df["status"] == "error").mean() * 100
+                st.metric("失敗率", f"{failure_rate:.1f}%")
+            with col_perf3:
+                st.metric("平均レイテンシ", f"{ok_df['latency_ms'].mean() / 1000:.1f}秒" if not ok_df.empty else "-")
+            with col_perf4:
+                st.metric("平均TTFT", f"{ok_df['ttft_ms'].mean() / 1000:.1f}秒" if not ok_df.empty else "-")
+
+            st.markdown("**パーセンタイル（成功した呼び出し）**")
+            st.dataframe(summarize_api_metrics(metrics_df), use_container_width=True, hide_index=True)
+
+            if "tier" in metrics_df.columns:
+                st.markdown("**モデル階層別（レイテンシ ms・概算料金 USD）**")
+                st.dataframe(summarize_by_tier(metrics_df), use_container_width=True, hide_index=True)
+
+            speculation_df = load_speculation_log(get_speculation_signature(), include_archived, archive_signature)
+            if speculation_df is not None and not speculation_df.empty:
+                speculation = summarize_speculation(speculation_df)
+                st.markdown("**先読み実行**")
+                col_spec1, col_spec2, col_spec3, col_spec4 = st.columns(4)
+                with col_spec1:
+                    st.metric("ヒット率", f"{speculation['hit_rate']:.1f}%" if speculation["hit_rate"] is not None else "-")
+                with col_spec2:
+                    st.metric("ヒット / 実行", f"{speculation['hits']} / {speculation['clicks']}")
+                with col_spec3:
+                    st.metric("無駄になったトークン", f"{speculation['wasted_tokens']:,}", help=f"使われなかった先読み {speculation['wasted_runs']}回分")
+                with col_spec4:
+                    st.metric("短縮した待ち時間", f"{speculation['saved_seconds']:.0f}秒")
+                st.dataframe(speculation["outcomes"], use_container_width=True, hide_index=True)
+
+            trend_df = daily_api_trend(metrics_df)
+            st.markdown("**日別レイテンシ推移（ms）**")
+            st.line_chart(trend_df[["latency_p50", "latency_p95", "ttft_p50"]])
+            st.markdown("**日別トークン使用量**")
+            st.bar_chart(trend_df[["input_tokens", "output_tokens"]])
+
+            st.markdown("**失敗内訳**")
+            error_df = metrics_df[metrics_df["status"] == "error"]
+            if not error_df.empty:
+                st.dataframe(
+                    error_df["error_class"].value_counts().rename_axis("エラー種別").reset_index(name="件数"),
+                    use_container_width=True,
+                    hide_index=True
+                )
+            else:
+                st.caption("失敗した呼び出しはありません")
+
+            st.download_button(
+                label="メトリクスをCSVでダウンロード",
+                data=metrics_df.to_csv(index=False).encode("utf-8"),
+                file_name=f"api_metrics_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv"
+            )
+        else:
+            st.info("まだAPI呼び出しの記録がありません")
+
+    with tab_quota:
+        status = get_scheduler_status()
+        col_quota1, col_quota2 = st.columns(2)
+        with col_quota1:
+            st.metric("実行中のAPI呼び出し", f"{status['active']} / {status['max_concurrent']}")
+        with col_quota2:
+            st.metric("実行待ち", sum(status["waiting"].values()))
+
+        users = st.secrets["users"] if "users" in st.secrets else {}
+        usage = get_all_quota_usage()
+        rows = []
+        for username in sorted(set(users) | set(usage)):
+            policy = get_user_policy(username, users.get(username))
+            used = usage.get(username, {"requests": 0, "tokens": 0})
+            rows.append({
+                "ユーザー": username,
+                "リクエスト": used["requests"],
+                "リクエスト上限": policy["daily_requests"] or None,
+                "トークン": used["tokens"],
+                "トークン上限": policy["daily_tokens"] or None,
+                "重み": policy["weight"],
+                "優先レーン": policy["priority"],
+                "実行待ち": status["waiting"].get(username, 0),
+            })
+        if rows:
+            st.markdown("**本日のユーザー別利用状況**（上限が空欄のユーザーは無制限）")
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        else:
+            st.caption("本日のAPI呼び出しはまだありません")
 
-with col3:
-    st.markdown("**主要施策**")
-    
-    use_vtuber = st.checkbox("VTuberマーケティング", value=True)
-    use_digital_ads = st.checkbox("デジタル広告", value=True)
-    use_events = st.checkbox("イベント・展示会", value=True)
-    use_pr = st.checkbox("PR・メディア露出", value=True)
-    use_influencer = st.checkbox("インフルエンサー施策", value=True)
-    use_community = st.checkbox("コミュニティ施策", value=False)
-
-with col4:
-    selected_tactics = []
+    with tab_storage:
+        storage_df = summarize_storage()
+        if storage_df.empty:
+            st.caption("圧縮済みのログはまだありません")
+        else:
+            st.markdown("**圧縮済みのログ**")
+            st.dataframe(storage_df, use_container_width=True, hide_index=True)
+
+        if st.button(f"{COLD_AFTER_DAYS}日より古いログ・分析結果を圧縮"):
+            with st.spinner("圧縮中..."):
+                results = run_tiering()
+            st.success("、".join(f"{target}: {count:,}件" for target, count in results.items()))
+            log_access(
+                st.session_state.get("username", "unknown"),
+                "cold_storage_tiered",
+                ", ".join(f"{target}={count}" for target, count in results.items())
+            )
+
+    with tab_trace:
+        try:
+            spans_df = load_trace_spans(get_trace_signature(), include_archived, archive_signature)
+        except Exception as e:
+            st.error(f"トレースファイルの読み込みに失敗しました: {e}")
+            spans_df = None
+
+        if spans_df is not None and not spans_df.empty:
+            st.markdown("**フェーズ別の処理時間（ms）**")
+            st.dataframe(summarize_spans(spans_df), use_container_width=True, hide_index=True)
+
+            st.markdown("**日別のフェーズ別p95推移（ms）**")
+            st.line_chart(daily_span_trend(spans_df))
+
+            trace_labels = {
+                root["trace_id"]: f"{root['timestamp']:%m/%d %H:%M:%S} {root['name']} {root['wall_ms']:,.0f}ms"
+                for _, root in recent_traces(spans_df).iterrows()
+            }
+            trace_id = st.selectbox(
+                "トレース（最近の実行）",
+                list(trace_labels),
+                format_func=trace_labels.get,
+                key="trace_id"
+            )
+            if trace_id is not None:
+                st.dataframe(
+                    trace_breakdown(spans_df, trace_id),
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "割合": st.column_config.ProgressColumn("割合", min_value=0.0, max_value=1.0, format="percent"),
+                    }
+                )
+        else:
+            st.info("まだトレースの記録がありません（環境変数 APP_TRACING=1 で起動すると記録されます）")
     
-    if use_vtuber:
-        vtuber_detail = st.text_input(
-            "VTuber施策詳細",
-            value="ホロライブ・にじさんじ大手5-10名",
-            help="具体的な施策内容"
+    st.markdown("---")
+
+@st.fragment
+def render_input_form():
+    """プロジェクト情報・予算・マーケティング施策の入力"""
+    # メイン入力フォーム
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("プロジェクト情報")
+        project_name = st.text_input(
+            "プロジェクト名",
+            key="project_name",
+            value="insert Project name...",
+            help="ゲームタイトルや製品名"
         )
-        selected_tactics.append(f"VTuberマーケティング: {vtuber_detail}")
-    
-    if use_digital_ads:
-        digital_detail = st.text_input(
-            "デジタル広告詳細",
-            value="YouTube、Twitter、Steam広告",
-            help="広告プラットフォーム"
+
+        project_genre = st.text_input(
+            "ジャンル",
+            key="project_genre",
+            value="サバイバル/クラフティング",
+            help="ゲームジャンルや製品カテゴリ"
         )
-        selected_tactics.append(f"デジタル広告: {digital_detail}")
-    
-    if use_events:
-        events_detail = st.text_input(
-            "イベント詳細",
-            value="東京ゲームショウ、BitSummit",
-            help="出展予定のイベント"
+
+        launch_date = st.date_input(
+            "ローンチ予定日",
+            key="launch_date",
+            help="発売日またはキャンペーン開始日"
         )
-        selected_tactics.append(f"イベント・展示会: {events_detail}")
-    
-    if use_pr:
-        pr_detail = st.text_input(
-            "PR施策詳細",
-            value="4Gamer、IGN Japan、Famitsu",
-            help="ターゲットメディア"
+
+        target_sales = st.number_input(
+            "目標販売本数",
+            key="target_sales",
+            min_value=0,
+            value=100000,
+            step=10000,
+            help="達成したい販売目標"
         )
-        selected_tactics.append(f"PR・メディア露出: {pr_detail}")
-    
-    if use_influencer:
-        influencer_detail = st.text_input(
-            "インフルエンサー詳細",
-            value="Twitch、YouTube配信者20-30名",
-            help="ターゲットインフルエンサー"
+
+    with col2:
+        st.subheader("予算設定")
+        total_marketing_budget = st.number_input(
+            "総マーケティング予算(万円)",
+            key="total_marketing_budget",
+            min_value=0,
+            value=50000,
+            step=1000,
+            help="使用可能な総マーケティング予算"
         )
-        selected_tactics.append(f"インフルエンサー施策: {influencer_detail}")
-    
-    if use_community:
-        community_detail = st.text_input(
-            "コミュニティ施策詳細",
-            value="Discord、Reddit、公式フォーラム",
-            help="コミュニティ戦略"
+
+        campaign_period = st.selectbox(
+            "キャンペーン期間",
+            ["1ヶ月", "3ヶ月", "6ヶ月", "1年"],
+            key="campaign_period",
+            index=1,
+            help="マーケティング活動の期間"
         )
-        selected_tactics.append(f"コミュニティ施策: {community_detail}")
 
-# 参考データ
-st.markdown("---")
-st.subheader("参考データ（重要: 実績ベースの見積もりに使用）")
+        target_market = st.selectbox(
+            "主要ターゲット市場",
+            ["日本のみ", "日本+アジア", "グローバル"],
+            key="target_market",
+            index=0
+        )
 
-col_ref1, col_ref2 = st.columns(2)
+        optimization_focus = st.selectbox(
+            "最適化の重点",
+            ["認知度最大化", "購買転換率最大化", "ROI最大化", "リーチ最大化"],
+            key="optimization_focus",
+            index=2
+        )
 
-with col_ref1:
-    vtuber_reference = st.text_area(
-        "VTuber/インフルエンサー施策の参考データ",
-        value="""【過去実績データ（Switch向けゲーム）】
+    # マーケティング施策
+    st.markdown("---")
+    st.subheader("マーケティング施策候補")
+
+    col3, col4 = st.columns(2)
+
+    with col3:
+        st.markdown("**主要施策**")
+
+        use_vtuber = st.checkbox("VTuberマーケティング", key="use_vtuber", value=True)
+        use_digital_ads = st.checkbox("デジタル広告", key="use_digital_ads", value=True)
+        use_events = st.checkbox("イベント・展示会", key="use_events", value=True)
+        use_pr = st.checkbox("PR・メディア露出", key="use_pr", value=True)
+        use_influencer = st.checkbox("インフルエンサー施策", key="use_influencer", value=True)
+        use_community = st.checkbox("コミュニティ施策", key="use_community", value=False)
+
+    with col4:
+        selected_tactics = []
+
+        if use_vtuber:
+            vtuber_detail = st.text_input(
+                "VTuber施策詳細",
+                key="vtuber_detail",
+                value="ホロライブ・にじさんじ大手5-10名",
+                help="具体的な施策内容"
+            )
+            selected_tactics.append(f"VTuberマーケティング: {vtuber_detail}")
+
+        if use_digital_ads:
+            digital_detail = st.text_input(
+                "デジタル広告詳細",
+                key="digital_detail",
+                value="YouTube、Twitter、Steam広告",
+                help="広告プラットフォーム"
+            )
+            selected_tactics.append(f"デジタル広告: {digital_detail}")
+
+        if use_events:
+            events_detail = st.text_input(
+                "イベント詳細",
+                key="events_detail",
+                value="東京ゲームショウ、BitSummit",
+                help="出展予定のイベント"
+            )
+            selected_tactics.append(f"イベント・展示会: {events_detail}")
+
+        if use_pr:
+            pr_detail = st.text_input(
+                "PR施策詳細",
+                key="pr_detail",
+                value="4Gamer、IGN Japan、Famitsu",
+                help="ターゲットメディア"
+            )
+            selected_tactics.append(f"PR・メディア露出: {pr_detail}")
+
+        if use_influencer:
+            influencer_detail = st.text_input(
+                "インフルエンサー詳細",
+                key="influencer_detail",
+                value="Twitch、YouTube配信者20-30名",
+                help="ターゲットインフルエンサー"
+            )
+            selected_tactics.append(f"インフルエンサー施策: {influencer_detail}")
+
+        if use_community:
+            community_detail = st.text_input(
+                "コミュニティ施策詳細",
+                key="community_detail",
+                value="Discord、Reddit、公式フォーラム",
+                help="コミュニティ戦略"
+            )
+            selected_tactics.append(f"コミュニティ施策: {community_detail}")
+
+    # 分析フラグメントから参照するため保存
+    st.session_state["selected_tactics"] = selected_tactics
+    schedule_analysis_speculation()
+
+# 参考データ欄の初期値
+DEFAULT_VTUBER_REFERENCE = """【過去実績データ（Switch向けゲーム）】
 
 ■ フォロワー規模別の実績:
 - 7万人級: コスト 5-17万円、CPV 0.9-10円、7日視聴 5,600-56,500
@@ -514,15 +703,9 @@ with col_ref1:
 ■ 成長パターン:
 - Day1→Day3: 1.2-3倍
 - Day1→Day7: 1.8-5倍
-- Day1→Day30: 2.5-6倍""",
-        height=300,
-        help="実際の過去案件データを入力してください"
-    )
+- Day1→Day30: 2.5-6倍"""
 
-with col_ref2:
-    other_reference = st.text_area(
-        "その他施策の参考データ",
-        value="""【デジタル広告】
+DEFAULT_OTHER_REFERENCE = """【デジタル広告】
 - YouTube広告: CPM 500-1,000円
 - Twitter/X広告: CPC 100-300円
 - Steam広告: CPM 800-1,500円
@@ -546,250 +729,997 @@ with col_ref2:
 【一般的なKPI目安】
 - CVR（認知→購入）: 0.5-2%
 - CPA（獲得単価）: 2,000-5,000円
-- ROAS: 150-300%が標準的""",
-        height=300,
-        help="実際の過去実績や市場データを入力"
-    )
+- ROAS: 150-300%が標準的"""
+
+@st.cache_data(show_spinner=False)
+def load_store_genres(store_signature):
+    """実績ストアのジャンル一覧（ストア更新時のみ再読込）"""
+    return list_genres()
+
+@st.cache_data(show_spinner=False)
+def load_store_reference(store_signature, genre):
+    """実績ストアから生成した参考データ（ストア更新時のみ再集計）"""
+    return generate_reference_text(genre)
+
+def apply_store_reference(genre):
+    """生成した参考データをVTuber参考データ欄に反映（ウィジェット描画前に実行されるコールバック）"""
+    text = load_store_reference(get_store_signature(), genre)
+    if text:
+        st.session_state["vtuber_reference"] = text
+    else:
+        st.session_state["store_reference_message"] = "該当する実績がありません"
+
+def render_campaign_store():
+    """過去実績ファイルの取り込みと参考データの生成"""
+    with st.expander("過去実績データから参考データを生成"):
+        uploaded_files = st.file_uploader(
+            "実績ファイル（CSV/Excel）",
+            type=["csv", "xlsx"],
+            accept_multiple_files=True,
+            help="列: 配信日・ジャンル・プラットフォーム・配信者・フォロワー数・コスト・7日視聴・CTR・ENG率"
+        )
 
-# 制約条件と追加情報
-st.markdown("---")
-st.subheader("制約条件・特記事項")
+        if st.button("実績ストアに取り込み", disabled=not uploaded_files):
+            for uploaded_file in uploaded_files:
+                try:
+                    added, total = ingest_campaigns(read_campaign_file(uploaded_file))
+                    st.success(f"{uploaded_file.name}: {added:,}件を取り込みました（合計 {total:,}件）")
+                except Exception as e:
+                    st.error(f"{uploaded_file.name} の取り込みに失敗しました: {e}")
+            log_access(
+                st.session_state.get("username", "unknown"),
+                "campaigns_imported",
+                f"ファイル数: {len(uploaded_files)}"
+            )
+
+        genres = load_store_genres(get_store_signature())
+        if not genres:
+            st.caption("実績ストアは空です。ファイルを取り込むと参考データを自動生成できます。")
+            return
+
+        st.checkbox(
+            "類似する過去実績を自動で参考データに追加",
+            key="use_retrieved_reference",
+            value=True,
+            help="ジャンル・ターゲット市場・施策（プラットフォーム・規模）が近い実績の集計行だけを送信します"
+        )
+        st.slider("追加する実績の行数", min_value=3, max_value=30, value=DEFAULT_TOP_K, key="retrieval_top_k")
+        if st.session_state["use_retrieved_reference"]:
+            preview = select_reference_text(
+                {
+                    "project_genre": st.session_state.get("project_genre", ""),
+                    "target_market": st.session_state.get("target_market", ""),
+                    "selected_tactics": st.session_state.get("selected_tactics", []),
+                },
+                st.session_state["retrieval_top_k"]
+            )
+            st.code(preview or "該当する実績がありません", language=None)
+
+        project_genre = st.session_state.get("project_genre")
+        genre_options = ["全ジャンル"] + genres
+        genre = st.selectbox(
+            "集計対象のジャンル",
+            genre_options,
+            index=genre_options.index(project_genre) if project_genre in genre_options else 0
+        )
+        st.button(
+            "VTuber参考データに反映",
+            on_click=apply_store_reference,
+            args=(None if genre == "全ジャンル" else genre,)
+        )
+        if "store_reference_message" in st.session_state:
+            st.warning(st.session_state.pop("store_reference_message"))
+
+@st.cache_data(show_spinner="Excelを読み込み中...", max_entries=8)
+def load_reference_workbook(digest, _file):
+    """Excelブックの参考データ（同じ内容のファイルは再解析しない）"""
+    return read_reference_workbook(_file)
+
+def apply_workbook_reference(text):
+    """Excelから生成した参考データをその他施策の参考データ欄に反映"""
+    st.session_state["other_reference"] = text
+
+def render_workbook_import():
+    """Excelブック（媒体単価・イベント費用など）からの参考データ取り込み"""
+    with st.expander("Excelから参考データを取り込み"):
+        workbook_file = st.file_uploader(
+            "参考データのExcelファイル",
+            type=["xlsx", "xlsm"],
+            help="シートごとに1行目を見出しとして読み込みます。「CPM下限(円)」「CPM上限(円)」のような列は範囲にまとめます。"
+        )
+        if workbook_file is None:
+            return
 
-col5, col6 = st.columns(2)
+        try:
+            sections = load_reference_workbook(file_digest(workbook_file), workbook_file)
+        except Exception as e:
+            st.error(f"Excelファイルの読み込みに失敗しました: {e}")
+            return
+
+        if not sections:
+            st.warning("参考データとして読み込めるシートがありません")
+            return
+
+        sheet_names = st.multiselect("取り込むシート", options=list(sections), default=list(sections))
+        text = combine_reference_sections(sections, sheet_names)
+        st.code(text[:2000] + ("\n..." if len(text) > 2000 else ""), language=None)
+        st.button(
+            "その他施策の参考データに反映",
+            on_click=apply_workbook_reference,
+            args=(text,),
+            disabled=not text
+        )
 
-with col5:
-    constraints = st.text_area(
-        "必須の制約条件",
-        height=100,
-        placeholder="""例:
-VTuberマーケティングは最低40%確保
-デジタル広告は25%以上
-イベント予算は固定で500万円""",
-        help="必ず守るべき予算制約"
-    )
+@st.fragment
+def render_reference_editor():
+    """参考データの編集とプレビュー"""
+    # 参考データ
+    st.markdown("---")
+    st.subheader("参考データ（重要: 実績ベースの見積もりに使用）")
 
-with col6:
-    additional_context = st.text_area(
-        "その他の考慮事項",
-        height=100,
-        placeholder="""例:
-Early Access段階のため段階的な投資が必要
-前作ファン10万人への優先アプローチ
-日本市場での認知度向上が最優先""",
-        help="戦略立案時の背景情報"
-    )
+    # 初期値はsession_stateに設定（実績ストアからの反映で上書きできるように）
+    st.session_state.setdefault("vtuber_reference", DEFAULT_VTUBER_REFERENCE)
+    st.session_state.setdefault("other_reference", DEFAULT_OTHER_REFERENCE)
 
-# 分析実行ボタン
-if st.button("予算最適化を実行", type="primary", use_container_width=True):
-    if not api_key:
-        st.error("Claude API Keyを入力してください（サイドバー）")
-    elif not selected_tactics:
-        st.error("最低1つのマーケティング施策を選択してください")
-    elif total_marketing_budget <= 0:
-        st.error("総マーケティング予算は0より大きい値を入力してください")
-    else:
-        log_access(
-            st.session_state.get("username", "unknown"),
-            "analysis_executed",
-            f"プロジェクト: {project_name}, 予算: {total_marketing_budget}万円"
+    render_campaign_store()
+    render_workbook_import()
+
+    col_ref1, col_ref2 = st.columns(2)
+
+    with col_ref1:
+        vtuber_reference = st.text_area(
+            "VTuber/インフルエンサー施策の参考データ",
+            key="vtuber_reference",
+            height=300,
+            help="実際の過去案件データを入力してください"
         )
-        
-        with st.spinner("最適化計算中... (30-60秒かかります)"):
-            try:
-                client = anthropic.Anthropic(api_key=api_key)
-                
-                tactics_list = "\n".join([f"- {tactic}" for tactic in selected_tactics])
-                
-                prompt = f"""
-あなたはゲームパブリッシングのマーケティング予算最適化の専門家です。以下の情報を基に、最適なマーケティング予算配分案を作成してください。
 
-【プロジェクト情報】
-- プロジェクト名: {project_name}
-- ジャンル: {project_genre}
-- ローンチ予定日: {launch_date}
-- 目標販売本数: {target_sales:,}本
-- ターゲット市場: {target_market}
+    with col_ref2:
+        other_reference = st.text_area(
+            "その他施策の参考データ",
+            key="other_reference",
+            height=300,
+            help="実際の過去実績や市場データを入力"
+        )
 
-【予算情報】
-- 総マーケティング予算: {total_marketing_budget:,}万円
-- キャンペーン期間: {campaign_period}
-- 最適化の重点: {optimization_focus}
+    compact_reference = st.checkbox(
+        "参考データを圧縮形式で送信（入力トークン削減）",
+        key="compact_reference",
+        value=True,
+        help="箇条書きを表形式に変換し、繰り返しの単位を見出しにまとめて送信します。数値は変更されません。"
+    )
 
-【実施予定のマーケティング施策】
-{tactics_list}
+    with st.expander("送信される参考データのプレビュー"):
+        st.code(format_reference_for_prompt(vtuber_reference, compact_reference), language=None)
+        st.code(format_reference_for_prompt(other_reference, compact_reference), language=None)
+
+        if st.button("圧縮前後のトークン数を比較"):
+            api_key = st.session_state.get("api_key")
+            if not api_key:
+                st.error("Claude API Keyを入力してください（サイドバー）")
+            else:
+                try:
+                    client = create_client(api_key)
+                    _, token_model = route_model("token_count")
+                    raw_text = f"{vtuber_reference}\n\n{other_reference}"
+                    compact_text = f"{format_reference_for_prompt(vtuber_reference)}\n\n{format_reference_for_prompt(other_reference)}"
+                    st.session_state["reference_token_counts"] = (
+                        count_prompt_tokens(client, token_model, raw_text),
+                        count_prompt_tokens(client, token_model, compact_text)
+                    )
+                except Exception as e:
+                    st.error(f"トークン数の取得に失敗しました: {e}")
+
+        if "reference_token_counts" in st.session_state:
+            raw_tokens, compact_tokens = st.session_state["reference_token_counts"]
+            col_tok1, col_tok2 = st.columns(2)
+            with col_tok1:
+                st.metric("圧縮前トークン数", f"{raw_tokens:,}")
+            with col_tok2:
+                st.metric(
+                    "圧縮後トークン数",
+                    f"{compact_tokens:,}",
+                    delta=f"{compact_tokens - raw_tokens:,}",
+                    delta_color="inverse"
+                )
 
-【参考データ - VTuber/インフルエンサー施策】
-{vtuber_reference}
+    schedule_analysis_speculation()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_roster_candidates(digest, _file):
+    """配信者リストの候補（同じ内容のファイルは再解析しない）"""
+    return roster_candidates(read_campaign_file(_file))
+
+def apply_roster_constraint(text):
+    """最適化した配信者構成を制約条件欄に追記（ウィジェット描画前に実行されるコールバック）"""
+    current = st.session_state.get("constraints", "").rstrip()
+    st.session_state["constraints"] = f"{current}\n{text}" if current else text
+
+def render_roster_optimizer():
+    """VTuber予算内での配信者の組み合わせ最適化（規模別の人数、または配信者リストから選択）"""
+    with st.expander("配信者の組み合わせを最適化（VTuber予算）"):
+        col_roster1, col_roster2, col_roster3 = st.columns(3)
+        with col_roster1:
+            roster_budget = st.number_input(
+                "VTuber施策の予算（万円）",
+                min_value=0,
+                value=1000,
+                step=100,
+                key="roster_budget"
+            )
+        with col_roster2:
+            objective = st.radio(
+                "最大化する指標",
+                list(ROSTER_OBJECTIVES),
+                format_func=lambda key: ROSTER_OBJECTIVES[key],
+                key="roster_objective"
+            )
+        with col_roster3:
+            scenario = st.selectbox(
+                "単価・視聴数の見積もり",
+                PROJECTION_SCENARIOS,
+                index=1,
+                key="roster_scenario",
+                help="保守: コストの上限と視聴数の下限 / 楽観: コストの下限と視聴数の上限"
+            )
+
+        roster_file = st.file_uploader(
+            "配信者リスト（CSV/Excel、任意）",
+            type=["csv", "xlsx"],
+            help="列: 配信者・プラットフォーム・フォロワー数・コスト・7日視聴・CTR。指定しない場合は参考データの規模別の行から人数を決めます"
+        )
+        try:
+            if roster_file is not None:
+                candidates = load_roster_candidates(file_digest(roster_file), roster_file)
+            else:
+                max_per_tier = st.slider("規模ごとの最大人数", min_value=1, max_value=30, value=DEFAULT_MAX_PER_TIER, key="roster_max_per_tier")
+                candidates = tier_candidates(st.session_state.get("vtuber_reference", ""), scenario, max_per_tier)
+        except Exception as e:
+            st.error(f"配信者リストの読み込みに失敗しました: {e}")
+            return
+
+        if candidates.empty:
+            st.caption("参考データにコストと7日視聴のある規模別の行がありません")
+            return
+
+        groups = sorted(candidates["group"].dropna().unique().tolist())
+        shares = st.data_editor(
+            pd.DataFrame({"グループ": groups, "最低配分(%)": 0.0}),
+            column_config={"最低配分(%)": st.column_config.NumberColumn(min_value=0.0, max_value=100.0, step=5.0)},
+            disabled=["グループ"],
+            hide_index=True,
+            key="roster_min_shares"
+        )
 
-【参考データ - その他施策】
-{other_reference}
+        if st.button("組み合わせを計算", disabled=roster_budget <= 0):
+            try:
+                st.session_state["roster_result"] = solve_roster(
+                    candidates,
+                    roster_budget * 1e4,
+                    objective=objective,
+                    min_shares=dict(zip(shares["グループ"], shares["最低配分(%)"].fillna(0) / 100))
+                )
+            except ValueError as e:
+                st.session_state.pop("roster_result", None)
+                st.error(str(e))
+
+        if "roster_result" in st.session_state:
+            selection, summary = st.session_state["roster_result"]
+            col_res1, col_res2, col_res3, col_res4 = st.columns(4)
+            with col_res1:
+                st.metric("費用合計", f"{summary['spent_yen'] / 1e4:,.0f}万円", delta=f"予算 {summary['budget_yen'] / 1e4:,.0f}万円", delta_color="off")
+            with col_res2:
+                st.metric("人数", f"{summary['creators']}名")
+            with col_res3:
+                st.metric("7日視聴（見込み）", f"{summary['views']:,.0f}")
+            with col_res4:
+                st.metric("コンバージョン（見込み）", f"{summary['conversions']:,.0f}")
+            st.dataframe(selection, use_container_width=True, hide_index=True)
+            st.button(
+                "この構成を制約条件に追加",
+                on_click=apply_roster_constraint,
+                args=(format_roster_constraint(selection),)
+            )
+
+@st.fragment
+def render_constraints():
+    """制約条件・特記事項の入力"""
+    # 制約条件と追加情報
+    st.markdown("---")
+    st.subheader("制約条件・特記事項")
 
-【制約条件】
-{constraints if constraints else "特になし"}
+    col5, col6 = st.columns(2)
 
-【その他の考慮事項】
-{additional_context if additional_context else "特になし"}
+    with col5:
+        constraints = st.text_area(
+            "必須の制約条件",
+            key="constraints",
+            height=100,
+            placeholder="""例:
+VTuberマーケティングは最低40%確保
+デジタル広告は25%以上
+イベント予算は固定で500万円""",
+            help="必ず守るべき予算制約"
+        )
 
-**【重要な指示】**
-1. **参考データを厳密に遵守**: 上記の参考データに記載されたCPV、CPM、CPC、コスト範囲を絶対に超えないでください
-2. **現実的な数値**: フォロワー規模に応じた適切なコストとリーチを算出してください
-3. **実績ベースの予測**: 過去の成長率パターン（Day1→Day7で1.8-5倍）を基に計算してください
-4. **保守的な見積もり**: 不確実性を考慮し、やや保守的な数値を採用してください
-5. **CPV計算**: コスト ÷ 予想視聴数 = CPVが参考データの範囲内であることを確認してください
+    with col6:
+        additional_context = st.text_area(
+            "その他の考慮事項",
+            key="additional_context",
+            height=100,
+            placeholder="""例:
+Early Access段階のため段階的な投資が必要
+前作ファン10万人への優先アプローチ
+日本市場での認知度向上が最優先""",
+            help="戦略立案時の背景情報"
+        )
 
-日本のゲーム市場の特性（VTuber影響力、Steamユーザー層、口コミ重視など）を考慮してください。
+    render_roster_optimizer()
+    schedule_analysis_speculation()
+
+def collect_analysis_inputs():
+    """各フラグメントの入力値をsession_stateから集める"""
+    state = st.session_state
+    inputs = {
+        "project_name": state["project_name"],
+        "project_genre": state["project_genre"],
+        "launch_date": state["launch_date"],
+        "target_sales": state["target_sales"],
+        "target_market": state["target_market"],
+        "total_marketing_budget": state["total_marketing_budget"],
+        "campaign_period": state["campaign_period"],
+        "optimization_focus": state["optimization_focus"],
+        "selected_tactics": state.get("selected_tactics", []),
+        "vtuber_reference": state["vtuber_reference"],
+        "other_reference": state["other_reference"],
+        "constraints": state["constraints"],
+        "additional_context": state["additional_context"],
+        "compact_reference": state["compact_reference"],
+    }
+    # 実績ストアがある場合は類似する実績の上位k行だけを追加
+    if state.get("use_retrieved_reference"):
+        inputs["retrieved_reference"] = select_reference_text(inputs, state.get("retrieval_top_k", DEFAULT_TOP_K))
+    return inputs
 
-以下の形式で回答してください:
+def prepare_result_workbook(analysis):
+    """Excelファイルを作成して分析結果と一緒に保存（ボタンのコールバック）"""
+    try:
+        analysis["xlsx"] = build_result_workbook(analysis)
+    except Exception as e:
+        analysis["xlsx_error"] = str(e)
+
+@traced("render_result")
+def render_analysis_result(analysis):
+    """保存済みの分析結果を表示（再実行しても結果が消えないようにsession_stateから描画）"""
+    result = analysis["text"]
+    result_tree = analysis["tree"]
+    selected_section_ids = analysis["section_ids"]
+    inputs = analysis["inputs"]
+    project_name = inputs["project_name"]
+    target_sales = inputs["target_sales"]
+    total_marketing_budget = inputs["total_marketing_budget"]
+    campaign_period = inputs["campaign_period"]
+    target_market = inputs["target_market"]
+    optimization_focus = inputs["optimization_focus"]
+    selected_tactics = inputs["selected_tactics"]
+    other_reference = inputs["other_reference"]
+
+    if analysis.get("tier") == DRAFT_TIER:
+        st.info(
+            f"この結果は{get_tier_label(DRAFT_TIER)}モデル（{analysis['model']}）によるドラフトです。"
+            "「予算最適化を実行」で本番モデルによる精緻な配分案を作成できます。"
+        )
+    elif analysis.get("model"):
+        st.caption(f"生成モデル: {analysis['model']}（{get_tier_label(analysis['tier'])}）")
+    if analysis.get("opened_from_archive"):
+        st.caption(f"過去の分析（アーカイブ #{analysis['archive_id']}）を表示しています")
+
+    # タブで結果を整理
+    tab1, tab2, tab3 = st.tabs(["最適化結果", "入力サマリー", "ダウンロード"])
+
+    with tab1:
+        # 各セクションをexpanderで表示
+        for section in result_tree:
+            section_name = section["title"]
+            with st.expander(section_name, expanded=(section_name.startswith("2.") or len(result_tree) == 1)):
+                for block in section["blocks"]:
+                    if block["type"] == "table":
+                        df = table_to_dataframe(block)
+                        if df is not None:
+                            st.dataframe(df, use_container_width=True)
+                    elif block["type"] == "heading":
+                        st.markdown(f"### {block['text']}")
+                    elif block["type"] == "metrics":
+                        cols = st.columns(len(block["values"]))
+                        for idx, (key, value) in enumerate(block["values"].items()):
+                            with cols[idx]:
+                                st.metric(key, value)
+                    else:
+                        st.markdown(block["text"])
+
+        # 3パターンの数値比較（金額・割合を数値化して集計）
+        allocation_section = next((sec for sec in result_tree if sec["title"].startswith("2.")), None)
+        if allocation_section is not None:
+            pattern_summary, pattern_allocations = build_pattern_comparison(
+                allocation_section,
+                total_marketing_budget
+            )
+            if not pattern_summary.empty:
+                with st.expander("パターン比較（数値）", expanded=True):
+                    st.dataframe(pattern_summary, use_container_width=True, hide_index=True)
+                    if "予算との差異(%)" in pattern_summary:
+                        over_budget = pattern_summary[pattern_summary["予算との差異(%)"].abs() > 1]
+                        for _, row in over_budget.iterrows():
+                            st.warning(f"{row['パターン']}: 配分合計が総予算と {row['予算との差異(%)']:+.1f}% ずれています")
+                    if not pattern_allocations.empty:
+                        st.bar_chart(
+                            pattern_allocations.pivot_table(
+                                index="施策",
+                                columns="パターン",
+                                values="配分額(万円)",
+                                aggfunc="sum"
+                            )
+                        )
+
+        # タイムラインの参考に、参考データの成長倍率から視聴数の推移を数値で予測
+        if 4 in selected_section_ids:
+            projection_summary, projection_curves = build_growth_projection(inputs["vtuber_reference"])
+            if not projection_summary.empty:
+                with st.expander("視聴数の推移予測（数値）"):
+                    st.caption("参考データの7日視聴と成長倍率（Day1→Day3/7/30）から算出した累計視聴数とCPVの推移です")
+                    st.dataframe(projection_summary, use_container_width=True, hide_index=True)
+                    scenario = st.radio("シナリオ", PROJECTION_SCENARIOS, index=1, horizontal=True, key="projection_scenario")
+                    scenario_curves = projection_curves[projection_curves["シナリオ"] == scenario]
+                    st.markdown("**累計視聴数**")
+                    st.line_chart(scenario_curves.pivot(index="日数", columns="施策", values="累計視聴"))
+                    st.markdown("**CPV（円）**")
+                    st.line_chart(scenario_curves.pivot(index="日数", columns="施策", values="CPV(円)"))
+
+        # 配分案の金額をローンチ日・キャンペーン期間に合わせて週ごとに割り振る
+        if allocation_section is not None and not pattern_allocations.empty:
+            with st.expander("週次の予算ペーシング（数値）"):
+                pacing_pattern = st.selectbox(
+                    "対象のパターン",
+                    pattern_allocations["パターン"].unique().tolist(),
+                    key="pacing_pattern"
+                )
+                schedule, pacing_notes = build_pacing_schedule(
+                    pattern_allocations[pattern_allocations["パターン"] == pacing_pattern],
+                    inputs["launch_date"],
+                    campaign_period,
+                    inputs["vtuber_reference"]
+                )
+                if schedule.empty:
+                    st.caption("配分額を数値として読み取れる施策がありません")
+                else:
+                    st.caption(f"ローンチ日 {inputs['launch_date']:%Y-%m-%d}・キャンペーン期間 {campaign_period} の週次支出（万円）")
+                    for note in pacing_notes:
+                        st.caption(note)
+                    tactic_columns = [column for column in schedule.columns if column not in ("週開始", "週", "合計")]
+                    st.bar_chart(schedule.set_index("週開始")[tactic_columns])
+                    st.dataframe(schedule, use_container_width=True, hide_index=True)
+                    st.download_button(
+                        label="ペーシング表をCSVでダウンロード",
+                        data=schedule.to_csv(index=False).encode("utf-8"),
+                        file_name=f"{project_name}_pacing_{pacing_pattern}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                        mime="text/csv"
+                    )
 
-## 1. プロジェクト概要と制約の確認
-*入力情報の整理と前提条件の確認*
+        # 免責事項を生成しなかった場合も注意書きは表示
+        if 9 not in selected_section_ids:
+            st.caption("本結果は参考データに基づく推定値です。実際の効果は市場状況により変動します。")
+
+    with tab2:
+        st.subheader("入力サマリー")
+
+        summary_data = {
+            "項目": [
+                "プロジェクト名",
+                "目標販売本数",
+                "総マーケティング予算",
+                "キャンペーン期間",
+                "ターゲット市場",
+                "最適化重点",
+                "選択施策数"
+            ],
+            "内容": [
+                project_name,
+                f"{target_sales:,}本",
+                f"{total_marketing_budget:,}万円",
+                campaign_period,
+                target_market,
+                optimization_focus,
+                str(len(selected_tactics))
+            ]
+        }
+        df_summary = pd.DataFrame(summary_data)
+        st.dataframe(df_summary, use_container_width=True, hide_index=True)
 
-## 2. マーケティング予算配分案（3パターン）
+        st.subheader("選択された施策")
+        tactics_df = pd.DataFrame({
+            "施策": selected_tactics
+        })
+        st.dataframe(tactics_df, use_container_width=True, hide_index=True)
 
-### パターンA: 認知拡大重視プラン
-| 施策 | 詳細 | 配分額(万円) | 構成比 | 期待リーチ | CPV/CPM | 配分理由 |
-|------|------|-------------|--------|-----------|---------|----------|
-| VTuber | 10万人級×5名 | ... | ...% | ... | ...円 | 参考データより10万人級はCPV 6-10円 |
-| ... | ... | ... | ...% | ... | ...円 | ... |
+        st.subheader("使用された参考データ")
+        st.info("VTuber施策: 実績データ入力済み")
+        if other_reference:
+            st.info("その他施策: 実績データ入力済み")
 
-**総計**: {total_marketing_budget:,}万円
-**期待総視聴数**: ...回
-**期待販売本数**: ...本（CVR 0.5-2%で計算）
-**想定ROI**: ...%
+    with tab3:
+        st.download_button(
+            label="結果をテキストでダウンロード",
+            data=result,
+            file_name=f"{project_name}_marketing_budget_v2_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
+            mime="text/plain"
+        )
 
-### パターンB: バランス型プラン（推奨）
-| 施策 | 詳細 | 配分額(万円) | 構成比 | 期待リーチ | CPV/CPM | 配分理由 |
-|------|------|-------------|--------|-----------|---------|----------|
-| ... | ... | ... | ...% | ... | ...円 | ... |
+        # Excelはボタンを押したときだけ作成し、同じ結果の間は作成済みのものを使う
+        if "xlsx" not in analysis:
+            st.button("Excelファイルを作成", on_click=prepare_result_workbook, args=(analysis,))
+        if "xlsx_error" in analysis:
+            st.error(f"Excelファイルの作成に失敗しました: {analysis.pop('xlsx_error')}")
+
+        if "xlsx" in analysis:
+            st.download_button(
+                label="結果をExcelでダウンロード",
+                data=analysis["xlsx"],
+                file_name=f"{project_name}_marketing_budget_v2_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+def find_delta_plan(previous_analysis, inputs, section_ids):
+    """差分モードで更新できれば (変更項目, 再生成するセクション, 再利用するセクション)、できなければNone
+
+    ドラフトの結果は本番モデルで全体を作り直す（ドラフトの文章を土台にしない）。
+    """
+    if previous_analysis is None or previous_analysis.get("tier", FULL_TIER) == DRAFT_TIER:
+        return None
+    if not st.session_state.get("delta_mode", True) or not section_ids:
+        return None
+    changed, regenerate_ids, reuse_ids = plan_delta(previous_analysis, inputs, section_ids)
+    if not is_delta_applicable(previous_analysis, regenerate_ids):
+        return None
+    return changed, regenerate_ids, reuse_ids
+
+def get_speculation_session():
+    """先読みの持ち主を区別するセッションID（バックグラウンドのスレッドからsession_stateは使えないため）"""
+    return st.session_state.setdefault("speculation_session", uuid.uuid4().hex)
+
+def schedule_analysis_speculation():
+    """先読みモードなら、入力が止まってから一定時間後に本番の分析をバックグラウンドで始めておく
+
+    入力を変更するたびに各フラグメントから呼ぶ。入力が変わると前の先読みは取り消される。
+    差分モードで更新される場合は差分の呼び出しが十分に軽いので先読みしない。
+    """
+    state = st.session_state
+    session_id = get_speculation_session()
+    if not state.get("speculative_mode") or not state.get("api_key"):
+        cancel_speculation(session_id)
+        return
+
+    inputs = collect_analysis_inputs()
+    section_ids = state.get("analysis_section_ids", ALL_SECTION_IDS)
+    if (
+        not inputs["selected_tactics"]
+        or inputs["total_marketing_budget"] <= 0
+        or not section_ids
+        or find_delta_plan(state.get("analysis_result"), inputs, section_ids) is not None
+    ):
+        cancel_speculation(session_id)
+        return
+
+    tier, model = route_model("analysis", section_ids)
+    prompt = build_analysis_prompt(inputs, section_ids)
+    max_tokens = estimate_max_tokens(section_ids)
+    api_key = state["api_key"]
+    username = state.get("username", "unknown")
+    policy = get_current_user_policy()
+
+    def call(cancel_event, record_out):
+        return run_scheduled_call(
+            create_client(api_key),
+            username=username,
+            policy=policy,
+            task="analysis_speculative",
+            model=model,
+            max_tokens=max_tokens,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            tier=tier,
+            cancel_event=cancel_event,
+            record_out=record_out
+        )
 
-**総計**: {total_marketing_budget:,}万円
-**期待総視聴数**: ...回
-**期待販売本数**: ...本
-**想定ROI**: ...%
+    key = speculation_key(model, max_tokens, prompt)
+    if key == state.get("last_analysis_key"):
+        # 実行済みの入力はもう一度先読みしない
+        cancel_speculation(session_id)
+        return
+
+    schedule_speculation(
+        session_id,
+        key,
+        username,
+        call,
+        state.get("speculation_delay", DEFAULT_DELAY_SECONDS)
+    )
 
-### パターンC: 購買転換重視プラン
-| 施策 | 詳細 | 配分額(万円) | 構成比 | 期待リーチ | CPV/CPM | 配分理由 |
-|------|------|-------------|--------|-----------|---------|----------|
-| ... | ... | ... | ...% | ... | ...円 | ... |
+def open_archived_analysis(analysis_id):
+    """アーカイブの分析結果を表示中の結果にする（保存済みの解析結果を使い、再解析・API呼び出しはしない）"""
+    analysis = load_analysis(analysis_id)
+    if analysis is None:
+        st.session_state["archive_message"] = "選択した分析結果が見つかりません"
+        return
+    analysis["opened_from_archive"] = True
+    st.session_state["analysis_result"] = analysis
+    log_access(
+        st.session_state.get("username", "unknown"),
+        "archive_opened",
+        f"アーカイブ #{analysis_id}: {analysis['inputs'].get('project_name', '')}"
+    )
 
-**総計**: {total_marketing_budget:,}万円
-**期待総視聴数**: ...回
-**期待販売本数**: ...本
-**想定ROI**: ...%
+def render_archive_search():
+    """過去の分析結果の全文検索（プロジェクト名・ジャンル・施策・本文）"""
+    with st.expander("過去の分析を検索"):
+        query = st.text_input(
+            "検索語",
+            key="archive_query",
+            placeholder="例: サバイバル 3億",
+            help="プロジェクト名・ジャンル・施策・本文から検索します。「3億」「5000万円」は総予算の条件になります"
+        )
+        try:
+            hits = search_analyses(query)
+        except Exception as e:
+            st.error(f"アーカイブの検索に失敗しました: {e}")
+            return
+
+        if "archive_message" in st.session_state:
+            st.warning(st.session_state.pop("archive_message"))
+        if hits.empty:
+            st.caption("該当する分析結果はありません" if query else "保存された分析結果はまだありません")
+            return
+
+        st.dataframe(hits, use_container_width=True, hide_index=True)
+        labels = {
+            row["id"]: f"#{row['id']} {row['プロジェクト']}（{row['ジャンル']}・{row['予算(万円)']:,}万円・{row['作成日時']}）"
+            for _, row in hits.iterrows()
+        }
+        selected_id = st.selectbox("開く分析結果", list(labels), format_func=labels.get, key="archive_selected")
+        st.button("この分析結果を開く", on_click=open_archived_analysis, args=(selected_id,))
 
-## 3. 数値の妥当性検証
+@st.fragment
+def render_analysis():
+    """生成セクションの選択・分析実行・結果表示"""
+    # 生成するセクション
+    st.markdown("---")
+    st.subheader("生成するセクション")
 
-## 4. タイムライン別予算配分
+    generation_scope = st.radio(
+        "生成範囲",
+        ["全セクション", "配分表のみ（セクション2）", "カスタム"],
+        horizontal=True,
+        help="必要なセクションだけを生成すると、処理時間とAPIコストを削減できます"
+    )
 
-## 5. KPI設定と測定方法
+    section_titles = {section["id"]: section["title"] for section in REPORT_SECTIONS}
 
-## 6. リスク分析と対応策
+    if generation_scope == "全セクション":
+        selected_section_ids = ALL_SECTION_IDS
+    elif generation_scope == "配分表のみ（セクション2）":
+        selected_section_ids = TABLES_ONLY_SECTION_IDS
+    else:
+        selected_section_ids = st.multiselect(
+            "セクションを選択",
+            options=ALL_SECTION_IDS,
+            default=TABLES_ONLY_SECTION_IDS,
+            format_func=lambda section_id: section_titles[section_id]
+        )
 
-## 7. 推奨実行プラン
+    analysis_inputs = collect_analysis_inputs()
+    api_key = st.session_state.get("api_key")
+    project_name = analysis_inputs["project_name"]
+    total_marketing_budget = analysis_inputs["total_marketing_budget"]
+    selected_tactics = analysis_inputs["selected_tactics"]
+
+    # 前回の結果があれば、変更された入力に関係するセクションだけを再生成する
+    previous_analysis = st.session_state.get("analysis_result")
+    delta_plan = None
+    if previous_analysis is not None and previous_analysis.get("tier", FULL_TIER) == DRAFT_TIER:
+        st.caption("前回の結果はドラフトのため、本番モデルで全セクションを生成します")
+    elif previous_analysis is not None:
+        delta_enabled = st.checkbox(
+            "差分モード（前回の結果から変更点だけを再計算）",
+            key="delta_mode",
+            value=True,
+            help="変更した入力に関係しないセクションは前回の結果をそのまま使います"
+        )
+        delta_plan = find_delta_plan(previous_analysis, analysis_inputs, selected_section_ids)
+        if delta_plan is not None:
+            plan_summary = describe_plan(*delta_plan)
+            st.caption(
+                f"変更された入力: {'、'.join(plan_summary['changed']) or 'なし'} / "
+                f"再生成: {len(delta_plan[1])}セクション / 前回の結果を使用: {len(delta_plan[2])}セクション"
+            )
+        elif delta_enabled and selected_section_ids:
+            st.caption("前回の結果にないセクションが含まれるため、通常の実行になります")
+
+    # 先読みモード: 入力が止まったら本番の分析を裏で始め、実行ボタンで結果をすぐ表示する
+    speculative_mode = st.checkbox(
+        "先読みモード（入力が止まったら裏で分析を開始）",
+        key="speculative_mode",
+        value=False,
+        help="入力が一定時間変わらなければバックグラウンドで分析を始めます。入力を変えると取り消されますが、それまでに消費したトークンは無駄になります"
+    )
+    if speculative_mode:
+        st.slider(
+            "先読みを始めるまでの待ち時間（秒）",
+            min_value=3,
+            max_value=60,
+            key="speculation_delay",
+            value=int(DEFAULT_DELAY_SECONDS)
+        )
+    st.session_state["analysis_section_ids"] = list(selected_section_ids)
+    schedule_analysis_speculation()
 
-## 8. 次のアクション（チェックリスト形式）
+    if delta_plan is not None:
+        st.caption(f"最大出力トークン: {estimate_max_tokens(delta_plan[1]) if delta_plan[1] else 0:,}")
+    else:
+        st.caption(f"最大出力トークン: {estimate_max_tokens(selected_section_ids):,}")
+
+    # 分析実行ボタン（ドラフト: 高速モデルで配分表のみ / 本番: 選択したセクションを本番モデルで生成）
+    col_run, col_draft = st.columns([3, 2])
+    with col_run:
+        run_full = st.button("予算最適化を実行", type="primary", use_container_width=True)
+    with col_draft:
+        run_draft = st.button(
+            "ドラフトを作成（高速・配分表のみ）",
+            use_container_width=True,
+            help="高速・低コストのモデルで配分表だけを先に作成します。内容を確認してから本番モデルで精緻化できます"
+        )
 
-## 9. 免責事項
-"""
-                
-                message = client.messages.create(
-                    model="claude-sonnet-4-20250514",
-                    max_tokens=4000,
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                
-                result = message.content[0].text
-                
-                st.success("最適化完了")
-                st.markdown("---")
-                
-                # セクションごとに分割
-                sections = parse_analysis_result(result)
-                
-                # タブで結果を整理
-                tab1, tab2, tab3 = st.tabs(["最適化結果", "入力サマリー", "ダウンロード"])
-                
-                with tab1:
-                    # 各セクションをexpanderで表示
-                    for section_name, section_content in sections.items():
-                        with st.expander(section_name, expanded=(section_name.startswith("2."))):
-                            # 表が含まれているか確認
-                            if '|' in section_content and '---' in section_content:
-                                # 表とそれ以外を分離
-                                parts = section_content.split('\n\n')
-                                for part in parts:
-                                    if '|' in part and '---' in part:
-                                        # 表をDataFrameに変換
-                                        df = parse_markdown_table(part)
-                                        if df is not None:
-                                            st.dataframe(df, use_container_width=True)
-                                    elif part.strip():
-                                        # 通常のテキスト
-                                        st.markdown(part)
-                            else:
-                                # 表が含まれていない場合はそのまま表示
-                                st.markdown(section_content)
-                                
-                                # メトリクスを抽出して表示
-                                if "パターン" in section_name:
-                                    metrics = extract_metrics_from_text(section_content)
-                                    if metrics:
-                                        cols = st.columns(len(metrics))
-                                        for idx, (key, value) in enumerate(metrics.items()):
-                                            with cols[idx]:
-                                                st.metric(key, value)
-                    
-                with tab2:
-                    st.subheader("入力サマリー")
-                    
-                    summary_data = {
-                        "項目": [
-                            "プロジェクト名",
-                            "目標販売本数",
-                            "総マーケティング予算",
-                            "キャンペーン期間",
-                            "ターゲット市場",
-                            "最適化重点",
-                            "選択施策数"
-                        ],
-                        "内容": [
-                            project_name,
-                            f"{target_sales:,}本",
-                            f"{total_marketing_budget:,}万円",
-                            campaign_period,
-                            target_market,
-                            optimization_focus,
-                            str(len(selected_tactics))
-                        ]
+    if run_draft:
+        # ドラフトは前回の結果に関係なく配分表だけを生成
+        selected_section_ids = TABLES_ONLY_SECTION_IDS
+        delta_plan = None
+
+    if run_full or run_draft:
+        requested_at = time.perf_counter()
+
+        if not api_key:
+            st.error("Claude API Keyを入力してください（サイドバー）")
+        elif not selected_tactics:
+            st.error("最低1つのマーケティング施策を選択してください")
+        elif total_marketing_budget <= 0:
+            st.error("総マーケティング予算は0より大きい値を入力してください")
+        elif not selected_section_ids:
+            st.error("生成するセクションを最低1つ選択してください")
+        else:
+            log_access(
+                st.session_state.get("username", "unknown"),
+                "analysis_executed",
+                f"プロジェクト: {project_name}, 予算: {total_marketing_budget}万円, セクション: {len(selected_section_ids)}/{len(ALL_SECTION_IDS)}"
+                + (f", 差分再生成: {len(delta_plan[1])}" if delta_plan is not None else "")
+                + (", ドラフト" if run_draft else "")
+            )
+
+            with st.spinner("最適化計算中... (30-60秒かかります)"):
+                try:
+                    if run_draft:
+                        tier, model = route_model("analysis_draft", selected_section_ids)
+                    else:
+                        tier, model = route_model("analysis", selected_section_ids)
+
+                    result = None
+                    if delta_plan is not None and not delta_plan[1]:
+                        # 変更がなければAPIを呼ばずに前回の結果を使う
+                        result = merge_results(previous_analysis, "", selected_section_ids, [])
+                        tier, model = previous_analysis.get("tier", tier), previous_analysis.get("model", model)
+                        st.info("前回から変更がないため、前回の結果を表示しています")
+                    elif delta_plan is not None:
+                        changed, regenerate_ids, _ = delta_plan
+                        client = create_client(api_key)
+                        tier, model = route_model("analysis_delta", regenerate_ids)
+
+                        delta_result = run_scheduled_call(
+                            client,
+                            username=st.session_state.get("username", "unknown"),
+                            policy=get_current_user_policy(),
+                            task="analysis_delta",
+                            model=model,
+                            max_tokens=estimate_max_tokens(regenerate_ids),
+                            messages=[
+                                {"role": "user", "content": build_delta_prompt(previous_analysis, analysis_inputs, changed, regenerate_ids)}
+                            ],
+                            requested_at=requested_at,
+                            tier=tier
+                        )
+                        try:
+                            result = merge_results(previous_analysis, delta_result, selected_section_ids, regenerate_ids)
+                        except IncompleteDeltaError as e:
+                            # 前回のセクションで補わず、通常の実行で生成し直す
+                            st.warning(f"{e}。選択したセクションをすべて生成し直します")
+                            tier, model = route_model("analysis", selected_section_ids)
+
+                    if result is None:
+                        client = create_client(api_key)
+
+                        prompt = build_analysis_prompt(analysis_inputs, selected_section_ids)
+                        max_tokens = estimate_max_tokens(selected_section_ids)
+
+                        # 同じ入力の先読みがあればその結果を使う
+                        analysis_key = speculation_key(model, max_tokens, prompt)
+                        result = None
+                        if run_full and speculative_mode:
+                            speculation_record = {}
+                            result = take_speculation(
+                                get_speculation_session(),
+                                analysis_key,
+                                st.session_state.get("username", "unknown"),
+                                record_out=speculation_record
+                            )
+                            if result is not None:
+                                # 先読みは実行時には利用枠に数えないので、使ったときに数える
+                                charge_quota(st.session_state.get("username", "unknown"), get_current_user_policy(), speculation_record)
+                                st.caption("先読みで計算済みの結果を使用しました")
+
+                        if result is None:
+                            result = run_scheduled_call(
+                                client,
+                                username=st.session_state.get("username", "unknown"),
+                                policy=get_current_user_policy(),
+                                task="analysis_draft" if run_draft else "analysis",
+                                model=model,
+                                max_tokens=max_tokens,
+                                messages=[
+                                    {"role": "user", "content": prompt}
+                                ],
+                                requested_at=requested_at,
+                                tier=tier
+                            )
+                        st.session_state["last_analysis_key"] = analysis_key
+
+                    st.success("最適化完了")
+
+                    # 1回の走査でセクション・表・メトリクスに分解
+                    result_tree = parse_result_tree(result)
+
+                    analysis = {
+                        "text": result,
+                        "tree": result_tree,
+                        "inputs": analysis_inputs,
+                        "section_ids": list(selected_section_ids),
+                        "tier": tier,
+                        "model": model,
                     }
-                    df_summary = pd.DataFrame(summary_data)
-                    st.dataframe(df_summary, use_container_width=True, hide_index=True)
-                    
-                    st.subheader("選択された施策")
-                    tactics_df = pd.DataFrame({
-                        "施策": selected_tactics
-                    })
-                    st.dataframe(tactics_df, use_container_width=True, hide_index=True)
-                    
-                    st.subheader("使用された参考データ")
-                    st.info("VTuber施策: 実績データ入力済み")
-                    if other_reference:
-                        st.info("その他施策: 実績データ入力済み")
-                
-                with tab3:
-                    st.download_button(
-                        label="結果をテキストでダウンロード",
-                        data=result,
-                        file_name=f"{project_name}_marketing_budget_v2_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
-                        mime="text/plain"
+                    try:
+                        analysis["archive_id"] = archive_analysis(analysis, st.session_state.get("username", "unknown"))
+                    except Exception as e:
+                        st.warning(f"分析結果のアーカイブに失敗しました: {e}")
+                    st.session_state["analysis_result"] = analysis
+
+                except (QuotaExceeded, QueueTimeout) as e:
+                    st.error(str(e))
+                except Exception as e:
+                    st.error(f"エラーが発生しました: {str(e)}")
+                    st.info("APIキーが正しいか確認してください")
+
+    render_archive_search()
+
+    if "analysis_result" in st.session_state:
+        st.markdown("---")
+        render_analysis_result(st.session_state["analysis_result"])
+
+def default_portfolio_titles():
+    """ポートフォリオ表の初期値（入力中のプロジェクト1行）"""
+    return pd.DataFrame([{
+        "タイトル": st.session_state.get("project_name", ""),
+        "ジャンル": st.session_state.get("project_genre", ""),
+        "ターゲット市場": st.session_state.get("target_market", "日本のみ"),
+        "販売単価(円)": 5000,
+        "購入率(%)": None,
+        "最低予算(万円)": 0.0,
+        "最大予算(万円)": None,
+    }], columns=PORTFOLIO_TITLE_COLUMNS)
+
+def portfolio_references(titles):
+    """タイトルごとの参考データ（実績ストアにジャンルがあればその集計、なければ入力中の参考データ）"""
+    genres = set(load_store_genres(get_store_signature()))
+    vtuber_reference = st.session_state.get("vtuber_reference", DEFAULT_VTUBER_REFERENCE)
+    references = [
+        load_store_reference(get_store_signature(), genre) if genre in genres else vtuber_reference
+        for genre in titles["ジャンル"]
+    ]
+    return titles.assign(**{
+        "VTuber参考データ": references,
+        "その他参考データ": st.session_state.get("other_reference", DEFAULT_OTHER_REFERENCE),
+    })
+
+@st.fragment
+def render_portfolio():
+    """複数タイトルで共通の予算を配分（タイトルごとの最適化を並列に実行し、限界売上を揃える）"""
+    st.markdown("---")
+    with st.expander("ポートフォリオ最適化（複数タイトルで予算を分配）"):
+        st.caption("タイトルごとにVTuberとデジタル広告の最適な内訳を求め、1円あたりの売上増が大きいタイトルから総予算を割り当てます（APIは使いません）")
+        col_pf1, col_pf2 = st.columns(2)
+        with col_pf1:
+            portfolio_budget = st.number_input(
+                "総予算（万円）",
+                min_value=0,
+                value=int(st.session_state.get("total_marketing_budget", 50000)),
+                step=1000,
+                key="portfolio_budget"
+            )
+        with col_pf2:
+            scenario = st.selectbox(
+                "単価・視聴数の見積もり",
+                PROJECTION_SCENARIOS,
+                index=1,
+                key="portfolio_scenario"
+            )
+
+        titles = st.data_editor(
+            default_portfolio_titles(),
+            column_config={
+                "ターゲット市場": st.column_config.SelectboxColumn(options=["日本のみ", "日本+アジア", "グローバル"]),
+                "販売単価(円)": st.column_config.NumberColumn(min_value=0, step=100),
+                "購入率(%)": st.column_config.NumberColumn(min_value=0.0, max_value=100.0, help="空欄は参考データのCVR"),
+                "最低予算(万円)": st.column_config.NumberColumn(min_value=0.0, step=100.0),
+                "最大予算(万円)": st.column_config.NumberColumn(min_value=0.0, step=100.0, help="空欄は上限なし"),
+            },
+            num_rows="dynamic",
+            hide_index=True,
+            key="portfolio_titles"
+        )
+
+        if st.button("ポートフォリオを最適化", disabled=portfolio_budget <= 0):
+            try:
+                with st.spinner("タイトルごとの配分を計算中..."):
+                    started = time.perf_counter()
+                    allocation, summary = optimize_portfolio(
+                        portfolio_references(titles),
+                        portfolio_budget * 1e4,
+                        scenario=scenario
                     )
-                    
-            except Exception as e:
-                st.error(f"エラーが発生しました: {str(e)}")
-                st.info("APIキーが正しいか確認してください")
+                    summary["elapsed_seconds"] = time.perf_counter() - started
+                st.session_state["portfolio_result"] = (allocation, summary)
+                log_access(
+                    st.session_state.get("username", "unknown"),
+                    "portfolio_optimized",
+                    f"タイトル数: {summary['titles']}, 総予算: {portfolio_budget}万円"
+                )
+            except ValueError as e:
+                st.session_state.pop("portfolio_result", None)
+                st.error(str(e))
+
+        if "portfolio_result" in st.session_state:
+            allocation, summary = st.session_state["portfolio_result"]
+            col_res1, col_res2, col_res3, col_res4 = st.columns(4)
+            with col_res1:
+                st.metric("配分合計", f"{summary['spent_yen'] / 1e4:,.0f}万円", delta=f"総予算 {summary['budget_yen'] / 1e4:,.0f}万円", delta_color="off")
+            with col_res2:
+                st.metric("想定売上", f"{summary['revenue_yen'] / 1e4:,.0f}万円")
+            with col_res3:
+                st.metric("ROAS", f"{summary['roas']:,.0f}%" if summary["roas"] is not None else "-")
+            with col_res4:
+                st.metric("想定販売本数", f"{summary['sales']:,}本")
+            st.bar_chart(allocation.set_index("タイトル")[["VTuber(万円)", "デジタル広告(万円)"]])
+            st.dataframe(allocation, use_container_width=True, hide_index=True)
+            st.caption(f"{summary['titles']}タイトル・予算の刻み {summary['unit_yen'] / 1e4:,.0f}万円・計算時間 {summary['elapsed_seconds']:.1f}秒")
+
+# アクセスログ・パフォーマンス表示（管理者のみ）
+if st.session_state.get("show_logs", False) and st.session_state.get("username") == "admin":
+    render_admin_panel()
+
+render_input_form()
+render_reference_editor()
+render_constraints()
+render_analysis()
+render_portfolio()
 
 # フッター
 st.markdown("---")
 st.caption("マーケティング予算最適化AI v2.0 - KRAFTON Japan Internal Tool")
+
+script_span.end()
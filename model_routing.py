@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+
+# ============================================
+# モデルの振り分け（ドラフト / 本番）
+# ============================================
+#
+# 環境変数で上書きできる:
+#   LLM_MODEL_DRAFT=claude-3-5-haiku-20241022
+#   LLM_MODEL_FULL=claude-sonnet-4-20250514
+#   LLM_TASK_TIERS="analysis_delta=draft,api_key_check=draft"
+
+DRAFT_TIER = "draft"
+FULL_TIER = "full"
+
+MODEL_TIERS = {
+    DRAFT_TIER: {"label": "ドラフト（高速・低コスト）", "model": "claude-3-5-haiku-20241022"},
+    FULL_TIER: {"label": "本番（高精度）", "model": "claude-sonnet-4-20250514"},
+}
+
+# 階層の順序（複数セクションをまとめて生成するときは最も上位の階層を使う）
+TIER_ORDER = [DRAFT_TIER, FULL_TIER]
+
+# タスクごとの既定の階層
+TASK_TIERS = {
+    "analysis": FULL_TIER,
+    "analysis_draft": DRAFT_TIER,
+    "analysis_delta": FULL_TIER,
+    "token_count": FULL_TIER,
+    "api_key_check": DRAFT_TIER,
+}
+
+# セクションごとの階層（定型的なセクションだけを生成する場合はドラフトモデルで足りる）
+SECTION_TIERS = {
+    1: FULL_TIER,
+    2: FULL_TIER,
+    3: FULL_TIER,
+    4: FULL_TIER,
+    5: FULL_TIER,
+    6: FULL_TIER,
+    7: FULL_TIER,
+    8: DRAFT_TIER,
+    9: DRAFT_TIER,
+}
+
+# 100万トークンあたりの料金（USD）: (入力, 出力, キャッシュ書き込み, キャッシュ読み込み)
+MODEL_PRICES = {
+    "claude-3-5-haiku-20241022": (0.80, 4.00, 1.00, 0.08),
+    "claude-3-haiku-20240307": (0.25, 1.25, 0.30, 0.03),
+    "claude-sonnet-4-20250514": (3.00, 15.00, 3.75, 0.30),
+    "claude-3-7-sonnet-20250219": (3.00, 15.00, 3.75, 0.30),
+    "claude-opus-4-20250514": (15.00, 75.00, 18.75, 1.50),
+}
+
+
+def get_task_tiers():
+    """タスク→階層の対応（LLM_TASK_TIERSで上書き）"""
+    tiers = dict(TASK_TIERS)
+    for item in os.environ.get("LLM_TASK_TIERS", "").split(","):
+        task, _, tier = item.partition("=")
+        if task.strip() and tier.strip() in MODEL_TIERS:
+            tiers[task.strip()] = tier.strip()
+    return tiers
+
+
+def get_model(tier):
+    """階層に対応するモデル名（LLM_MODEL_DRAFT / LLM_MODEL_FULLで上書き）"""
+    return os.environ.get(f"LLM_MODEL_{tier.upper()}") or MODEL_TIERS[tier]["model"]
+
+
+def get_tier_label(tier):
+    return MODEL_TIERS[tier]["label"]
+
+
+def route_tier(task, section_ids=None):
+    """タスクと生成するセクションから階層を決める
+
+    タスクの階層を基本とし、分析タスクでは選択セクションの階層のうち最も上位のものを上限とする
+    （免責事項だけの再生成などは本番モデルを使わない）。
+    """
+    tier = get_task_tiers().get(task, FULL_TIER)
+    if section_ids and tier == FULL_TIER:
+        section_tiers = [SECTION_TIERS.get(section_id, FULL_TIER) for section_id in section_ids]
+        tier = max(section_tiers, key=TIER_ORDER.index)
+    return tier
+
+
+def route_model(task, section_ids=None):
+    """(階層, モデル名)"""
+    tier = route_tier(task, section_ids)
+    return tier, get_model(tier)
+
+
+def estimate_cost(model, input_tokens=0, output_tokens=0, cache_creation_input_tokens=0, cache_read_input_tokens=0):
+    """トークン数から料金（USD）を概算。料金表にないモデルはNone"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    input_price, output_price, cache_write_price, cache_read_price = prices
+    return (
+        (input_tokens or 0) * input_price
+        + (output_tokens or 0) * output_price
+        + (cache_creation_input_tokens or 0) * cache_write_price
+        + (cache_read_input_tokens or 0) * cache_read_price
+    ) / 1_000_000
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from roster_solver import tier_candidates, value_curve, combine_budget_curves, budget_unit
+
+# ============================================
+# ポートフォリオ最適化（複数タイトルで共通の予算を限界売上が釣り合うように配分）
+# ============================================
+#
+# 1. タイトルごとに予算（刻み）→ 最大売上の曲線を並列に計算する（プロセスプール）
+#    - VTuber: 参考データの規模別の行から人数を選ぶナップサック（roster_solver）
+#    - デジタル広告: CPMから求めたインプレッションが市場の到達上限に近づくほど伸びが鈍る曲線
+#    - 2つの合成で予算ごとの最適な内訳を決める
+# 2. 各曲線の上側の凸包を取り、1円あたりの売上が大きい区間から全タイトル共通の予算に割り当てる
+
+# 市場ごとの到達可能な人数の上限（デジタル広告のリーチが飽和する水準）
+MARKET_REACH_CAPS = {
+    "日本のみ": 3_000_000,
+    "日本+アジア": 8_000_000,
+    "グローバル": 20_000_000,
+}
+DEFAULT_REACH_CAP = MARKET_REACH_CAPS["日本のみ"]
+
+# デジタル広告の平均接触回数（インプレッション÷リーチ）
+AD_FREQUENCY = 3.0
+
+# 参考データにCPMがない場合の値（円）
+DEFAULT_CPM = 800.0
+
+# 参考データにCVRがない場合の購入率（%、リーチ→購入）
+DEFAULT_PURCHASE_RATE = 1.25
+
+# これより少ないタイトル数ではプロセスを起動せずに順番に計算する
+PARALLEL_MIN_TITLES = 4
+
+# 並列数（既定はCPU数）
+MAX_WORKERS = int(os.environ.get("PORTFOLIO_MAX_WORKERS", "0")) or os.cpu_count() or 1
+
+# 「- YouTube広告: CPM 500-1,000円」
+_CPM_PATTERN = re.compile(r'CPM\s*(?P<low>\d[\d,]*)\s*(?:[-~〜～]\s*(?P<high>\d[\d,]*))?\s*円')
+# 「- CVR（認知→購入）: 0.5-2%」
+_CVR_PATTERN = re.compile(r'CVR[^:：\n]*[:：]\s*(?P<low>\d+(?:\.\d+)?)\s*(?:[-~〜～]\s*(?P<high>\d+(?:\.\d+)?))?\s*%')
+
+TITLE_COLUMNS = ["タイトル", "ジャンル", "ターゲット市場", "販売単価(円)", "購入率(%)", "最低予算(万円)", "最大予算(万円)"]
+
+
+def _range_mid(match):
+    low = float(match.group("low").replace(",", ""))
+    high = float((match.group("high") or match.group("low")).replace(",", ""))
+    return (low + high) / 2
+
+
+def parse_ad_cpm(reference_text):
+    """参考データのCPMの行（中央値）の平均。なければDEFAULT_CPM"""
+    values = [_range_mid(match) for match in _CPM_PATTERN.finditer(reference_text or "")]
+    return float(np.mean(values)) if values else DEFAULT_CPM
+
+
+def parse_purchase_rate(reference_text):
+    """参考データのCVR（認知→購入）の中央値（%）。なければDEFAULT_PURCHASE_RATE"""
+    match = _CVR_PATTERN.search(reference_text or "")
+    return _range_mid(match) if match else DEFAULT_PURCHASE_RATE
+
+
+def ad_reach_curve(budgets_yen, cpm, reach_cap):
+    """デジタル広告の予算ごとのリーチ（上限に近づくほど伸びが鈍る）"""
+    impressions = budgets_yen / cpm * 1000
+    return reach_cap * (1 - np.exp(-impressions / AD_FREQUENCY / reach_cap))
+
+
+def solve_title(spec):
+    """1タイトル分の予算曲線（プロセスプールから呼ぶため引数・戻り値はpickle可能な値のみ）
+
+    spec: vtuber_reference, other_reference, market, scenario, unit, steps
+    戻り値: {"reach": 予算ごとの最大リーチ, "vtuber_steps": そのうちVTuberに使う刻み数}
+    """
+    unit, steps = spec["unit"], spec["steps"]
+    budgets = np.arange(steps + 1) * float(unit)
+    ads = ad_reach_curve(
+        budgets,
+        parse_ad_cpm(spec["other_reference"]),
+        MARKET_REACH_CAPS.get(spec["market"], DEFAULT_REACH_CAP)
+    )
+
+    candidates = tier_candidates(spec["vtuber_reference"], spec["scenario"])
+    if candidates.empty:
+        vtuber = np.zeros(steps + 1)
+    else:
+        vtuber = value_curve(candidates, unit, steps, objective="views")
+
+    # VTuberは視聴が増える予算だけを候補にして合成（階段状の曲線の平らな部分は広告に回す方が良い）
+    vtuber_points = np.where(np.diff(vtuber, prepend=-1.0) > 0, vtuber, -np.inf)
+    reach, vtuber_steps = combine_budget_curves(ads, vtuber_points)
+    return {"reach": reach, "vtuber_steps": vtuber_steps}
+
+
+# ============================================
+# プロセスプール（起動に時間がかかるため、最初の実行で作って使い回す）
+# ============================================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+def solve_titles(specs, parallel=None):
+    """全タイトルの予算曲線を計算（タイトル数がPARALLEL_MIN_TITLES以上ならプロセスプールで並列）"""
+    if parallel is None:
+        parallel = MAX_WORKERS > 1 and len(specs) >= PARALLEL_MIN_TITLES
+    if not parallel:
+        return [solve_title(spec) for spec in specs]
+
+    try:
+        chunksize = max(1, len(specs) // (MAX_WORKERS * 4))
+        return list(_get_executor().map(solve_title, specs, chunksize=chunksize))
+    except BrokenProcessPool as e:
+        # ワーカーが落ちた場合はプールを作り直せるようにして、この回は順番に計算する
+        print(f"ポートフォリオ並列計算エラー: {e}")
+        _reset_executor()
+        return [solve_title(spec) for spec in specs]
+
+
+# ============================================
+# タイトル間の配分（限界売上の大きい順に割り当てる）
+# ============================================
+
+def _upper_hull(values, start, stop):
+    """values[start..stop] の上側の凸包の頂点（刻み位置）"""
+    hull = []
+    for x in range(start, stop + 1):
+        while len(hull) >= 2:
+            x1, x2 = hull[-2], hull[-1]
+            # x2 が x1 と x を結ぶ線分の下にあれば除く
+            if (values[x2] - values[x1]) * (x - x1) <= (values[x] - values[x1]) * (x2 - x1):
+                hull.pop()
+            else:
+                break
+        hull.append(x)
+    return hull
+
+
+def allocate_budget(curves, total_steps, min_steps, max_steps):
+    """売上曲線の凸包の区間を1刻みあたりの売上の大きい順に取り、各タイトルの刻み数を決める
+
+    区間はタイトル内では傾きの大きい順に並ぶので、取れなかった区間があればそのタイトルは打ち切る。
+    最後に入り切らない区間は残りの予算の分だけ割り当てる（凸包ではなく実際の曲線の値になる）。
+    戻り値は (刻み数の配列, 各タイトルの最後に取った区間の傾き)。
+    """
+    allocation = np.array(min_steps, dtype=int)
+    remaining = total_steps - int(allocation.sum())
+    if remaining < 0:
+        raise ValueError("最低予算の合計が総予算を超えています")
+
+    segments = []
+    for title, (values, low, high) in enumerate(zip(curves, min_steps, max_steps)):
+        hull = _upper_hull(values, low, high)
+        for x1, x2 in zip(hull, hull[1:]):
+            segments.append(((values[x2] - values[x1]) / (x2 - x1), title, x1, x2))
+    segments.sort(key=lambda segment: -segment[0])
+
+    marginal = np.zeros(len(curves))
+    blocked = set()
+    for slope, title, x1, x2 in segments:
+        if remaining <= 0 or slope <= 0:
+            break
+        if title in blocked or allocation[title] != x1:
+            continue
+        take = min(x2 - x1, remaining)
+        allocation[title] = x1 + take
+        marginal[title] = slope
+        remaining -= take
+        if take < x2 - x1:
+            blocked.add(title)
+    return allocation, marginal
+
+
+def build_title_specs(titles, total_budget_yen, scenario="中央"):
+    """タイトル表（TITLE_COLUMNSと参考データ列）から計算用の辞書を作る"""
+    unit = budget_unit(total_budget_yen)
+    steps = int(total_budget_yen // unit)
+    specs = []
+    for _, row in titles.iterrows():
+        specs.append({
+            "vtuber_reference": row["VTuber参考データ"],
+            "other_reference": row["その他参考データ"],
+            "market": row["ターゲット市場"],
+            "scenario": scenario,
+            "unit": unit,
+            "steps": steps,
+        })
+    return specs, unit, steps
+
+
+def optimize_portfolio(titles, total_budget_yen, scenario="中央", parallel=None):
+    """複数タイトルで総予算を分け合い、想定売上の合計を最大化する
+
+    titles: TITLE_COLUMNSに加えて「VTuber参考データ」「その他参考データ」の列を持つ表。
+    購入率が空の行は参考データのCVRを使う。最大予算が空・0の行は上限なし。
+    戻り値は (タイトル別の配分表, 合計の辞書)。入力が不正ならValueError。
+    """
+    titles = titles.dropna(subset=["タイトル"]).reset_index(drop=True)
+    titles = titles[titles["タイトル"].astype(str).str.strip() != ""].reset_index(drop=True)
+    if titles.empty:
+        raise ValueError("タイトルがありません")
+    if total_budget_yen <= 0:
+        raise ValueError("総予算を入力してください")
+
+    specs, unit, steps = build_title_specs(titles, total_budget_yen, scenario)
+    results = solve_titles(specs, parallel)
+
+    prices = titles["販売単価(円)"].fillna(0).to_numpy(dtype=float)
+    rates = np.array([
+        rate if pd.notna(rate) else parse_purchase_rate(other)
+        for rate, other in zip(titles["購入率(%)"], titles["その他参考データ"])
+    ], dtype=float)
+    revenues = [
+        result["reach"] * rate / 100 * price
+        for result, rate, price in zip(results, rates, prices)
+    ]
+
+    min_steps = np.ceil(titles["最低予算(万円)"].fillna(0).to_numpy(dtype=float) * 1e4 / unit).astype(int)
+    max_budget = titles["最大予算(万円)"].fillna(0).to_numpy(dtype=float)
+    max_steps = np.where(max_budget > 0, np.floor(max_budget * 1e4 / unit), steps).astype(int)
+    max_steps = np.minimum(max_steps, steps)
+    if (min_steps > max_steps).any():
+        invalid = titles.loc[min_steps > max_steps, "タイトル"]
+        raise ValueError(f"最低予算が最大予算を超えています: {', '.join(map(str, invalid))}")
+
+    allocation, marginal = allocate_budget(revenues, steps, min_steps, max_steps)
+
+    rows = []
+    for index, title in enumerate(titles["タイトル"]):
+        spend = int(allocation[index])
+        result = results[index]
+        reach = float(result["reach"][spend])
+        vtuber_yen = float(result["vtuber_steps"][spend] * unit)
+        revenue = float(revenues[index][spend])
+        budget_yen = spend * unit
+        rows.append({
+            "タイトル": title,
+            "配分予算(万円)": budget_yen / 1e4,
+            "VTuber(万円)": vtuber_yen / 1e4,
+            "デジタル広告(万円)": (budget_yen - vtuber_yen) / 1e4,
+            "想定リーチ": round(reach),
+            "想定販売本数": round(reach * rates[index] / 100),
+            "想定売上(万円)": round(revenue / 1e4, 1),
+            "ROAS(%)": round(revenue / budget_yen * 100, 1) if budget_yen else None,
+            "限界売上(円/円)": round(float(marginal[index]) / unit, 2),
+        })
+    allocation_df = pd.DataFrame(rows)
+
+    spent_yen = float(allocation.sum() * unit)
+    revenue_yen = float(sum(revenues[index][allocation[index]] for index in range(len(titles))))
+    summary = {
+        "titles": len(titles),
+        "budget_yen": total_budget_yen,
+        "spent_yen": spent_yen,
+        "unit_yen": unit,
+        "revenue_yen": revenue_yen,
+        "roas": revenue_yen / spent_yen * 100 if spent_yen else None,
+        "sales": int(allocation_df["想定販売本数"].sum()),
+    }
+    return allocation_df, summary
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+import re
+
+from tracing import traced
+
+# ============================================
+# 参考データの圧縮シリアライズ
+# ============================================
+
+# 「コスト 5-17万円」の数値部分（先頭の+、範囲、末尾の+を含む）
+_VALUE_PATTERN = re.compile(
+    r'^(?P<value>\+?\d[\d,.]*(?:\s*[-~〜]\s*\d[\d,.]*)?\+?)\s*(?P<unit>万円|円|%|倍)?(?P<rest>.*)$'
+)
+
+# 「CPV 0.9-10円」のように指標名と数値を空白で区切ったもの
+_METRIC_PATTERN = re.compile(r'^(?P<metric>\S.*?)\s+(?=[+\d])(?P<body>.*)$')
+
+
+def _parse_field(field):
+    """「コスト 5-17万円」を (指標名, 数値, 単位, 補足) に分解"""
+    field = field.strip()
+    metric = ""
+    body = field
+
+    metric_match = _METRIC_PATTERN.match(field)
+    if metric_match and _VALUE_PATTERN.match(metric_match.group("body")):
+        metric = metric_match.group("metric")
+        body = metric_match.group("body")
+
+    value_match = _VALUE_PATTERN.match(body)
+    if not value_match:
+        # 数値を含まない記述はそのまま値として扱う
+        return metric, body, "", ""
+
+    # 桁区切りのカンマは情報を持たないので除去
+    value = value_match.group("value").replace(",", "").replace(" ", "")
+    return metric, value, value_match.group("unit") or "", value_match.group("rest").strip()
+
+
+def parse_reference_text(reference_text):
+    """参考データの箇条書きを見出し・行のリストに変換"""
+    blocks = []
+    parent_label = None
+
+    for raw_line in reference_text.split('\n'):
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        # 見出し（【...】 / ■ ...:）
+        if line.startswith('【') or line.startswith('■'):
+            blocks.append({"type": "heading", "text": line.rstrip(':：')})
+            parent_label = None
+            continue
+
+        is_nested = raw_line.startswith((' ', '\t')) and line.startswith(('*', '-', '・'))
+        text = line.lstrip('-*・').strip()
+
+        parts = re.split(r'[:：]', text, maxsplit=1)
+        if len(parts) < 2:
+            # 「ラベル: 値」形式でない行は原文のまま残す
+            blocks.append({"type": "text", "text": text})
+            continue
+
+        label = parts[0].strip()
+        body = parts[1].strip()
+
+        if not body:
+            # 「- 東京ゲームショウ:」のような親項目
+            parent_label = label
+            continue
+
+        if is_nested and parent_label:
+            label = f"{parent_label}/{label}"
+        elif not is_nested:
+            parent_label = None
+
+        fields = [_parse_field(f) for f in body.split('、') if f.strip()]
+        blocks.append({"type": "row", "label": label, "fields": fields})
+
+    return blocks
+
+
+def _format_cell(value, unit, rest, lifted_unit):
+    """セル文字列（見出しに単位を移した場合は単位を省略）"""
+    if lifted_unit:
+        return f"{value}{rest}"
+    return f"{value}{unit}{rest}"
+
+
+def _render_row_group(rows):
+    """同じ指標構成の行をまとめて表形式で出力"""
+    metrics = [field[0] for field in rows[0]["fields"]]
+
+    if len(rows) == 1:
+        fields = rows[0]["fields"]
+        parts = [f"{m} {v}{u}{r}".strip() for m, v, u, r in fields]
+        return [f"{rows[0]['label']}: {'、'.join(parts)}"]
+
+    # 列ごとに単位が揃っていれば見出しへ移す（数値以外のセルは判定から除外）
+    lifted_units = []
+    for col in range(len(metrics)):
+        units = {row["fields"][col][2] for row in rows if row["fields"][col][2] or row["fields"][col][1][:1].isdigit()}
+        lifted_units.append(units.pop() if len(units) == 1 and "" not in units else "")
+
+    header = ["項目"]
+    for metric, unit in zip(metrics, lifted_units):
+        name = metric or "値"
+        header.append(f"{name}({unit})" if unit else name)
+
+    lines = ['|'.join(header)]
+    for row in rows:
+        cells = [row["label"]]
+        for (m, v, u, r), unit in zip(row["fields"], lifted_units):
+            cells.append(_format_cell(v, u, r, unit and u == unit))
+        lines.append('|'.join(cells))
+    return lines
+
+
+def serialize_reference_compact(reference_text):
+    """参考データを見出し＋区切り表の圧縮形式に変換（情報は落とさない）"""
+    output = []
+    pending_rows = []
+
+    def flush():
+        # 見出し単位で、指標構成が同じ行をグループ化（初出順）
+        groups = {}
+        for row in pending_rows:
+            signature = tuple(field[0] for field in row["fields"])
+            groups.setdefault(signature, []).append(row)
+        for rows in groups.values():
+            output.extend(_render_row_group(rows))
+        pending_rows.clear()
+
+    for block in parse_reference_text(reference_text):
+        if block["type"] == "row":
+            pending_rows.append(block)
+            continue
+
+        flush()
+        if block["type"] == "heading":
+            output.append(block["text"].replace('■ ', '■'))
+        else:
+            output.append(block["text"])
+
+    flush()
+    return '\n'.join(output)
+
+
+def format_reference_for_prompt(reference_text, compact=True):
+    """プロンプトに埋め込む参考データ文字列"""
+    if not reference_text or not compact:
+        return reference_text
+    return serialize_reference_compact(reference_text)
+
+
+# ============================================
+# トークン数の計測
+# ============================================
+
+def count_prompt_tokens(client, model, text):
+    """トークンカウントAPIで入力トークン数を取得"""
+    response = client.messages.count_tokens(
+        model=model,
+        messages=[{"role": "user", "content": text}]
+    )
+    return response.input_tokens
+
+
+# ============================================
+# 分析プロンプトの組み立て（セクション選択対応）
+# ============================================
+
+_PATTERN_TABLE = """| 施策 | 詳細 | 配分額(万円) | 構成比 | 期待リーチ | CPV/CPM | 配分理由 |
+|------|------|-------------|--------|-----------|---------|----------|"""
+
+_ALLOCATION_TEMPLATE = """
+### パターンA: 認知拡大重視プラン
+{table}
+| VTuber | 10万人級×5名 | ... | ...% | ... | ...円 | 参考データより10万人級はCPV 6-10円 |
+| ... | ... | ... | ...% | ... | ...円 | ... |
+
+**総計**: {total_budget}万円
+**期待総視聴数**: ...回
+**期待販売本数**: ...本（CVR 0.5-2%で計算）
+**想定ROI**: ...%
+
+### パターンB: バランス型プラン（推奨）
+{table}
+| ... | ... | ... | ...% | ... | ...円 | ... |
+
+**総計**: {total_budget}万円
+**期待総視聴数**: ...回
+**期待販売本数**: ...本
+**想定ROI**: ...%
+
+### パターンC: 購買転換重視プラン
+{table}
+| ... | ... | ... | ...% | ... | ...円 | ... |
+
+**総計**: {total_budget}万円
+**期待総視聴数**: ...回
+**期待販売本数**: ...本
+**想定ROI**: ...%"""
+
+# 出力セクション定義（max_tokensは全選択時に従来の4000となる配分）
+REPORT_SECTIONS = [
+    {"id": 1, "title": "1. プロジェクト概要と制約の確認", "max_tokens": 250, "body": "*入力情報の整理と前提条件の確認*"},
+    {"id": 2, "title": "2. マーケティング予算配分案（3パターン）", "max_tokens": 1600, "body": _ALLOCATION_TEMPLATE},
+    {"id": 3, "title": "3. 数値の妥当性検証", "max_tokens": 400, "body": ""},
+    {"id": 4, "title": "4. タイムライン別予算配分", "max_tokens": 400, "body": ""},
+    {"id": 5, "title": "5. KPI設定と測定方法", "max_tokens": 350, "body": ""},
+    {"id": 6, "title": "6. リスク分析と対応策", "max_tokens": 350, "body": ""},
+    {"id": 7, "title": "7. 推奨実行プラン", "max_tokens": 300, "body": ""},
+    {"id": 8, "title": "8. 次のアクション（チェックリスト形式）", "max_tokens": 250, "body": ""},
+    {"id": 9, "title": "9. 免責事項", "max_tokens": 100, "body": ""},
+]
+
+ALL_SECTION_IDS = [section["id"] for section in REPORT_SECTIONS]
+TABLES_ONLY_SECTION_IDS = [2]
+
+# 見出しと指示文の出力分
+_MAX_TOKENS_OVERHEAD = 100
+
+
+def get_report_sections(section_ids):
+    """選択されたセクション定義を番号順で取得"""
+    selected = set(section_ids)
+    return [section for section in REPORT_SECTIONS if section["id"] in selected]
+
+
+def estimate_max_tokens(section_ids):
+    """選択セクションに応じたmax_tokens"""
+    sections = get_report_sections(section_ids)
+    if len(sections) == len(REPORT_SECTIONS):
+        return sum(section["max_tokens"] for section in sections)
+    return sum(section["max_tokens"] for section in sections) + _MAX_TOKENS_OVERHEAD
+
+
+def build_output_format(section_ids, total_marketing_budget):
+    """回答形式（## 見出しとテンプレート）部分を組み立て"""
+    blocks = []
+    for section in get_report_sections(section_ids):
+        body = section["body"].format(table=_PATTERN_TABLE, total_budget=f"{total_marketing_budget:,}")
+        blocks.append(f"## {section['title']}\n{body}".rstrip())
+    return "\n\n".join(blocks)
+
+
+@traced("prompt_build")
+def build_analysis_prompt(inputs, section_ids=None):
+    """入力値の辞書から分析プロンプトを作成"""
+    if section_ids is None:
+        section_ids = ALL_SECTION_IDS
+
+    compact = inputs.get("compact_reference", True)
+    tactics_list = "\n".join([f"- {tactic}" for tactic in inputs["selected_tactics"]])
+    output_format = build_output_format(section_ids, inputs["total_marketing_budget"])
+
+    # 実績ストアから選んだ類似案件の参考行（上位k件のみ）
+    retrieved_reference = inputs.get("retrieved_reference")
+    if retrieved_reference:
+        retrieved_block = f"""
+【参考データ - 類似する過去実績】
+{format_reference_for_prompt(retrieved_reference, compact)}
+"""
+    else:
+        retrieved_block = ""
+
+    if len(get_report_sections(section_ids)) < len(REPORT_SECTIONS):
+        scope_instruction = "\n**以下に示したセクションのみを出力し、それ以外のセクションは出力しないでください。**\n"
+    else:
+        scope_instruction = ""
+
+    return f"""
+あなたはゲームパブリッシングのマーケティング予算最適化の専門家です。以下の情報を基に、最適なマーケティング予算配分案を作成してください。
+
+【プロジェクト情報】
+- プロジェクト名: {inputs["project_name"]}
+- ジャンル: {inputs["project_genre"]}
+- ローンチ予定日: {inputs["launch_date"]}
+- 目標販売本数: {inputs["target_sales"]:,}本
+- ターゲット市場: {inputs["target_market"]}
+
+【予算情報】
+- 総マーケティング予算: {inputs["total_marketing_budget"]:,}万円
+- キャンペーン期間: {inputs["campaign_period"]}
+- 最適化の重点: {inputs["optimization_focus"]}
+
+【実施予定のマーケティング施策】
+{tactics_list}
+
+【参考データ - VTuber/インフルエンサー施策】
+{format_reference_for_prompt(inputs["vtuber_reference"], compact)}
+
+【参考データ - その他施策】
+{format_reference_for_prompt(inputs["other_reference"], compact)}
+{retrieved_block}
+【制約条件】
+{inputs["constraints"] if inputs["constraints"] else "特になし"}
+
+【その他の考慮事項】
+{inputs["additional_context"] if inputs["additional_context"] else "特になし"}
+
+**【重要な指示】**
+1. **参考データを厳密に遵守**: 上記の参考データに記載されたCPV、CPM、CPC、コスト範囲を絶対に超えないでください
+2. **現実的な数値**: フォロワー規模に応じた適切なコストとリーチを算出してください
+3. **実績ベースの予測**: 過去の成長率パターン（Day1→Day7で1.8-5倍）を基に計算してください
+4. **保守的な見積もり**: 不確実性を考慮し、やや保守的な数値を採用してください
+5. **CPV計算**: コスト ÷ 予想視聴数 = CPVが参考データの範囲内であることを確認してください
+
+日本のゲーム市場の特性（VTuber影響力、Steamユーザー層、口コミ重視など）を考慮してください。
+{scope_instruction}
+以下の形式で回答してください:
+
+{output_format}
+"""
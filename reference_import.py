@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import re
+
+from openpyxl import load_workbook
+
+# ============================================
+# Excelブックからの参考データ取り込み
+# ============================================
+
+# 親項目としてまとめる列（「東京ゲームショウ」の下に「小ブース」「中ブース」を並べる）
+GROUP_COLUMN_NAMES = {"区分", "カテゴリ", "親項目", "イベント"}
+
+# 「CPM下限(円)」「CPM上限(円)」のような範囲の列
+_RANGE_COLUMN_PATTERN = re.compile(r'^(?P<base>.+?)\s*[_ ]?(?P<side>下限|上限|min|max|最小|最大)$', re.IGNORECASE)
+_LOW_SIDES = {"下限", "min", "最小"}
+
+# 見出しの単位「CPM(円)」「費用（万円）」
+_HEADER_UNIT_PATTERN = re.compile(r'^(?P<name>.*?)\s*[（(](?P<unit>[^）)]+)[)）]\s*$')
+
+# 1シートあたりの取り込み行数の上限（プロンプトが膨らみすぎないように）
+MAX_ROWS_PER_SHEET = 2000
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file):
+    """ファイル内容のSHA-256（パス・アップロードファイル・バイト列に対応）"""
+    digest = hashlib.sha256()
+    if isinstance(file, (bytes, bytearray)):
+        digest.update(file)
+    elif isinstance(file, str):
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    else:
+        position = file.tell()
+        file.seek(0)
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        file.seek(position)
+    return digest.hexdigest()
+
+
+def _format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "あり" if value else "なし"
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, float):
+        return format(value, ",.6g")
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime("%Y-%m-%d")
+    return str(value).strip()
+
+
+def _split_header(header):
+    """「CPM(円)」→ ("CPM", "円")"""
+    match = _HEADER_UNIT_PATTERN.match(header)
+    if match:
+        return match.group("name").strip(), match.group("unit").strip()
+    return header, ""
+
+
+def _plan_columns(headers):
+    """見出し行から、項目列・親項目列と出力する指標（範囲の列は1つにまとめる）を決める
+
+    戻り値は (項目列, 親項目列, [(指標名, 単位, 下限列, 上限列)])
+    """
+    headers = [_format_value(h) for h in headers]
+    group_index = next((i for i, h in enumerate(headers) if h in GROUP_COLUMN_NAMES), None)
+    label_index = next((i for i, h in enumerate(headers) if h and i != group_index), None)
+
+    fields = []
+    range_positions = {}
+    for index, header in enumerate(headers):
+        if not header or index in (label_index, group_index):
+            continue
+        name, unit = _split_header(header)
+        match = _RANGE_COLUMN_PATTERN.match(name)
+        if match:
+            base = match.group("base").strip()
+            side = "low" if match.group("side").lower() in _LOW_SIDES else "high"
+            if base not in range_positions:
+                range_positions[base] = len(fields)
+                fields.append([base, unit, None, None])
+            field = fields[range_positions[base]]
+            field[2 if side == "low" else 3] = index
+            field[1] = field[1] or unit
+        else:
+            fields.append([name, unit, index, None])
+
+    return label_index, group_index, [tuple(field) for field in fields]
+
+
+def _format_fields(row, fields):
+    parts = []
+    for name, unit, low_index, high_index in fields:
+        low = _format_value(row[low_index]) if low_index is not None and low_index < len(row) else ""
+        high = _format_value(row[high_index]) if high_index is not None and high_index < len(row) else ""
+        if low and high and low != high:
+            value = f"{low}-{high}"
+        else:
+            value = low or high
+        if not value:
+            continue
+        parts.append(f"{name} {value}{unit}")
+    return parts
+
+
+def sheet_to_reference(title, rows, max_rows=MAX_ROWS_PER_SHEET):
+    """シートの行（先頭の空でない行を見出しとする）を参考データの箇条書きに変換
+
+    rowsはイテレータのまま1行ずつ処理する。
+    """
+    headers = None
+    for row in rows:
+        if any(cell is not None and str(cell).strip() for cell in row):
+            headers = row
+            break
+    if headers is None:
+        return ""
+
+    label_index, group_index, fields = _plan_columns(headers)
+    if label_index is None:
+        return ""
+
+    lines = [f"【{title}】"]
+    current_group = None
+    row_count = 0
+    for row in rows:
+        label = _format_value(row[label_index]) if label_index < len(row) else ""
+        if not label:
+            continue
+        row_count += 1
+        if row_count > max_rows:
+            lines.append(f"（{max_rows:,}行を超える分は省略）")
+            break
+
+        parts = _format_fields(row, fields)
+        body = "、".join(parts)
+
+        group = _format_value(row[group_index]) if group_index is not None and group_index < len(row) else ""
+        if group:
+            if group != current_group:
+                lines.append(f"- {group}:")
+                current_group = group
+            lines.append(f"  * {label}: {body}" if body else f"  * {label}")
+        else:
+            current_group = None
+            lines.append(f"- {label}: {body}" if body else f"- {label}")
+
+    return "\n".join(lines) if len(lines) > 1 else ""
+
+
+def read_reference_workbook(file, sheet_names=None, max_rows=MAX_ROWS_PER_SHEET):
+    """Excelブックを読み取り専用モードで1行ずつ読み、シート名→参考データの辞書を返す"""
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        sections = {}
+        for worksheet in workbook.worksheets:
+            if sheet_names is not None and worksheet.title not in sheet_names:
+                continue
+            text = sheet_to_reference(worksheet.title, worksheet.iter_rows(values_only=True), max_rows)
+            if text:
+                sections[worksheet.title] = text
+        return sections
+    finally:
+        # 読み取り専用モードはファイルを開いたままにするため明示的に閉じる
+        workbook.close()
+
+
+def combine_reference_sections(sections, sheet_names=None):
+    """選択したシートの参考データを1つのテキストにまとめる"""
+    names = sheet_names if sheet_names is not None else list(sections)
+    return "\n\n".join(sections[name] for name in names if name in sections)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from campaign_store import (
+    STORE_FILE,
+    TIER_LABELS,
+    TIER_EDGES,
+    load_campaigns,
+    get_store_signature,
+    summarize_ranges,
+    format_summary_fields,
+)
+
+# ============================================
+# 過去実績の類似検索（関連する参考行だけをプロンプトに入れる）
+# ============================================
+
+# プロンプトに入れる行数の既定値（ライブラリが増えてもプロンプトの大きさは一定）
+DEFAULT_TOP_K = 12
+
+INDEX_KEYS = ["genre", "market", "platform", "tier"]
+
+# 類似度の重み（合計1.0）と、実績件数の多い行を優先する補正
+WEIGHTS = {"genre": 0.4, "market": 0.2, "platform": 0.2, "tier": 0.2}
+SUPPORT_WEIGHT = 0.05
+
+# 施策テキストに含まれるプラットフォーム名の表記ゆれ
+PLATFORM_KEYWORDS = {
+    "YouTube": ["youtube", "ユーチューブ"],
+    "Twitch": ["twitch"],
+    "TikTok": ["tiktok"],
+    "ニコニコ": ["ニコニコ", "niconico"],
+    "Twitter/X": ["twitter", "x広告", "ツイッター"],
+}
+
+# 「大手」「中堅」など規模を表す言葉 → フォロワー規模の区分
+TIER_KEYWORDS = {
+    "大手": ["50-100万人", "100万人以上"],
+    "中堅": ["10-30万人", "30-50万人"],
+    "小規模": ["5万人未満", "5-10万人"],
+    "個人": ["5万人未満", "5-10万人"],
+}
+
+INDEX_FIELDS = [
+    ("コスト", "cost_yen", "万円", 1e4),
+    ("CPV", "cpv", "円", 1),
+    ("7日視聴", "views_7d", "", 1),
+    ("CTR", "ctr", "%", 1),
+    ("ENG率", "engagement_rate", "%", 1),
+]
+
+_FOLLOWER_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*万人')
+_TOKEN_SPLIT_PATTERN = re.compile(r'[/／・,、\s+＋]+')
+
+
+def _tokens(text):
+    return {token.lower() for token in _TOKEN_SPLIT_PATTERN.split(str(text)) if token}
+
+
+def build_reference_index(df):
+    """実績をジャンル・市場・プラットフォーム・フォロワー規模ごとの参考行にまとめる"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=INDEX_KEYS + ["count", "text"])
+
+    summary = summarize_ranges(df, INDEX_KEYS)
+    rows = []
+    for key, row in summary.iterrows():
+        values = dict(zip(INDEX_KEYS, key))
+        count = int(row["count"].iloc[0])
+        parts = format_summary_fields(row, INDEX_FIELDS) + [f"件数 {count}件"]
+        label = "/".join(str(values[name]) for name in INDEX_KEYS)
+        rows.append({**values, "count": count, "text": f"- {label}: {'、'.join(parts)}"})
+
+    index = pd.DataFrame(rows)
+    index["tier"] = index["tier"].astype("string")
+    return index
+
+
+class ReferenceIndex:
+    """実績ストアから作った索引をストアの更新時だけ作り直す（プロセス内で共有）"""
+
+    def __init__(self, store_file=STORE_FILE):
+        self.store_file = store_file
+        self._signature = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        signature = get_store_signature(self.store_file)
+        with self._lock:
+            if self._index is None or signature != self._signature:
+                self._index = build_reference_index(load_campaigns(store_file=self.store_file))
+                self._signature = signature
+            return self._index
+
+
+_default_index = ReferenceIndex()
+
+
+def extract_query(inputs):
+    """入力値から検索条件（ジャンル・市場・プラットフォーム・フォロワー規模）を取り出す"""
+    tactics_text = " ".join(inputs.get("selected_tactics", []))
+    lowered = tactics_text.lower()
+
+    platforms = {
+        platform for platform, keywords in PLATFORM_KEYWORDS.items()
+        if any(keyword in lowered for keyword in keywords)
+    }
+
+    tiers = set()
+    for keyword, keyword_tiers in TIER_KEYWORDS.items():
+        if keyword in tactics_text:
+            tiers.update(keyword_tiers)
+    for followers in _FOLLOWER_PATTERN.findall(tactics_text):
+        position = int(np.searchsorted(TIER_EDGES, float(followers) * 10_000, side="right")) - 1
+        tiers.add(TIER_LABELS[min(max(position, 0), len(TIER_LABELS) - 1)])
+
+    return {
+        "genre": inputs.get("project_genre", ""),
+        "market": inputs.get("target_market", ""),
+        "platforms": platforms,
+        "tiers": tiers,
+    }
+
+
+def _jaccard(query_tokens, text):
+    tokens = _tokens(text)
+    if not query_tokens or not tokens:
+        return 0.0
+    return len(query_tokens & tokens) / len(query_tokens | tokens)
+
+
+def score_index(index, query):
+    """索引の各行と検索条件の類似度（0〜1程度）"""
+    if index.empty:
+        return np.array([])
+
+    # 文字列の比較は値の種類ごとに1回だけ行い、行にはmapで展開する
+    genre_tokens = _tokens(query["genre"])
+    genre_scores = index["genre"].map({genre: _jaccard(genre_tokens, genre) for genre in index["genre"].unique()})
+
+    # 市場は完全一致を1.0、「日本」と「日本+アジア」のような部分一致を0.5とする
+    market_tokens = _tokens(query["market"])
+    market_scores = index["market"].map({
+        market: 1.0 if market == query["market"] else (0.5 if market_tokens & _tokens(market) else 0.0)
+        for market in index["market"].unique()
+    })
+
+    if query["platforms"]:
+        platform_scores = index["platform"].isin(query["platforms"]).astype(float)
+    else:
+        platform_scores = pd.Series(0.5, index=index.index)
+
+    if query["tiers"]:
+        tier_positions = index["tier"].map({label: position for position, label in enumerate(TIER_LABELS)})
+        wanted = np.array(sorted(TIER_LABELS.index(tier) for tier in query["tiers"]))
+        distance = np.abs(tier_positions.to_numpy(dtype=float)[:, None] - wanted[None, :]).min(axis=1)
+        tier_scores = pd.Series(np.clip(1.0 - distance * 0.5, 0.0, 1.0), index=index.index)
+    else:
+        tier_scores = pd.Series(0.5, index=index.index)
+
+    support = np.log1p(index["count"].to_numpy()) / np.log1p(index["count"].max())
+
+    return (
+        WEIGHTS["genre"] * genre_scores.to_numpy()
+        + WEIGHTS["market"] * market_scores.to_numpy()
+        + WEIGHTS["platform"] * platform_scores.to_numpy()
+        + WEIGHTS["tier"] * tier_scores.to_numpy()
+        + SUPPORT_WEIGHT * support
+    )
+
+
+def search_reference_rows(index, query, top_k=DEFAULT_TOP_K):
+    """類似度の高い順に上位top_k行を返す"""
+    if index.empty or top_k <= 0:
+        return index.iloc[0:0]
+
+    scores = score_index(index, query)
+    if len(scores) > top_k:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return index.iloc[order].assign(score=scores[order])
+
+
+def select_reference_text(inputs, top_k=DEFAULT_TOP_K, index=None):
+    """現在の入力に関連する過去実績の上位top_k行を参考データ形式で返す（実績がなければ空文字）"""
+    index = _default_index.get() if index is None else index
+    rows = search_reference_rows(index, extract_query(inputs), top_k)
+    if rows.empty:
+        return ""
+
+    header = f"【関連する過去実績（類似度上位{len(rows)}件／全{len(index):,}件、ジャンル/市場/プラットフォーム/規模）】"
+    return "\n".join([header] + rows["text"].tolist())
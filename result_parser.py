@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import re
+
+import pandas as pd
+
+from tracing import traced
+
+# ============================================
+# 分析結果の1パス解析
+# ============================================
+
+# 表の区切り線（|---|:---:|）
+_SEPARATOR_PATTERN = re.compile(r'^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$')
+
+# エスケープされていない縦線
+_CELL_SPLIT_PATTERN = re.compile(r'(?<!\\)\|')
+
+# 主要メトリクス（行単位で判定）
+_METRIC_PATTERNS = [
+    ("総計", "総予算", re.compile(r'総計.*?(\d+,?\d*)\s*万円'), "万円"),
+    ("期待販売本数", "期待販売本数", re.compile(r'期待販売本数.*?(\d+,?\d*)\s*本'), "本"),
+    ("想定ROI", "想定ROI", re.compile(r'想定ROI.*?(\d+)'), "%"),
+]
+
+# 見出しなしで始まる部分結果の受け皿
+PREAMBLE_TITLE = "分析結果"
+
+
+def split_table_row(line):
+    """表の1行をセルに分割（空セルも保持）"""
+    row = line.strip()
+    if row.startswith('|'):
+        row = row[1:]
+    if row.endswith('|') and not row.endswith('\\|'):
+        row = row[:-1]
+    return [cell.strip().replace('\\|', '|') for cell in _CELL_SPLIT_PATTERN.split(row)]
+
+
+def _match_metrics(line, metrics):
+    """1行からメトリクスを抽出して辞書に追加（最初の一致を優先）"""
+    for keyword, name, pattern, suffix in _METRIC_PATTERNS:
+        if name in metrics or keyword not in line:
+            continue
+        match = pattern.search(line)
+        if match:
+            metrics[name] = match.group(1) + suffix
+
+
+def _new_section(title, preamble=False):
+    return {"title": title, "preamble": preamble, "blocks": [], "lines": []}
+
+
+@traced("parse_result")
+def parse_result_tree(result_text):
+    """分析結果を1回の走査でセクション・段落・表・メトリクスの木に変換
+
+    戻り値: [{"title", "preamble", "blocks", "text"}]
+    blocks: {"type": "heading"|"paragraph"|"table"|"metrics", ...}
+    """
+    sections = []
+    section = _new_section(PREAMBLE_TITLE, preamble=True)
+    paragraph = []
+    table = None
+    metrics = {}
+
+    def close_paragraph():
+        if paragraph:
+            section["blocks"].append({"type": "paragraph", "text": '\n'.join(paragraph)})
+            paragraph.clear()
+
+    def close_table():
+        nonlocal table
+        if table is not None:
+            section["blocks"].append(table)
+            table = None
+
+    def close_metrics():
+        nonlocal metrics
+        if metrics:
+            section["blocks"].append({"type": "metrics", "values": metrics})
+            metrics = {}
+
+    def close_section():
+        close_paragraph()
+        close_table()
+        close_metrics()
+        section["text"] = '\n'.join(section.pop("lines"))
+        if not section["preamble"] or section["blocks"]:
+            sections.append(section)
+
+    for line in result_text.splitlines():
+        # セクション見出し
+        if line.startswith('## '):
+            close_section()
+            section = _new_section(line[3:].strip())
+            continue
+
+        section["lines"].append(line)
+        stripped = line.strip()
+
+        # 表の行
+        if stripped.startswith('|'):
+            close_paragraph()
+            if table is None:
+                table = {"type": "table", "headers": split_table_row(stripped), "rows": []}
+            elif not table["rows"] and _SEPARATOR_PATTERN.match(stripped):
+                continue
+            else:
+                table["rows"].append(split_table_row(stripped))
+            continue
+
+        close_table()
+
+        # サブセクション見出し（パターンごとにメトリクスを区切る）
+        if line.startswith('### '):
+            close_paragraph()
+            close_metrics()
+            section["blocks"].append({"type": "heading", "level": 3, "text": line[4:].strip()})
+            continue
+
+        if not stripped:
+            close_paragraph()
+            continue
+
+        paragraph.append(line)
+        _match_metrics(line, metrics)
+
+    close_section()
+    return sections
+
+
+def table_to_dataframe(table):
+    """表ブロックをDataFrameに変換（列数の過不足は空セル補完・末尾列へ結合）"""
+    headers = table["headers"]
+    width = len(headers)
+    if not table["rows"] or not width:
+        return None
+
+    rows = []
+    for cells in table["rows"]:
+        if len(cells) < width:
+            cells = cells + [""] * (width - len(cells))
+        elif len(cells) > width:
+            cells = cells[:width - 1] + [" | ".join(cells[width - 1:])]
+        rows.append(cells)
+
+    # 重複・空の列名はpandasで扱えるよう番号を付ける
+    columns = []
+    for idx, header in enumerate(headers):
+        name = header or f"列{idx + 1}"
+        columns.append(name if name not in columns else f"{name}_{idx + 1}")
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+# ============================================
+# 従来インターフェース（木構造の上で実装）
+# ============================================
+
+def parse_markdown_table(markdown_text):
+    """マークダウン表をDataFrameに変換"""
+    for section in parse_result_tree(markdown_text):
+        for block in section["blocks"]:
+            if block["type"] == "table":
+                return table_to_dataframe(block)
+    return None
+
+
+def extract_metrics_from_text(text):
+    """テキストから主要メトリクスを抽出"""
+    metrics = {}
+    for line in text.splitlines():
+        _match_metrics(line, metrics)
+    return metrics
+
+
+@traced()
+def parse_analysis_result(result_text):
+    """分析結果をセクションごとに分割"""
+    return {
+        section["title"]: section["text"]
+        for section in parse_result_tree(result_text)
+        if not section["preamble"]
+    }
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+import math
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from campaign_store import normalize_campaigns
+from growth_projection import parse_line_items, SCENARIOS
+
+# ============================================
+# 配信者の組み合わせ最適化（VTuber予算内で期待視聴数を最大化するナップサック）
+# ============================================
+
+# 最適化の目的
+OBJECTIVES = {
+    "views": "7日視聴数",
+    "conversions": "コンバージョン（7日視聴×CTR）",
+}
+
+# CTRが分からない候補に使う値（%、参考データの平均CTR 0.13-0.45%の中央）
+DEFAULT_CTR = 0.29
+
+# 規模ごとの最大人数（参考データの規模別の行から選ぶ場合）
+DEFAULT_MAX_PER_TIER = 10
+
+# 予算の刻み（円）。予算が大きい場合は刻み数がMAX_BUDGET_STEPSに収まるよう広げる
+BUDGET_UNIT_YEN = 10_000
+MAX_BUDGET_STEPS = 5000
+
+CANDIDATE_COLUMNS = ["label", "group", "cost_yen", "views", "ctr", "max_count"]
+
+
+def tier_candidates(reference_text, scenario="中央", max_per_tier=DEFAULT_MAX_PER_TIER):
+    """参考データの規模別の行（コストと7日視聴があるもの）を候補にする
+
+    保守はコストの上限と視聴数の下限、楽観はその逆、中央はそれぞれの中央値を使う。
+    """
+    items = parse_line_items(reference_text)
+    if items.empty:
+        return pd.DataFrame(columns=CANDIDATE_COLUMNS)
+
+    position = SCENARIOS.index(scenario)
+    weight = position / (len(SCENARIOS) - 1)
+    return pd.DataFrame({
+        "label": items["label"],
+        "group": items["label"],
+        "cost_yen": items["cost_max"] + (items["cost_min"] - items["cost_max"]) * weight,
+        "views": items["views_min"] + (items["views_max"] - items["views_min"]) * weight,
+        "ctr": DEFAULT_CTR,
+        "max_count": max_per_tier,
+    })
+
+
+def roster_candidates(raw_df):
+    """配信者リスト（実績ファイルと同じ列名）を候補にする。1人1回まで
+
+    7日視聴がない配信者は同じフォロワー規模の中央値で補う。コストがない配信者は除く。
+    """
+    df = normalize_campaigns(raw_df)
+    tier_views = df.groupby("tier", observed=True)["views_7d"].transform("median")
+    views = df["views_7d"].fillna(tier_views)
+
+    creators = df["creator"].fillna("配信者" + pd.Series(range(1, len(df) + 1), index=df.index).astype(str))
+    candidates = pd.DataFrame({
+        "label": creators + "（" + df["platform"] + "）",
+        "group": df["tier"].astype("string"),
+        "cost_yen": df["cost_yen"],
+        "views": views,
+        "ctr": df["ctr"].fillna(DEFAULT_CTR),
+        "max_count": 1,
+    })
+    return candidates.dropna(subset=["cost_yen", "views"]).query("cost_yen > 0").reset_index(drop=True)
+
+
+def budget_unit(budget_yen):
+    """予算の刻み（円）"""
+    return max(BUDGET_UNIT_YEN, math.ceil(budget_yen / MAX_BUDGET_STEPS / BUDGET_UNIT_YEN) * BUDGET_UNIT_YEN)
+
+
+def roster_budget_unit(budget_yen):
+    """配信者の組み合わせ用の予算の刻み（円）
+
+    1人ごとの費用の切り上げ・切り捨ての誤差が大きくならないよう、刻み数がMAX_BUDGET_STEPSに収まる範囲で
+    BUDGET_UNIT_YENより細かくする（予算が大きい場合は budget_unit と同じ）。
+    """
+    if budget_yen > BUDGET_UNIT_YEN * MAX_BUDGET_STEPS:
+        return budget_unit(budget_yen)
+    return max(1, math.ceil(budget_yen / MAX_BUDGET_STEPS))
+
+
+def _expand_counts(candidates):
+    """人数の上限がある候補を 1,2,4,... 人分のまとまりに分けて0/1ナップサックに変換
+
+    戻り値は (候補の番号, 人数) の配列。
+    """
+    rows, counts = [], []
+    for index, max_count in enumerate(candidates["max_count"].astype(int)):
+        remaining, size = max_count, 1
+        while remaining > 0:
+            take = min(size, remaining)
+            rows.append(index)
+            counts.append(take)
+            remaining -= take
+            size *= 2
+    return np.array(rows, dtype=int), np.array(counts, dtype=int)
+
+
+def _group_knapsack(costs, values, steps):
+    """ちょうど各予算を使い切る場合の最大値（到達できない予算は-inf）と、復元用の選択表"""
+    best = np.full(steps + 1, -np.inf)
+    best[0] = 0.0
+    taken = np.zeros((len(costs), steps + 1), dtype=bool)
+    for item, (cost, value) in enumerate(zip(costs, values)):
+        if cost > steps:
+            continue
+        candidate = best[:steps + 1 - cost] + value
+        improved = candidate > best[cost:]
+        taken[item, cost:] = improved
+        best[cost:] = np.where(improved, candidate, best[cost:])
+    return best, taken
+
+
+def _minimum_knapsack(costs, floor_costs, values, steps, minimum):
+    """切り捨てたコストの合計がminimum以上になる組み合わせに限った _group_knapsack
+
+    最低割合の判定は、切り上げたコストの合計（刻み数）から切り上げ分の合計を引いた、切り捨てたコストの合計で行う
+    （実際の費用は必ずそれ以上なので、下限を下回る組み合わせを選ばない）。
+    切り上げ分の合計が刻み数のわりに大きくなりうる予算（帯）だけ、切り上げ分を2つ目の次元にとって解き直す。
+    帯より上の予算ではどの組み合わせも下限を満たすので、制約なしの最大値がそのまま使える。
+
+    戻り値は (最大値, 復元用の関数 backtrack(予算) → 選んだ候補の番号)。
+    """
+    best, taken = _group_knapsack(costs, values, steps)
+    roundings = costs - floor_costs
+
+    # 切り上げ分は1刻みあたり最大 1/ratio なので、予算 s の組み合わせの切り捨て合計は s - s // ratio 以上
+    rounded = roundings > 0
+    ratio = (costs[rounded] / roundings[rounded]).min() if rounded.any() else np.inf
+    budgets = np.arange(steps + 1)
+    guaranteed = budgets - np.floor(budgets / ratio) >= minimum
+    band = int(np.argmax(guaranteed)) if guaranteed.any() else steps + 1
+
+    # 帯の中で下限を満たしうる切り上げ分の合計は band - 1 - minimum まで（切り上げ分は減らないので、それを超えた状態は捨てる）
+    max_rounding = min(int((band - 1) / ratio) if np.isfinite(ratio) else 0, band - 1 - minimum)
+    band_best = np.full((band, max(max_rounding, 0) + 1), -np.inf)
+    band_best[0, 0] = 0.0
+    # 選択表は候補数×帯の刻み数×切り上げ分と大きくなるので、切り上げ分の次元をビットに詰める
+    band_taken = np.zeros((len(costs), band, (band_best.shape[1] + 7) // 8), dtype=np.uint8)
+    if max_rounding >= 0:
+        improved = np.zeros(band_best.shape, dtype=bool)
+        for item, (cost, rounding, value) in enumerate(zip(costs, roundings, values)):
+            if cost >= band or rounding > max_rounding:
+                continue
+            candidate = band_best[:band - cost, :max_rounding + 1 - rounding] + value
+            current = band_best[cost:, rounding:]
+            improved[:] = False
+            np.greater(candidate, current, out=improved[cost:, rounding:])
+            band_taken[item] = np.packbits(improved, axis=1)
+            np.maximum(candidate, current, out=current)
+
+    # 帯の中の予算 s では、切り上げ分の合計が s - minimum 以下の組み合わせだけが下限を満たす
+    feasible = np.arange(band_best.shape[1])[None, :] <= (np.arange(band) - minimum)[:, None]
+    band_feasible = np.where(feasible, band_best, -np.inf)
+    band_roundings = np.argmax(band_feasible, axis=1)
+    best = best.copy()
+    best[:band] = band_feasible.max(axis=1)
+
+    def backtrack(spend):
+        if spend >= band:
+            return _backtrack(costs, taken, spend)
+        rounding = int(band_roundings[spend])
+        chosen = []
+        for item in range(len(costs) - 1, -1, -1):
+            if band_taken[item, spend, rounding // 8] >> (7 - rounding % 8) & 1:
+                chosen.append(item)
+                spend -= costs[item]
+                rounding -= roundings[item]
+        return chosen
+
+    return best, backtrack
+
+
+def _backtrack(costs, taken, spend):
+    chosen = []
+    for item in range(len(costs) - 1, -1, -1):
+        if taken[item, spend]:
+            chosen.append(item)
+            spend -= costs[item]
+    return chosen
+
+
+def combine_budget_curves(left, right):
+    """2つの予算別の最大値を合成（max-plus畳み込み）。右側に割り当てた予算も返す"""
+    combined = np.full_like(left, -np.inf)
+    split = np.zeros(len(left), dtype=int)
+    for spend in np.flatnonzero(np.isfinite(right)):
+        candidate = np.full_like(left, -np.inf)
+        candidate[spend:] = left[:len(left) - spend] + right[spend]
+        improved = candidate > combined
+        combined[improved] = candidate[improved]
+        split[improved] = spend
+    return combined, split
+
+
+def _item_values(candidates, objective):
+    values = candidates["views"].to_numpy(dtype=float)
+    if objective == "conversions":
+        values = values * candidates["ctr"].to_numpy(dtype=float) / 100
+    return values
+
+
+def value_curve(candidates, unit, steps, objective="views"):
+    """予算（刻み数0〜steps）ごとに達成できる目的の最大値（その予算以内、単調増加）"""
+    rows, counts = _expand_counts(candidates.reset_index(drop=True))
+    unit_costs = np.ceil(candidates["cost_yen"].to_numpy(dtype=float) / unit).astype(int)
+    best, _ = _group_knapsack(unit_costs[rows] * counts, _item_values(candidates, objective)[rows] * counts, steps)
+    return np.maximum.accumulate(np.where(np.isfinite(best), best, 0.0))
+
+
+def solve_roster(candidates, budget_yen, objective="views", min_shares=None):
+    """予算内で目的（7日視聴数またはコンバージョン）を最大化する人数の組み合わせ
+
+    min_shares: {グループ: 予算に占める最低割合(0-1)}。グループは規模別の行ならその行、
+    配信者リストならフォロワー規模。
+    コストは予算の刻みに切り上げるため、合計が予算を超えることはない。
+    最低割合は刻みに切り捨てたコストで判定するため、実際の費用が下限を下回ることはない。
+    戻り値は (選択結果のDataFrame, 合計の辞書)。条件を満たせなければValueError。
+    """
+    min_shares = {group: share for group, share in (min_shares or {}).items() if share > 0}
+    candidates = candidates.reset_index(drop=True)
+    if candidates.empty:
+        raise ValueError("候補がありません")
+
+    unit = roster_budget_unit(budget_yen)
+    steps = int(budget_yen // unit)
+
+    rows, counts = _expand_counts(candidates)
+    cost_yen = candidates["cost_yen"].to_numpy(dtype=float)
+    unit_costs = np.ceil(cost_yen / unit).astype(int)
+    unit_values = _item_values(candidates, objective)
+    item_costs = unit_costs[rows] * counts
+    item_floor_costs = np.floor(cost_yen / unit).astype(int)[rows] * counts
+    item_values = unit_values[rows] * counts
+    item_groups = candidates["group"].to_numpy()[rows]
+
+    # 最低割合のあるグループは別々に解き、使った予算が下限以上の場合だけを残して合成する
+    constrained = [group for group in min_shares if group in set(item_groups)]
+    missing = [group for group in min_shares if group not in constrained]
+    if missing:
+        raise ValueError(f"最低配分を指定したグループに候補がありません: {', '.join(map(str, missing))}")
+
+    parts = []
+    free = ~np.isin(item_groups, constrained)
+    parts.append((None, np.flatnonzero(free)))
+    for group in constrained:
+        parts.append((group, np.flatnonzero(item_groups == group)))
+
+    combined = None
+    splits = []
+    tables = []
+    for group, items in parts:
+        if group is None:
+            best, taken = _group_knapsack(item_costs[items], item_values[items], steps)
+            backtrack = partial(_backtrack, item_costs[items], taken)
+        else:
+            minimum = math.ceil(min_shares[group] * budget_yen / unit)
+            best, backtrack = _minimum_knapsack(item_costs[items], item_floor_costs[items], item_values[items], steps, minimum)
+        tables.append((items, backtrack))
+        if combined is None:
+            combined = best
+        else:
+            combined, split = combine_budget_curves(combined, best)
+            splits.append(split)
+
+    if not np.isfinite(combined).any():
+        raise ValueError("最低配分の条件を満たす組み合わせがありません（予算が不足しています）")
+
+    spend = int(np.argmax(combined))
+    value = float(combined[spend])
+
+    # 後ろのグループから予算の割り当てを戻して、グループごとに選んだ候補を復元
+    group_spends = [0] * len(tables)
+    for position in range(len(tables) - 1, 0, -1):
+        group_spends[position] = int(splits[position - 1][spend])
+        spend -= group_spends[position]
+    group_spends[0] = spend
+
+    selected_counts = np.zeros(len(candidates), dtype=int)
+    for (items, backtrack), group_spend in zip(tables, group_spends):
+        for chosen in backtrack(group_spend):
+            selected_counts[rows[items[chosen]]] += counts[items[chosen]]
+
+    picked = candidates.assign(count=selected_counts)[selected_counts > 0]
+    selection = pd.DataFrame({
+        "候補": picked["label"],
+        "グループ": picked["group"],
+        "人数": picked["count"],
+        "単価(万円)": (picked["cost_yen"] / 1e4).round(1),
+        "費用(万円)": (picked["cost_yen"] * picked["count"] / 1e4).round(1),
+        "7日視聴": (picked["views"] * picked["count"]).round(0),
+        "コンバージョン": (picked["views"] * picked["count"] * picked["ctr"] / 100).round(1),
+    }).reset_index(drop=True)
+
+    spent_yen = float((picked["cost_yen"] * picked["count"]).sum())
+    summary = {
+        "objective": objective,
+        "value": value,
+        "budget_yen": budget_yen,
+        "spent_yen": spent_yen,
+        "views": float(selection["7日視聴"].sum()),
+        "conversions": float(selection["コンバージョン"].sum()),
+        "creators": int(selection["人数"].sum()),
+    }
+    return selection, summary
+
+
+def format_roster_constraint(selection):
+    """選んだ組み合わせを制約条件欄に追記する文（「10万人級×5名」の形式）"""
+    parts = [f"{row['候補']}×{row['人数']}名" if row["人数"] > 1 else row["候補"] for _, row in selection.iterrows()]
+    total = selection["費用(万円)"].sum()
+    return f"VTuber施策の配信者構成: {'、'.join(parts)}（合計{total:,.0f}万円）"
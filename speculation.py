@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+
+from telemetry import CallCancelled
+from cold_storage import with_archived_rows
+from log_files import file_signature, append_csv_rows
+
+# ============================================
+# 分析の先読み実行（入力が止まったらバックグラウンドで開始）
+# ============================================
+
+SPECULATION_LOG_FILE = os.path.join("logs", "speculation_log.csv")
+
+SPECULATION_FIELDS = ["timestamp", "username", "key", "outcome", "wasted_tokens", "saved_ms"]
+
+# 結果の種類
+#   hit       : 実行ボタン押下時に先読みが完了していた
+#   hit_wait  : 実行中の先読みを待って使った
+#   miss      : 先読みモードで実行したが、同じ入力の先読みが始まっていなかった
+#   cancelled : 実行中に入力が変わって打ち切った（消費済みのトークンは無駄になる）
+#   unused    : 完了したが入力が変わって使われなかった
+#   error     : 先読みのAPI呼び出しが失敗した
+HIT_OUTCOMES = {"hit", "hit_wait"}
+CLICK_OUTCOMES = HIT_OUTCOMES | {"miss"}
+
+# 入力が変わらなくなってから先読みを始めるまでの秒数（画面で変更可）
+DEFAULT_DELAY_SECONDS = float(os.environ.get("LLM_SPECULATION_DELAY_SECONDS", "8"))
+
+# 実行中の先読みを待つ上限
+TAKE_TIMEOUT_SECONDS = 180
+
+# 保持するセッション数の上限（放置されたセッションの先読みで増え続けないように）
+MAX_TRACKED_SESSIONS = 200
+
+
+def speculation_key(model, max_tokens, prompt):
+    """API呼び出しの内容（モデル・最大トークン・プロンプト）のハッシュ"""
+    payload = json.dumps([model, max_tokens, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def record_speculation(username, key, outcome, wasted_tokens=0, saved_ms=0):
+    """先読みの結果を1件追記"""
+    try:
+        append_csv_rows(SPECULATION_LOG_FILE, SPECULATION_FIELDS, [{
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "username": username,
+            "key": key[:12],
+            "outcome": outcome,
+            "wasted_tokens": wasted_tokens,
+            "saved_ms": round(saved_ms, 1),
+        }])
+
+    except Exception as e:
+        print(f"先読みログ記録エラー: {e}")
+
+
+def _consumed_tokens(record):
+    return int((record.get("input_tokens") or 0) + (record.get("output_tokens") or 0))
+
+
+class SpeculativeJob:
+    """1セッション分の先読み（入力のハッシュごとに1つ）"""
+
+    def __init__(self, key, username):
+        self.key = key
+        self.username = username
+        self.timer = None
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+        self.started_at = None
+        self.finished_at = None
+        self.discarded = False
+        self.result = None
+        self.error = None
+        self.record = {}
+
+
+class SpeculativeRunner:
+    """セッションごとに最新の入力の先読みを1つだけ保持する（プロセス内で共有）"""
+
+    def __init__(self, max_sessions=MAX_TRACKED_SESSIONS):
+        self.max_sessions = max_sessions
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def schedule(self, session_id, key, username, call, delay):
+        """delay秒後にcall(cancel_event, record_out)を別スレッドで実行する
+
+        同じ入力で予約済みなら何もしない（タイマーを延長しない）。入力が変わった場合は
+        前の先読みを取り消して予約し直すので、入力が止まってからdelay秒後に始まる。
+        """
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job is not None and job.key == key:
+                return
+            if job is not None:
+                self._discard(job)
+
+            job = SpeculativeJob(key, username)
+            job.timer = threading.Timer(delay, self._run, args=(job, call))
+            job.timer.daemon = True
+            self._jobs[session_id] = job
+            self._jobs.move_to_end(session_id)
+
+            while len(self._jobs) > self.max_sessions:
+                _, old_job = self._jobs.popitem(last=False)
+                self._discard(old_job)
+
+        job.timer.start()
+
+    def _run(self, job, call):
+        with self._lock:
+            if job.discarded:
+                return
+            job.started_at = time.perf_counter()
+
+        try:
+            job.result = call(job.cancel_event, job.record)
+        except CallCancelled:
+            pass
+        except Exception as e:
+            job.error = e
+
+        with self._lock:
+            job.finished_at = time.perf_counter()
+            job.done.set()
+            if job.discarded:
+                outcome = "unused" if job.result is not None else "cancelled"
+                record_speculation(job.username, job.key, outcome, _consumed_tokens(job.record))
+            elif job.error is not None:
+                record_speculation(job.username, job.key, "error", _consumed_tokens(job.record))
+
+    def _discard(self, job):
+        """先読みを取り消す（ロック内で呼ぶ）。完了済みで未使用なら無駄になったトークンを記録"""
+        job.discarded = True
+        job.cancel_event.set()
+        job.timer.cancel()
+        if job.done.is_set() and job.result is not None:
+            record_speculation(job.username, job.key, "unused", _consumed_tokens(job.record))
+
+    def cancel(self, session_id):
+        with self._lock:
+            job = self._jobs.pop(session_id, None)
+            if job is not None:
+                self._discard(job)
+
+    def take(self, session_id, key, username, timeout=TAKE_TIMEOUT_SECONDS, record_out=None):
+        """同じ入力の先読み結果を取り出す（実行中なら完了を待つ）。使えなければNone
+
+        record_out: 使えた場合に先読みのメトリクス（トークン数など）を受け取る辞書
+        """
+        clicked_at = time.perf_counter()
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job is None or job.key != key or job.started_at is None:
+                # 予約だけで始まっていない先読みは通常の実行に任せる
+                if job is not None and job.key == key:
+                    self._jobs.pop(session_id)
+                    self._discard(job)
+                record_speculation(username, key, "miss")
+                return None
+            self._jobs.pop(session_id)
+            was_done = job.done.is_set()
+
+        if not job.done.wait(timeout):
+            with self._lock:
+                self._discard(job)
+            record_speculation(username, key, "miss")
+            return None
+
+        if job.result is None:
+            record_speculation(username, key, "miss")
+            return None
+
+        saved_ms = (min(job.finished_at, clicked_at) - job.started_at) * 1000
+        record_speculation(username, key, "hit" if was_done else "hit_wait", saved_ms=saved_ms)
+        if record_out is not None:
+            record_out.update(job.record)
+        return job.result
+
+
+_default_runner = SpeculativeRunner()
+
+
+def schedule_speculation(session_id, key, username, call, delay=DEFAULT_DELAY_SECONDS):
+    _default_runner.schedule(session_id, key, username, call, delay)
+
+
+def cancel_speculation(session_id):
+    _default_runner.cancel(session_id)
+
+
+def take_speculation(session_id, key, username, record_out=None):
+    return _default_runner.take(session_id, key, username, record_out=record_out)
+
+
+# ============================================
+# 集計（管理者パフォーマンスタブ用）
+# ============================================
+
+def get_speculation_log(include_archived=False):
+    """先読みログの取得（include_archived=Trueなら圧縮済みの過去分も含める）"""
+    df = pd.read_csv(SPECULATION_LOG_FILE) if os.path.exists(SPECULATION_LOG_FILE) else None
+    if include_archived:
+        df = with_archived_rows(os.path.basename(SPECULATION_LOG_FILE), df)
+    return df
+
+
+def get_speculation_signature():
+    """先読みログの更新検知用キー（更新時刻とサイズ）"""
+    return file_signature(SPECULATION_LOG_FILE)
+
+
+def summarize_speculation(df):
+    """ヒット率（先読みモードでの実行に占める割合）・無駄になったトークン・短縮時間"""
+    clicks = df[df["outcome"].isin(CLICK_OUTCOMES)]
+    hits = df[df["outcome"].isin(HIT_OUTCOMES)]
+    return {
+        "clicks": len(clicks),
+        "hits": len(hits),
+        "hit_rate": len(hits) / len(clicks) * 100 if len(clicks) else None,
+        "wasted_tokens": int(df["wasted_tokens"].sum()),
+        "wasted_runs": int(df["outcome"].isin(["cancelled", "unused", "error"]).sum()),
+        "saved_seconds": hits["saved_ms"].sum() / 1000,
+        "outcomes": df["outcome"].value_counts().rename_axis("結果").reset_index(name="件数"),
+    }
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import os
+import csv
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from model_routing import estimate_cost
+from cold_storage import with_archived_rows
+from tracing import span
+from log_files import file_signature, locked_file, append_csv_rows
+
+# ============================================
+# API呼び出しメトリクスの記録
+# ============================================
+
+METRICS_FILE = os.path.join("logs", "api_metrics.csv")
+
+METRICS_FIELDS = [
+    "timestamp",
+    "username",
+    "task",
+    "tier",
+    "model",
+    "status",
+    "queue_ms",
+    "ttft_ms",
+    "latency_ms",
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+    "stop_reason",
+    "error_class",
+    "cost_usd",
+    "charged",
+]
+
+# パーセンタイル集計の対象列
+TIMING_COLUMNS = ["queue_ms", "ttft_ms", "latency_ms"]
+TOKEN_COLUMNS = ["input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"]
+
+
+def _migrate_metrics_header():
+    """列を追加する前に記録されたファイルを現在の列構成に書き換える（1回だけ、locked_file のロック内で呼ぶ）"""
+    with open(METRICS_FILE, newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f), None)
+    if header == METRICS_FIELDS:
+        return
+    df = pd.read_csv(METRICS_FILE)
+    df.reindex(columns=METRICS_FIELDS).to_csv(METRICS_FILE, index=False, encoding="utf-8")
+
+
+def record_api_call(record):
+    """API呼び出し1件分のメトリクスを追記"""
+    try:
+        os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+        with locked_file(METRICS_FILE):
+            if os.path.isfile(METRICS_FILE):
+                _migrate_metrics_header()
+            append_csv_rows(METRICS_FILE, METRICS_FIELDS, [record], extrasaction="ignore")
+
+    except Exception as e:
+        # メトリクス記録に失敗しても分析結果は返す
+        print(f"メトリクス記録エラー: {e}")
+
+
+def get_api_metrics(include_archived=False):
+    """API呼び出しメトリクスの取得（include_archived=Trueなら圧縮済みの過去分も含める）"""
+    df = pd.read_csv(METRICS_FILE) if os.path.exists(METRICS_FILE) else None
+    if include_archived:
+        df = with_archived_rows(os.path.basename(METRICS_FILE), df)
+    if df is None:
+        return None
+
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+def get_metrics_signature():
+    """メトリクスファイルの更新検知用キー（更新時刻とサイズ）"""
+    return file_signature(METRICS_FILE)
+
+
+class CallCancelled(Exception):
+    """cancel_eventによりストリーミングを途中で打ち切った"""
+
+
+def _record_usage(record, usage, model, min_output_tokens=0):
+    record["input_tokens"] = usage.input_tokens
+    record["output_tokens"] = max(usage.output_tokens, min_output_tokens)
+    record["cache_creation_input_tokens"] = getattr(usage, "cache_creation_input_tokens", None) or 0
+    record["cache_read_input_tokens"] = getattr(usage, "cache_read_input_tokens", None) or 0
+    cost = estimate_cost(
+        model,
+        record["input_tokens"],
+        record["output_tokens"],
+        record["cache_creation_input_tokens"],
+        record["cache_read_input_tokens"]
+    )
+    if cost is not None:
+        record["cost_usd"] = round(cost, 6)
+
+
+def run_instrumented_call(
+    client,
+    username,
+    task,
+    model,
+    max_tokens,
+    messages,
+    requested_at=None,
+    tier=None,
+    cancel_event=None,
+    record_out=None,
+    charged=True
+):
+    """ストリーミングでAPIを呼び出し、キュー時間・TTFT・トークン数・概算料金を記録
+
+    requested_at: 実行ボタン押下時の time.perf_counter() の値（キュー時間の起点）
+    tier: モデルの階層（model_routing の "draft" / "full"）
+    cancel_event: セットされたらストリーミングを打ち切って CallCancelled を送出（threading.Event）
+    record_out: 記録したメトリクスを受け取る辞書
+    charged: 利用枠のリクエスト数に数えた呼び出しか（先読みはFalse。利用枠の復元に使う）
+    """
+    started = time.perf_counter()
+    if requested_at is None:
+        requested_at = started
+
+    record = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "username": username,
+        "task": task,
+        "tier": tier or "",
+        "model": model,
+        "status": "ok",
+        "queue_ms": round((started - requested_at) * 1000, 1),
+        "charged": 1 if charged else 0,
+    }
+    first_token_at = None
+
+    try:
+        chunks = []
+        with span("api_call", task=task, model=model), \
+                client.messages.stream(model=model, max_tokens=max_tokens, messages=messages) as stream:
+            for text in stream.text_stream:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunks.append(text)
+                if cancel_event is not None and cancel_event.is_set():
+                    # 打ち切り時点のusageは出力トークンが少なく出るため、受信したチャンク数を下限とする
+                    _record_usage(record, stream.current_message_snapshot.usage, model, min_output_tokens=len(chunks))
+                    raise CallCancelled()
+            final_message = stream.get_final_message()
+
+        _record_usage(record, final_message.usage, model)
+        record["stop_reason"] = final_message.stop_reason
+
+        return "".join(chunks)
+
+    except CallCancelled:
+        record["status"] = "cancelled"
+        raise
+
+    except Exception as e:
+        record["status"] = "error"
+        record["error_class"] = type(e).__name__
+        raise
+
+    finally:
+        finished = time.perf_counter()
+        record["latency_ms"] = round((finished - started) * 1000, 1)
+        if first_token_at is not None:
+            record["ttft_ms"] = round((first_token_at - started) * 1000, 1)
+        record_api_call(record)
+        if record_out is not None:
+            record_out.update(record)
+
+
+# ============================================
+# 集計（管理者パフォーマンスタブ用）
+# ============================================
+
+def summarize_api_metrics(df):
+    """時間・トークン指標のパーセンタイル表を作成"""
+    ok_df = df[df["status"] == "ok"]
+
+    rows = []
+    for column in TIMING_COLUMNS + TOKEN_COLUMNS:
+        values = pd.to_numeric(ok_df[column], errors="coerce").dropna()
+        if values.empty:
+            continue
+        rows.append({
+            "指標": column,
+            "件数": len(values),
+            "平均": round(values.mean(), 1),
+            "p50": round(values.quantile(0.50), 1),
+            "p90": round(values.quantile(0.90), 1),
+            "p95": round(values.quantile(0.95), 1),
+            "p99": round(values.quantile(0.99), 1),
+            "最大": round(values.max(), 1),
+        })
+
+    return pd.DataFrame(rows)
+
+
+def summarize_by_tier(df):
+    """モデル階層ごとの呼び出し数・レイテンシ・トークン数・概算料金"""
+    df = df.copy()
+    df["tier"] = df["tier"].fillna("").replace("", "未設定")
+    df["is_error"] = df["status"] == "error"
+
+    summary = df.groupby(["tier", "model"]).agg(
+        calls=("status", "size"),
+        failure_rate=("is_error", "mean"),
+        ttft_p50=("ttft_ms", "median"),
+        latency_p50=("latency_ms", "median"),
+        latency_p95=("latency_ms", lambda s: s.quantile(0.95)),
+        output_tokens=("output_tokens", "sum"),
+        cost_usd=("cost_usd", "sum"),
+    )
+    summary["failure_rate"] = (summary["failure_rate"] * 100).round(1)
+    summary["cost_per_call_usd"] = (summary["cost_usd"] / summary["calls"]).round(4)
+    summary["cost_usd"] = summary["cost_usd"].round(4)
+    return summary.reset_index()
+
+
+def daily_api_trend(df):
+    """日別の呼び出し数・失敗率・レイテンシ・トークン推移"""
+    df = df.copy()
+    df["date"] = df["timestamp"].dt.date
+    df["is_error"] = df["status"] == "error"
+
+    trend = df.groupby("date").agg(
+        calls=("status", "size"),
+        failure_rate=("is_error", "mean"),
+        latency_p50=("latency_ms", "median"),
+        latency_p95=("latency_ms", lambda s: s.quantile(0.95)),
+        ttft_p50=("ttft_ms", "median"),
+        input_tokens=("input_tokens", "sum"),
+        output_tokens=("output_tokens", "sum"),
+    )
+    trend["failure_rate"] = (trend["failure_rate"] * 100).round(1)
+    return trend
@@ -1,6 +1,10 @@
 import streamlit as st
 import anthropic
 
+from llm_transport import create_client
+from telemetry import run_instrumented_call
+from model_routing import route_model
+
 st.title("🔍 APIキー診断ツール")
 
 # secrets.tomlからAPIキーを読み込み
@@ -33,20 +37,25 @@ if "ANTHROPIC_API_KEY" in st.secrets:
         with st.spinner("テスト中..."):
             try:
                 # Anthropic APIクライアント初期化
-                client = anthropic.Anthropic(api_key=api_key)
+                client = create_client(api_key)
+                tier, model = route_model("api_key_check")
                 
                 # 簡単なテストリクエスト
-                message = client.messages.create(
-                    model="claude-sonnet-4-20250514",
+                response_text = run_instrumented_call(
+                    client,
+                    username="api_key_check",
+                    task="api_key_check",
+                    model=model,
                     max_tokens=100,
                     messages=[
                         {"role": "user", "content": "Hello, please respond with 'API test successful!'"}
-                    ]
+                    ],
+                    tier=tier
                 )
                 
                 # 成功
                 st.success("🎉 APIテスト成功！")
-                st.code(message.content[0].text)
+                st.code(response_text)
                 
             except anthropic.AuthenticationError as e:
                 st.error("❌ 認証エラー: APIキーが無効です")
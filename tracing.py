@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
+
+from log_files import file_signature, append_csv_rows
+
+# ============================================
+# フェーズ別の処理時間の計測（トレーシング）
+# ============================================
+#
+# APP_TRACING=1 のときだけ有効。各フェーズをスパン（名前・実時間・CPU時間・親子関係）として計測し、
+# 最上位のスパンが終わった時点でそのトレースの全スパンを logs/trace_spans.csv に追記する。
+# 無効時の span() は共有の空のコンテキスト、traced() は元の関数をそのまま返すので、ほぼ負荷がない。
+#
+# アプリの import の計測より前に読み込まれるので、このモジュールは標準ライブラリだけに依存する
+# （集計用の pandas 等は集計関数の中で読み込む）。
+
+TRACING_ENABLED = os.environ.get("APP_TRACING", "") == "1"
+
+TRACE_FILE = os.path.join("logs", "trace_spans.csv")
+
+TRACE_FIELDS = ["timestamp", "trace_id", "span_id", "parent_id", "name", "depth", "offset_ms", "wall_ms", "cpu_ms", "attributes"]
+
+_local = threading.local()
+
+
+class Span:
+    """1フェーズ分の計測。with文か start_span() / end() で使う
+
+    実時間はperf_counter、CPU時間はスレッドごとのthread_time（他スレッドの処理を含めない）。
+    """
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.timestamp = None
+        self.started = None
+        self.cpu_started = None
+        self.parent = None
+        self.trace = None
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def start(self):
+        stack = _stack()
+        self.parent = stack[-1] if stack else None
+        # 親がなければ新しいトレースを始める（スパンの記録はトレースの最上位が終わるまで溜める）
+        self.trace = self.parent.trace if self.parent else {"id": uuid.uuid4().hex[:16], "started": None, "spans": []}
+        self.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        if self.trace["started"] is None:
+            self.trace["started"] = self.started
+        stack.append(self)
+        return self
+
+    def end(self):
+        finished = time.perf_counter()
+        cpu_finished = time.thread_time()
+        stack = _stack()
+        if self in stack:
+            # 例外で子のスパンが閉じられなかった場合も含めて、自分より上を取り除く
+            del stack[stack.index(self):]
+
+        depth = 0
+        parent = self.parent
+        while parent is not None:
+            depth += 1
+            parent = parent.parent
+
+        self.trace["spans"].append({
+            "timestamp": self.timestamp,
+            "trace_id": self.trace["id"],
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else "",
+            "name": self.name,
+            "depth": depth,
+            "offset_ms": round((self.started - self.trace["started"]) * 1000, 2),
+            "wall_ms": round((finished - self.started) * 1000, 2),
+            "cpu_ms": round((cpu_finished - self.cpu_started) * 1000, 2),
+            "attributes": json.dumps(self.attributes, ensure_ascii=False, default=str) if self.attributes else "",
+        })
+        if self.parent is None:
+            export_spans(self.trace["spans"])
+
+    def set(self, **attributes):
+        """計測中に分かった属性（件数・モデル名など）を追加"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.end()
+        return False
+
+
+class _NoopSpan:
+    def end(self):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_STARTED_SPAN = _NoopSpan()
+_NOOP_SPAN = nullcontext(_NOOP_STARTED_SPAN)
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def span(name, **attributes):
+    """with span("prompt_build"): ... の形で1フェーズを計測（無効時は何もしない）"""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def start_span(name, **attributes):
+    """with文で囲めない範囲（スクリプト全体など）の計測を始める。戻り値の end() で終了"""
+    if not TRACING_ENABLED:
+        return _NOOP_STARTED_SPAN
+    return Span(name, attributes).start()
+
+
+def start_trace(name, **attributes):
+    """スクリプト1回の実行などを新しいトレースの最上位として計測を始める
+
+    前回の実行が st.rerun() 等で途中で終わり、閉じられなかったスパンが残っていれば捨てる。
+    """
+    if not TRACING_ENABLED:
+        return _NOOP_STARTED_SPAN
+    _stack().clear()
+    return Span(name, attributes).start()
+
+
+def traced(name=None):
+    """関数全体を1つのスパンとして計測するデコレーター（無効時は元の関数をそのまま返す）"""
+    def decorator(func):
+        if not TRACING_ENABLED:
+            return func
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(span_name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def export_spans(spans):
+    """1トレース分のスパンをまとめて追記"""
+    try:
+        append_csv_rows(TRACE_FILE, TRACE_FIELDS, spans)
+
+    except Exception as e:
+        print(f"トレース記録エラー: {e}")
+
+
+# ============================================
+# 集計（管理者トレースタブ用）
+# ============================================
+
+def get_trace_spans(include_archived=False):
+    """記録したスパンの取得（include_archived=Trueなら圧縮済みの過去分も含める）"""
+    import pandas as pd
+    from cold_storage import with_archived_rows
+
+    df = pd.read_csv(TRACE_FILE, dtype=_ID_DTYPES) if os.path.exists(TRACE_FILE) else None
+    if include_archived:
+        df = with_archived_rows("trace_spans.csv", df)
+    if df is None:
+        return None
+    df = df.astype(_ID_DTYPES)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+def get_trace_signature():
+    """トレースファイルの更新検知用キー（更新時刻とサイズ）"""
+    return file_signature(TRACE_FILE)
+
+
+_ID_DTYPES = {"trace_id": str, "span_id": str, "parent_id": str}
+
+
+def summarize_spans(df):
+    """フェーズ別の件数・実時間とCPU時間のパーセンタイル"""
+    summary = df.groupby("name").agg(
+        件数=("wall_ms", "size"),
+        実時間p50=("wall_ms", "median"),
+        実時間p95=("wall_ms", lambda s: s.quantile(0.95)),
+        実時間p99=("wall_ms", lambda s: s.quantile(0.99)),
+        CPU時間p50=("cpu_ms", "median"),
+        CPU時間p95=("cpu_ms", lambda s: s.quantile(0.95)),
+        合計実時間=("wall_ms", "sum"),
+        合計CPU時間=("cpu_ms", "sum"),
+    )
+    # CPU時間の割合が低いフェーズはI/O・API待ちが中心
+    summary["CPU比率(%)"] = (summary["合計CPU時間"] / summary["合計実時間"].where(summary["合計実時間"] > 0) * 100).round(1)
+    summary = summary.drop(columns=["合計CPU時間"]).sort_values("合計実時間", ascending=False)
+    return summary.round(1).rename_axis("フェーズ").reset_index()
+
+
+def daily_span_trend(df, percentile=0.95):
+    """日別・フェーズ別の実時間のパーセンタイル（行: 日付、列: フェーズ）"""
+    df = df.assign(date=df["timestamp"].dt.date)
+    return df.groupby(["date", "name"])["wall_ms"].quantile(percentile).unstack("name").round(1)
+
+
+def recent_traces(df, limit=50):
+    """最近のトレース（最上位のスパン）を新しい順に"""
+    roots = df[df["depth"] == 0]
+    return roots.sort_values("timestamp", ascending=False).head(limit)
+
+
+def trace_breakdown(df, trace_id):
+    """1トレースのスパンを開始順に並べたフレームグラフ風の表（名前を深さで字下げ、全体に占める割合つき）"""
+    import pandas as pd
+
+    spans = df[df["trace_id"] == trace_id].sort_values(["offset_ms", "depth"])
+    total = spans["wall_ms"].max() or 1
+    return pd.DataFrame({
+        "フェーズ": spans["depth"].map(lambda depth: "　" * depth) + spans["name"],
+        "開始(ms)": spans["offset_ms"],
+        "実時間(ms)": spans["wall_ms"],
+        "CPU時間(ms)": spans["cpu_ms"],
+        "割合": (spans["wall_ms"] / total).clip(0, 1),
+        "属性": spans["attributes"].fillna(""),
+    }).reset_index(drop=True)
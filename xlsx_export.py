@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import io
+import re
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from amount_normalizer import normalize_values, normalize_metrics, parse_header_unit, build_pattern_comparison
+from result_parser import table_to_dataframe
+
+# ============================================
+# 分析結果のExcel出力（複数シート）
+# ============================================
+
+# シート名に使えない文字と長さの上限
+_INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+MAX_SHEET_NAME_LENGTH = 31
+
+# 「配分額(万円)」の列は万円単位、%は割合（0.3 → 30.0%）として書き出す
+_PERCENT_FORMAT = "0.0%"
+_NUMBER_FORMAT = "#,##0.##"
+
+# 「CPM 500円」のように数値の前に指標名があるセル（数値だけにすると指標名が失われるので文字列のまま出力）
+_METRIC_LABEL_PATTERN = r'^\s*(?:約|~|〜)?\s*[A-Za-z/]+\s*[+-]?\d'
+
+
+def _sheet_name(name, used):
+    """Excelで使えるシート名（重複時は連番を付ける）"""
+    base = _INVALID_SHEET_CHARS.sub("_", name).strip() or "Sheet"
+    base = base[:MAX_SHEET_NAME_LENGTH]
+    candidate = base
+    suffix = 2
+    while candidate in used:
+        tail = f"_{suffix}"
+        candidate = base[:MAX_SHEET_NAME_LENGTH - len(tail)] + tail
+        suffix += 1
+    used.add(candidate)
+    return candidate
+
+
+def _header_cells(worksheet, values):
+    cells = []
+    for value in values:
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.font = Font(bold=True)
+        cells.append(cell)
+    return cells
+
+
+def _numeric_cell(worksheet, value, unit, multiplier):
+    """正規化済みの値をExcelの数値セルに変換（見出しの単位に合わせる）"""
+    if unit == "%":
+        cell = WriteOnlyCell(worksheet, value=value / 100)
+        cell.number_format = _PERCENT_FORMAT
+    else:
+        cell = WriteOnlyCell(worksheet, value=value / multiplier)
+        cell.number_format = _NUMBER_FORMAT
+    return cell
+
+
+def normalize_table_cells(blocks):
+    """全表のセルを1回の正規化でまとめて数値化
+
+    戻り値は id(block) → (DataFrame, 値の配列, 単位の配列, 見出しの倍率の配列)。
+    値は単一の数値として読めるセルのみ（範囲・文字列・指標名つきのセルはNaN）。
+    """
+    tables = []
+    for block in blocks:
+        df = table_to_dataframe(block)
+        if df is not None and not df.empty:
+            tables.append((block, df))
+    if not tables:
+        return {}
+
+    cells = []
+    multipliers = []
+    units = []
+    for _, df in tables:
+        header_units = [parse_header_unit(column) for column in df.columns]
+        cells.append(df.to_numpy(dtype=object).ravel())
+        multipliers.append(np.tile([multiplier for multiplier, _ in header_units], len(df)))
+        units.append(np.tile([unit for _, unit in header_units], len(df)))
+
+    cell_texts = pd.Series(np.concatenate(cells))
+    normalized = normalize_values(
+        cell_texts,
+        header_multipliers=pd.Series(np.concatenate(multipliers)),
+        header_units=pd.Series(np.concatenate(units))
+    )
+    labeled = cell_texts.astype("string").str.normalize("NFKC").str.contains(_METRIC_LABEL_PATTERN, na=False)
+    single = normalized["min"].where((normalized["min"] == normalized["max"]) & ~labeled).to_numpy(dtype=float, na_value=np.nan)
+    unit_values = normalized["unit"].to_numpy()
+    multiplier_values = np.concatenate(multipliers)
+
+    result = {}
+    offset = 0
+    for block, df in tables:
+        shape = df.shape
+        size = shape[0] * shape[1]
+        result[id(block)] = (
+            df,
+            single[offset:offset + size].reshape(shape),
+            unit_values[offset:offset + size].reshape(shape),
+            multiplier_values[offset:offset + size].reshape(shape),
+        )
+        offset += size
+    return result
+
+
+def _table_rows(worksheet, table):
+    """表を行のリストに変換（単一値のセルは数値、範囲・文字列はそのまま）"""
+    df, values, units, multipliers = table
+    texts = df.to_numpy(dtype=object)
+    rows = [_header_cells(worksheet, [str(column) for column in df.columns])]
+    for row_index in range(texts.shape[0]):
+        row = []
+        for column_index in range(texts.shape[1]):
+            value = values[row_index, column_index]
+            if np.isnan(value):
+                row.append(texts[row_index, column_index])
+            else:
+                row.append(_numeric_cell(
+                    worksheet,
+                    float(value),
+                    units[row_index, column_index],
+                    multipliers[row_index, column_index]
+                ))
+        rows.append(row)
+    return rows
+
+
+def _metric_rows(worksheet, block):
+    """「**総予算**: 50,000万円」のメトリクスを (名前, 元の表記, 数値) の行に変換"""
+    numeric = normalize_metrics(block["values"])
+    rows = []
+    for name, text in block["values"].items():
+        value = numeric.get(name)
+        rows.append([name, text, value if value is not None else ""])
+    return rows
+
+
+def _write_section_blocks(worksheet, blocks, tables):
+    """見出し・表・メトリクス・本文を上から順に書き出す"""
+    for block in blocks:
+        if block["type"] == "heading":
+            worksheet.append(_header_cells(worksheet, [block["text"]]))
+        elif block["type"] == "table":
+            if id(block) not in tables:
+                continue
+            for row in _table_rows(worksheet, tables[id(block)]):
+                worksheet.append(row)
+            worksheet.append([])
+        elif block["type"] == "metrics":
+            worksheet.append(_header_cells(worksheet, ["指標", "表記", "数値(円・本・%)"]))
+            for row in _metric_rows(worksheet, block):
+                worksheet.append(row)
+            worksheet.append([])
+        else:
+            for line in block["text"].split("\n"):
+                worksheet.append([line])
+
+
+def _split_patterns(section):
+    """配分案セクションを ### 見出しごとのブロック列に分ける"""
+    patterns = []
+    current = None
+    for block in section["blocks"]:
+        if block["type"] == "heading":
+            current = {"title": block["text"], "blocks": []}
+            patterns.append(current)
+        elif current is not None:
+            current["blocks"].append(block)
+    return patterns
+
+
+def _write_input_summary(workbook, used, inputs):
+    worksheet = workbook.create_sheet(_sheet_name("入力サマリー", used))
+    worksheet.append(_header_cells(worksheet, ["項目", "内容"]))
+    worksheet.append(["プロジェクト名", inputs["project_name"]])
+    worksheet.append(["ジャンル", inputs["project_genre"]])
+    worksheet.append(["ローンチ予定日", inputs["launch_date"]])
+    worksheet.append(["目標販売本数", inputs["target_sales"]])
+    worksheet.append(["総マーケティング予算(万円)", inputs["total_marketing_budget"]])
+    worksheet.append(["キャンペーン期間", inputs["campaign_period"]])
+    worksheet.append(["ターゲット市場", inputs["target_market"]])
+    worksheet.append(["最適化重点", inputs["optimization_focus"]])
+    worksheet.append([])
+    worksheet.append(_header_cells(worksheet, ["選択された施策"]))
+    for tactic in inputs["selected_tactics"]:
+        worksheet.append([tactic])
+    for label, key in [("必須の制約条件", "constraints"), ("その他の考慮事項", "additional_context")]:
+        if inputs.get(key):
+            worksheet.append([])
+            worksheet.append(_header_cells(worksheet, [label]))
+            for line in inputs[key].split("\n"):
+                worksheet.append([line])
+
+
+def _write_validation(workbook, used, result_tree, allocation_section, total_marketing_budget, tables):
+    """パターン比較（配分合計と総予算の差異）と妥当性検証セクション"""
+    validation_section = next((sec for sec in result_tree if sec["title"].startswith("3.")), None)
+    if allocation_section is None and validation_section is None:
+        return
+
+    worksheet = workbook.create_sheet(_sheet_name("検証", used))
+    if allocation_section is not None:
+        summary, _ = build_pattern_comparison(allocation_section, total_marketing_budget)
+        if not summary.empty:
+            worksheet.append(_header_cells(worksheet, ["パターン比較"]))
+            worksheet.append(_header_cells(worksheet, list(summary.columns)))
+            for record in summary.itertuples(index=False):
+                worksheet.append([None if pd.isna(value) else value for value in record])
+            worksheet.append([])
+
+    if validation_section is not None:
+        worksheet.append(_header_cells(worksheet, [validation_section["title"]]))
+        _write_section_blocks(worksheet, validation_section["blocks"], tables)
+
+
+def build_result_workbook(analysis):
+    """分析結果（session_stateに保存した辞書）を複数シートのExcelブックに変換してバイト列で返す
+
+    シート: 入力サマリー / パターンごとの配分表 / 検証 / その他の各セクション
+    """
+    result_tree = analysis["tree"]
+    inputs = analysis["inputs"]
+
+    # 書き込み専用モード: 行を順に書き出すだけでセルをメモリに保持しない
+    workbook = Workbook(write_only=True)
+    used = set()
+
+    tables = normalize_table_cells(block for section in result_tree for block in section["blocks"] if block["type"] == "table")
+
+    _write_input_summary(workbook, used, inputs)
+
+    allocation_section = next((sec for sec in result_tree if sec["title"].startswith("2.")), None)
+    if allocation_section is not None:
+        for pattern in _split_patterns(allocation_section):
+            name = pattern["title"].split(":")[0].split("：")[0].strip()
+            worksheet = workbook.create_sheet(_sheet_name(name, used))
+            worksheet.append(_header_cells(worksheet, [pattern["title"]]))
+            _write_section_blocks(worksheet, pattern["blocks"], tables)
+
+    _write_validation(workbook, used, result_tree, allocation_section, inputs["total_marketing_budget"], tables)
+
+    for section in result_tree:
+        if section is allocation_section or section["title"].startswith("3."):
+            continue
+        worksheet = workbook.create_sheet(_sheet_name(section["title"], used))
+        worksheet.append(_header_cells(worksheet, [section["title"]]))
+        _write_section_blocks(worksheet, section["blocks"], tables)
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()